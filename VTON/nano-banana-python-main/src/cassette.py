@@ -0,0 +1,170 @@
+"""Record and replay of Gemini API calls ("cassettes").
+
+A CassetteClient stands in for ``genai.Client``. In "record" mode it calls the
+API and stores every response as a JSON file in the cassette directory; in
+"replay" mode it answers from those files without network access and raises
+CassetteMissing for requests that were never recorded. Files are named after
+a hash of the method, model, contents and config.
+
+Replays can simulate upstream behaviour with a latency before the first
+chunk, a delay between chunks and re-chunking into at most ``chunk_parts``
+parts per chunk.
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Any, Iterator
+
+from google.genai import types
+
+RECORD = "record"
+REPLAY = "replay"
+CASSETTE_MODES = (RECORD, REPLAY)
+
+
+class CassetteMissing(Exception):
+    """Raised in replay mode for a request that has no recording."""
+
+
+def _jsonable(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    return value
+
+
+def request_key(method: str, model: str, contents: Any, config: Any = None) -> str:
+    """Returns the name of the recording for a request."""
+    payload = json.dumps(
+        [method, model, _jsonable(contents), _jsonable(config)],
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Cassette:
+    """A directory of recorded interactions."""
+
+    def __init__(
+        self,
+        directory: str,
+        latency: float = 0,
+        chunk_delay: float = 0,
+        chunk_parts: int | None = None,
+    ):
+        self.directory = directory
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_parts = chunk_parts
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def save(self, key: str, method: str, model: str, responses: list) -> None:
+        """Stores the responses of one interaction."""
+        os.makedirs(self.directory, exist_ok=True)
+        data = {
+            "method": method,
+            "model": model,
+            "responses": [_jsonable(response) for response in responses],
+        }
+        tmp_path = f"{self._path(key)}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path(key))
+
+    def load(self, key: str) -> list[types.GenerateContentResponse]:
+        """Returns the recorded responses of an interaction."""
+        try:
+            with open(self._path(key)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise CassetteMissing(
+                f"No recorded response for request {key} in {self.directory}; "
+                "record it with --cassette-mode record"
+            )
+        return [
+            types.GenerateContentResponse.model_validate(response)
+            for response in data["responses"]
+        ]
+
+    def replay_stream(
+        self, responses: list[types.GenerateContentResponse]
+    ) -> Iterator[types.GenerateContentResponse]:
+        """Yields recorded stream chunks with the configured latency and chunking."""
+        if self.chunk_parts:
+            responses = list(_rechunk(responses, self.chunk_parts))
+        for index, response in enumerate(responses):
+            delay = self.latency if index == 0 else self.chunk_delay
+            if delay:
+                time.sleep(delay)
+            yield response
+
+
+def _rechunk(
+    responses: list[types.GenerateContentResponse], chunk_parts: int
+) -> Iterator[types.GenerateContentResponse]:
+    """Splits the parts of every response across chunks of at most ``chunk_parts`` parts."""
+    for response in responses:
+        candidates = response.candidates
+        if (
+            not candidates
+            or candidates[0].content is None
+            or not candidates[0].content.parts
+        ):
+            yield response
+            continue
+        parts = candidates[0].content.parts
+        for start in range(0, len(parts), chunk_parts):
+            chunk = response.model_copy(deep=True)
+            chunk.candidates[0].content.parts = parts[start : start + chunk_parts]
+            yield chunk
+
+
+class _CassetteModels:
+    def __init__(self, models: Any, cassette: Cassette, mode: str):
+        self._models = models
+        self._cassette = cassette
+        self._mode = mode
+
+    def generate_content(self, *, model: str, contents: Any, config: Any = None, **kwargs):
+        key = request_key("generate_content", model, contents, config)
+        if self._mode == REPLAY:
+            return self._cassette.load(key)[0]
+        response = self._models.generate_content(
+            model=model, contents=contents, config=config, **kwargs
+        )
+        self._cassette.save(key, "generate_content", model, [response])
+        return response
+
+    def generate_content_stream(
+        self, *, model: str, contents: Any, config: Any = None, **kwargs
+    ) -> Iterator[types.GenerateContentResponse]:
+        key = request_key("generate_content_stream", model, contents, config)
+        if self._mode == REPLAY:
+            # Loaded lazily, like the real stream, which sends the request on first read
+            yield from self._cassette.replay_stream(self._cassette.load(key))
+            return
+        responses = []
+        for response in self._models.generate_content_stream(
+            model=model, contents=contents, config=config, **kwargs
+        ):
+            responses.append(response)
+            yield response
+        self._cassette.save(key, "generate_content_stream", model, responses)
+
+
+class CassetteClient:
+    """Stands in for a genai.Client; ``client`` may be None in replay mode."""
+
+    def __init__(self, client: Any, cassette: Cassette, mode: str):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Cassette mode must be one of: {', '.join(CASSETTE_MODES)}")
+        self._client = client
+        self.models = _CassetteModels(client.models if client else None, cassette, mode)
@@ -0,0 +1,163 @@
+"""Batch runs of many remix jobs listed in a manifest file.
+
+A manifest is JSONL (one object per line) or CSV (with a header row). Every
+job has
+- ``images``: 1-5 image paths, a list in JSONL or ``;``-separated in CSV,
+- ``prompt`` (optional): defaults to the CLI's ``--prompt``, else like a
+  single CLI run,
+- ``id`` (optional): names the job's output directory; derived from the
+  images and prompt when missing.
+
+Relative image paths are resolved against the manifest's directory. Jobs run
+on a thread pool sharing one client, limiter and cache. Each job writes its
+images to ``<output_dir>/<id>/`` and appends one line to the results log as
+soon as it finishes, so an interrupted run can be resumed by skipping the
+jobs already logged as done.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+SINGLE_IMAGE_PROMPT = "Turn this image into a professional quality studio shoot with better lighting and depth of field."
+MULTI_IMAGE_PROMPT = "Combine the subjects of these images in a natural way, producing a new image."
+
+
+def default_prompt(num_images: int) -> str:
+    """Returns the prompt used when none is given."""
+    return SINGLE_IMAGE_PROMPT if num_images == 1 else MULTI_IMAGE_PROMPT
+
+
+@dataclass
+class ManifestJob:
+    id: str
+    image_paths: list[str]
+    prompt: str
+
+
+def load_manifest(path: str, prompt: str | None = None) -> list[ManifestJob]:
+    """Reads the jobs of a JSONL or CSV manifest; ``prompt`` is the default prompt."""
+    base_dir = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = list(csv.DictReader(f))
+            for row in rows:
+                row["images"] = [p.strip() for p in row.get("images", "").split(";") if p.strip()]
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+
+    jobs = []
+    seen = set()
+    for line_number, row in enumerate(rows, start=1):
+        images = row.get("images") or []
+        if isinstance(images, str):
+            images = [images]
+        image_paths = [os.path.join(base_dir, p) for p in images]
+        if not 1 <= len(image_paths) <= 5:
+            raise ValueError(f"{path}: job {line_number} must list between 1 and 5 images")
+        job_prompt = row.get("prompt") or prompt or default_prompt(len(image_paths))
+        job_id = str(row.get("id") or _derive_id(images, job_prompt))
+        if job_id in seen:
+            raise ValueError(f"{path}: duplicate job id {job_id!r}")
+        seen.add(job_id)
+        jobs.append(ManifestJob(id=job_id, image_paths=image_paths, prompt=job_prompt))
+    return jobs
+
+
+def _derive_id(images: list[str], prompt: str) -> str:
+    payload = json.dumps([images, prompt])
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def completed_job_ids(results_log: str) -> set[str]:
+    """Returns the ids of the jobs logged as done in an earlier run."""
+    done = set()
+    if not os.path.exists(results_log):
+        return done
+    with open(results_log) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run
+                continue
+            if entry.get("status") == "done":
+                done.add(entry["id"])
+    return done
+
+
+class ResultsLog:
+    """Thread-safe, line-buffered JSONL log of finished jobs."""
+
+    def __init__(self, path: str):
+        cut_short = False
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                cut_short = f.read(1) != b"\n"
+        self._file = open(path, "a")
+        self._lock = threading.Lock()
+        if cut_short:
+            # Start on a new line after the one an interrupted run left unfinished
+            self._file.write("\n")
+
+    def write(self, entry: dict):
+        with self._lock:
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run_manifest(
+    jobs: list[ManifestJob],
+    remix: Callable[[list[str], str, str], list[str]],
+    output_dir: str,
+    results_log: str,
+    workers: int = 4,
+    resume: bool = False,
+) -> dict[str, int]:
+    """Runs ``remix(image_paths, prompt, job_output_dir)`` for every job.
+
+    Returns how many jobs were done, failed and skipped.
+    """
+    skip = completed_job_ids(results_log) if resume else set()
+    pending = [job for job in jobs if job.id not in skip]
+    counts = {"done": 0, "failed": 0, "skipped": len(jobs) - len(pending)}
+    counts_lock = threading.Lock()
+    log = ResultsLog(results_log)
+
+    def run(job: ManifestJob):
+        job_output_dir = os.path.join(output_dir, job.id)
+        os.makedirs(job_output_dir, exist_ok=True)
+        start = time.perf_counter()
+        entry = {"id": job.id, "images": job.image_paths, "prompt": job.prompt}
+        try:
+            entry["outputs"] = remix(job.image_paths, job.prompt, job_output_dir)
+            entry["status"] = "done"
+        except Exception as e:
+            traceback.print_exc()
+            entry["status"] = "failed"
+            entry["error"] = str(e)
+        entry["seconds"] = round(time.perf_counter() - start, 3)
+        log.write(entry)
+        with counts_lock:
+            counts[entry["status"]] += 1
+            finished = counts["done"] + counts["failed"]
+        print(f"[{finished}/{len(pending)}] {job.id}: {entry['status']}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Consume the results so that bugs in run() itself are not swallowed
+            list(pool.map(run, pending))
+    finally:
+        log.close()
+    return counts
@@ -1,10 +1,18 @@
 import argparse
+import itertools
 import mimetypes
 import os
 import time
+from concurrent.futures import Future
 from google import genai
 from google.genai import types
 
+from cassette import CASSETTE_MODES, REPLAY, Cassette, CassetteClient
+from manifest import default_prompt, load_manifest, run_manifest
+from result_cache import ResultCache, digest, make_key
+from upstream import UpstreamLimiter
+from writer import OUTPUT_FORMATS, ImageWriter, check_output_format
+
 MODEL_NAME = "gemini-2.5-flash-image-preview"
 
 
@@ -12,7 +20,12 @@ def remix_images(
     image_paths: list[str],
     prompt: str,
     output_dir: str,
-):
+    cache: ResultCache | None = None,
+    limiter: UpstreamLimiter | None = None,
+    client: genai.Client | CassetteClient | None = None,
+    model: str = MODEL_NAME,
+    writer: ImageWriter | None = None,
+) -> list[str]:
     """
     Remixes two images using the Google Generative AI model.
 
@@ -20,14 +33,53 @@ def remix_images(
         image_paths: A list of two paths to input images.
         prompt: The prompt for remixing the images.
         output_dir: Directory to save the remixed images.
+        cache: Optional result cache consulted before calling the API.
+        limiter: Optional limiter applying rate limits and retries to the API call.
+        client: Optional client to use, e.g. a CassetteClient; by default one
+            is created from the GEMINI_API_KEY environment variable.
+        model: The image model to use.
+        writer: Optional background writer saving the images; by default a
+            private one is used.
+
+    Returns:
+        The paths of the saved images.
     """
     api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
+    if client is None and not api_key:
         raise ValueError("GEMINI_API_KEY environment variable not set.")
 
-    client = genai.Client(api_key=api_key)
+    if writer is None:
+        writer = ImageWriter()
+        try:
+            return remix_images(
+                image_paths,
+                prompt,
+                output_dir,
+                cache=cache,
+                limiter=limiter,
+                client=client,
+                model=model,
+                writer=writer,
+            )
+        finally:
+            writer.close()
 
+    started_at = time.perf_counter()
     contents = _load_image_parts(image_paths)
+
+    cache_key = None
+    if cache is not None:
+        cache_key = make_key(
+            [digest(part.inline_data.data) for part in contents], prompt, model
+        )
+        cached_images = cache.get(cache_key)
+        if cached_images is not None:
+            print(f"Serving {len(cached_images)} cached image(s) for prompt: {prompt}")
+            return _save_images(cached_images, output_dir, writer, started_at)
+
+    if client is None:
+        client = genai.Client(api_key=api_key)
+
     contents.append(genai.types.Part.from_text(text=prompt))
 
     generate_content_config = types.GenerateContentConfig(
@@ -36,13 +88,40 @@ def remix_images(
 
     print(f"Remixing with {len(image_paths)} images and prompt: {prompt}")
 
+    if limiter is None:
+        limiter = UpstreamLimiter()
+    stream = limiter.call(_open_stream, client, model, contents, generate_content_config)
+
+    images, pending_files = _process_api_stream_response(
+        stream, output_dir, writer, started_at
+    )
+    if cache is not None:
+        cache.set(cache_key, images)
+    return [pending.result() for pending in pending_files]
+
+
+def _open_stream(
+    client: genai.Client | CassetteClient,
+    model: str,
+    contents: list,
+    config: types.GenerateContentConfig,
+):
+    """Starts a streaming generation and waits for its first chunk.
+
+    The request is only sent when the stream is first read, so reading one
+    chunk here lets rate-limit and server errors surface while the call can
+    still be retried. Errors later in the stream are not retried, as some
+    images may already have been saved.
+    """
     stream = client.models.generate_content_stream(
-        model=MODEL_NAME,
+        model=model,
         contents=contents,
-        config=generate_content_config,
+        config=config,
     )
-
-    _process_api_stream_response(stream, output_dir)
+    first_chunk = next(stream, None)
+    if first_chunk is None:
+        return iter(())
+    return itertools.chain([first_chunk], stream)
 
 
 def _load_image_parts(image_paths: list[str]) -> list[types.Part]:
@@ -58,9 +137,16 @@ def _load_image_parts(image_paths: list[str]) -> list[types.Part]:
     return parts
 
 
-def _process_api_stream_response(stream, output_dir: str):
-    """Processes the streaming response from the GenAI API, saving images and printing text."""
-    file_index = 0
+def _process_api_stream_response(
+    stream, output_dir: str, writer: ImageWriter, started_at: float
+) -> tuple[list[bytes], list[Future]]:
+    """Processes the streaming response from the GenAI API, saving images and printing text.
+
+    Images are handed to ``writer`` as soon as their part arrives. Returns the
+    data of every image and the futures of their file names.
+    """
+    images = []
+    pending_files = []
     for chunk in stream:
         if (
             chunk.candidates is None
@@ -71,23 +157,40 @@ def _process_api_stream_response(stream, output_dir: str):
 
         for part in chunk.candidates[0].content.parts:
             if part.inline_data and part.inline_data.data:
-                timestamp = int(time.time())
-                file_extension = mimetypes.guess_extension(part.inline_data.mime_type)
-                file_name = os.path.join(
-                    output_dir,
-                    f"remixed_image_{timestamp}_{file_index}{file_extension}",
+                images.append(part.inline_data.data)
+                pending_files.append(
+                    writer.submit(
+                        part.inline_data.data,
+                        part.inline_data.mime_type,
+                        output_dir,
+                        started_at,
+                    )
                 )
-                _save_binary_file(file_name, part.inline_data.data)
-                file_index += 1
             elif part.text:
                 print(part.text)
+    return images, pending_files
+
 
+def _save_images(
+    images: list[bytes], output_dir: str, writer: ImageWriter, started_at: float
+) -> list[str]:
+    """Saves previously generated images, naming them like fresh API output."""
+    pending_files = [
+        writer.submit(data, _sniff_mime_type(data), output_dir, started_at)
+        for data in images
+    ]
+    return [pending.result() for pending in pending_files]
 
-def _save_binary_file(file_name: str, data: bytes):
-    """Saves binary data to a specified file."""
-    with open(file_name, "wb") as f:
-        f.write(data)
-    print(f"File saved to: {file_name}")
+
+def _sniff_mime_type(data: bytes) -> str:
+    """Identifies common image formats from their leading bytes."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
 
 
 def _get_mime_type(file_path: str) -> str:
@@ -106,47 +209,224 @@ def main():
         "-i",
         "--image",
         action="append",
-        required=True,
         help="Paths to input images (1-5 images). Provide multiple -i flags for multiple images.",
     )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="JSONL or CSV file listing many jobs to run instead of a single -i run.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=4,
+        help="Number of manifest jobs to run in parallel.",
+    )
+    parser.add_argument(
+        "--results-log",
+        type=str,
+        help="JSONL log of finished manifest jobs (default: <output-dir>/results.jsonl).",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip manifest jobs the results log already records as done.",
+    )
     parser.add_argument(
         "--prompt",
         type=str,
         help="Optional prompt for remixing the images.",
     )
+    parser.add_argument(
+        "--model",
+        type=str,
+        default=MODEL_NAME,
+        help=f"Image model to use (default: {MODEL_NAME}).",
+    )
     parser.add_argument(
         "--output-dir",
         type=str,
         default="output",
         help="Directory to save the remixed images.",
     )
+    parser.add_argument(
+        "--output-format",
+        choices=OUTPUT_FORMATS,
+        help="Convert the generated images to this format before saving (requires Pillow).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="Optional directory for caching results of identical requests.",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=512,
+        help="Maximum size of the result cache in megabytes.",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="How many times to retry rate-limited or failed API calls.",
+    )
+    parser.add_argument(
+        "--requests-per-minute",
+        type=float,
+        default=60,
+        help="Maximum rate of API calls.",
+    )
+    parser.add_argument(
+        "--cassette-mode",
+        choices=CASSETTE_MODES,
+        help="Record API responses to --cassette-dir, or replay them from it without network access.",
+    )
+    parser.add_argument(
+        "--cassette-dir",
+        type=str,
+        default="cassettes",
+        help="Directory holding recorded API responses.",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        type=float,
+        default=0,
+        help="Seconds to wait before the first replayed chunk.",
+    )
+    parser.add_argument(
+        "--replay-chunk-delay",
+        type=float,
+        default=0,
+        help="Seconds to wait between replayed chunks.",
+    )
+    parser.add_argument(
+        "--replay-chunk-parts",
+        type=int,
+        help="Replay streamed responses in chunks of at most this many parts.",
+    )
 
     args = parser.parse_args()
 
-    all_image_paths = args.image
+    if args.manifest:
+        if args.image:
+            parser.error("Use either --manifest or -i, not both.")
+        try:
+            manifest_jobs = load_manifest(args.manifest, prompt=args.prompt)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+    else:
+        all_image_paths = args.image or []
+
+        num_images = len(all_image_paths)
+        if not (1 <= num_images <= 5):
+            parser.error("Please provide between 1 and 5 input images using the -i flag.")
 
-    num_images = len(all_image_paths)
-    if not (1 <= num_images <= 5):
-        parser.error("Please provide between 1 and 5 input images using the -i flag.")
+        # Determine the prompt
+        final_prompt = args.prompt
+        if final_prompt is None:
+            final_prompt = default_prompt(num_images)
 
-    # Determine the prompt
-    final_prompt = args.prompt
-    if final_prompt is None:
-        if num_images == 1:
-            final_prompt = "Turn this image into a professional quality studio shoot with better lighting and depth of field."
-        else:
-            final_prompt = "Combine the subjects of these images in a natural way, producing a new image."
+    try:
+        check_output_format(args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
 
     # Ensure output directory exists
     output_dir = args.output_dir
     os.makedirs(output_dir, exist_ok=True)
 
-    remix_images(
-        image_paths=all_image_paths,
-        prompt=final_prompt,
-        output_dir=output_dir,
+    cache = None
+    if args.cache_dir:
+        cache = ResultCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+    limiter = UpstreamLimiter(
+        max_concurrency=max(1, args.jobs) if args.manifest else 1,
+        requests_per_minute=args.requests_per_minute,
+        retry_attempts=args.retries + 1,
     )
 
+    client = None
+    if args.cassette_mode:
+        cassette = Cassette(
+            args.cassette_dir,
+            latency=args.replay_latency,
+            chunk_delay=args.replay_chunk_delay,
+            chunk_parts=args.replay_chunk_parts,
+        )
+        real_client = None
+        if args.cassette_mode != REPLAY:
+            api_key = os.environ.get("GEMINI_API_KEY")
+            if not api_key:
+                parser.error("GEMINI_API_KEY environment variable not set.")
+            real_client = genai.Client(api_key=api_key)
+        client = CassetteClient(real_client, cassette, args.cassette_mode)
+
+    writer = ImageWriter(args.output_format)
+    failed = False
+    if args.manifest:
+        if client is None:
+            api_key = os.environ.get("GEMINI_API_KEY")
+            if not api_key:
+                parser.error("GEMINI_API_KEY environment variable not set.")
+            # One client, and so one connection pool, for all workers
+            client = genai.Client(api_key=api_key)
+
+        def remix(image_paths: list[str], prompt: str, job_output_dir: str) -> list[str]:
+            return remix_images(
+                image_paths=image_paths,
+                prompt=prompt,
+                output_dir=job_output_dir,
+                cache=cache,
+                limiter=limiter,
+                client=client,
+                model=args.model,
+                writer=writer,
+            )
+
+        counts = run_manifest(
+            manifest_jobs,
+            remix,
+            output_dir,
+            args.results_log or os.path.join(output_dir, "results.jsonl"),
+            workers=max(1, args.jobs),
+            resume=args.resume,
+        )
+        print(
+            f"Manifest: {counts['done']} done, {counts['failed']} failed, "
+            f"{counts['skipped']} skipped"
+        )
+        failed = counts["failed"] > 0
+    else:
+        remix_images(
+            image_paths=all_image_paths,
+            prompt=final_prompt,
+            output_dir=output_dir,
+            cache=cache,
+            limiter=limiter,
+            client=client,
+            model=args.model,
+            writer=writer,
+        )
+
+    writer.close()
+    print(writer.summary())
+
+    limiter_stats = limiter.stats()
+    if limiter_stats["retries"]:
+        print(
+            f"API: {limiter_stats['attempts']} attempt(s), "
+            f"{limiter_stats['retries']} retr(ies)"
+        )
+
+    if cache is not None:
+        stats = cache.stats()
+        print(f"Cache: {stats['hits']} hit(s), {stats['misses']} miss(es)")
+
+    if failed:
+        # Let scripts notice; rerun with --resume to retry only the failed jobs
+        raise SystemExit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,154 @@
+"""
+Content-addressed cache of virtual try-on results.
+
+Results are keyed on a hash of the input image bytes, the prompt and the
+model name, so remixing the same images with the same prompt again is served
+from disk instead of running a new upstream generation.  The cache is
+bounded in bytes and evicts the least recently used entries first.
+
+Each entry is a directory ``<root>/<key[:2]>/<key>/`` holding one file per
+generated image.  Entries are written to a temporary directory and renamed
+into place, so readers in other processes never see half-written entries.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def digest(data: bytes) -> str:
+    """Returns the hex sha256 digest of a bytes-like object."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(image_digests: list[str], prompt: str, model_name: str) -> str:
+    """Builds the cache key for a generation from per-image digests."""
+    h = hashlib.sha256()
+    for value in (model_name, prompt, *image_digests):
+        h.update(value.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of generated images stored on disk.
+
+    Args:
+        directory: Root directory of the cache.
+        max_bytes: Total size the cache may use before evicting entries.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = None  # key -> size in bytes, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> list[bytes] | None:
+        """Returns the cached list of images for ``key`` or None."""
+        path = self._entry_path(key)
+        try:
+            names = sorted(os.listdir(path), key=lambda name: int(name.split(".")[0]))
+            images = []
+            for name in names:
+                with open(os.path.join(path, name), "rb") as f:
+                    images.append(f.read())
+        except (OSError, ValueError):
+            images = None
+
+        with self._lock:
+            self._load_index()
+            if not images:
+                self.misses += 1
+                if key in self._entries:
+                    self._size -= self._entries.pop(key)
+                return None
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # Written by another process since our index was built
+                self._entries[key] = sum(len(image) for image in images)
+                self._size += self._entries[key]
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return images
+
+    def set(self, key: str, images: list[bytes]):
+        """Stores ``images`` under ``key`` and evicts old entries if needed."""
+        size = sum(len(image) for image in images)
+        if not images or size > self.max_bytes:
+            return
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            for index, image in enumerate(images):
+                with open(os.path.join(temp_path, f"{index}.bin"), "wb") as f:
+                    f.write(image)
+            os.rename(temp_path, path)
+        except OSError:
+            # Most likely another request stored the same entry first
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+        with self._lock:
+            self._load_index()
+            if key in self._entries:
+                self._size -= self._entries.pop(key)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_index(self):
+        """Builds the LRU index from the entries already on disk (lock held)."""
+        if self._entries is not None:
+            return
+        found = []
+        os.makedirs(self.directory, exist_ok=True)
+        for prefix in os.listdir(self.directory):
+            prefix_path = os.path.join(self.directory, prefix)
+            if prefix.startswith(".") or not os.path.isdir(prefix_path):
+                continue
+            for key in os.listdir(prefix_path):
+                path = os.path.join(prefix_path, key)
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(path))
+                    found.append((os.stat(path).st_mtime, key, size))
+                except OSError:
+                    continue
+        found.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in found)
+        self._size = sum(size for _, _, size in found)
+        self._evict()
+
+    def _evict(self):
+        """Removes least recently used entries until the cache fits (lock held)."""
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
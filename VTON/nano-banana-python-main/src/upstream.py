@@ -0,0 +1,114 @@
+"""Client-side limits for calls to the Gemini API.
+
+UpstreamLimiter caps the calls in flight, spends a token from a token bucket
+per call and retries rate-limit and transient server/network errors with
+jittered exponential backoff. Queue wait time and retry counts are kept in
+``stats()``.
+"""
+
+import threading
+import time
+from typing import Any, Callable, TypeVar
+
+import httpx
+from google.genai import errors
+from tenacity import (
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+T = TypeVar("T")
+
+# HTTP status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Tells whether a failed API call is worth retrying."""
+    if isinstance(exc, errors.APIError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, httpx.TransportError)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at ``rate`` tokens per second."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes one token, waiting for it if the bucket is empty."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class UpstreamLimiter:
+    """Concurrency limit, rate limit and retry policy shared by API calls."""
+
+    def __init__(
+        self,
+        max_concurrency: int = 4,
+        requests_per_minute: float = 60,
+        burst: float = 10,
+        retry_attempts: int = 4,
+        retry_max_wait: float = 20,
+    ):
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.retry_attempts = retry_attempts
+        self.retry_max_wait = retry_max_wait
+        self._lock = threading.Lock()
+        self._attempts = 0
+        self._retries = 0
+        self._queue_wait = 0.0
+
+    def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Calls ``func(*args, **kwargs)`` within the limits, retrying transient errors."""
+        retrying = Retrying(
+            stop=stop_after_attempt(self.retry_attempts),
+            wait=wait_random_exponential(multiplier=1, max=self.retry_max_wait),
+            retry=retry_if_exception(is_retryable),
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )
+        return retrying(self._call_once, func, args, kwargs)
+
+    def stats(self) -> dict[str, float]:
+        """Returns attempt and retry counts and the total time spent queued."""
+        with self._lock:
+            return {
+                "attempts": self._attempts,
+                "retries": self._retries,
+                "queue_wait_seconds": self._queue_wait,
+            }
+
+    def _call_once(self, func: Callable[..., T], args: tuple, kwargs: dict) -> T:
+        start = time.perf_counter()
+        with self._semaphore:
+            self._bucket.acquire()
+            with self._lock:
+                self._attempts += 1
+                self._queue_wait += time.perf_counter() - start
+            return func(*args, **kwargs)
+
+    def _before_sleep(self, retry_state) -> None:
+        exc = retry_state.outcome.exception()
+        print(f"Retrying after error: {exc}")
+        with self._lock:
+            self._retries += 1
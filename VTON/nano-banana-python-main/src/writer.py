@@ -0,0 +1,137 @@
+"""Background writing of generated images.
+
+ImageWriter takes finished image parts from the stream consumer and writes
+them on its own thread, so reading the API stream never waits on disk.
+Files are named after a hash of their content, so images never overwrite
+each other however close together they are produced. They can optionally be
+converted to WebP or PNG on the way (requires Pillow).
+"""
+
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from io import BytesIO
+
+OUTPUT_FORMATS = ("webp", "png")
+
+# How many images the summary lists one by one
+SUMMARY_MAX_LINES = 50
+
+
+@dataclass
+class WrittenImage:
+    file_name: str
+    bytes_in: int
+    bytes_out: int
+    # Seconds from the start of the request until the image arrived
+    arrived_after: float
+    write_seconds: float
+
+
+def check_output_format(output_format: str | None) -> None:
+    """Raises ValueError if ``output_format`` cannot be produced here."""
+    if output_format is None:
+        return
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Output format must be one of: {', '.join(OUTPUT_FORMATS)}")
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise ValueError(
+            "Converting images requires Pillow; install it with `uv pip install pillow`"
+        )
+
+
+class ImageWriter:
+    """Writes images on a background thread and keeps statistics about them."""
+
+    def __init__(self, output_format: str | None = None):
+        check_output_format(output_format)
+        self.output_format = output_format
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-writer")
+        self._lock = threading.Lock()
+        self.written: list[WrittenImage] = []
+
+    def submit(
+        self, data: bytes, mime_type: str | None, output_dir: str, started_at: float
+    ) -> Future:
+        """Queues an image for writing; the future resolves to its file name.
+
+        ``started_at`` is the time.perf_counter() value of the request start.
+        """
+        arrived_after = time.perf_counter() - started_at
+        return self._executor.submit(self._write, data, mime_type, output_dir, arrived_after)
+
+    def _write(
+        self, data: bytes, mime_type: str | None, output_dir: str, arrived_after: float
+    ) -> str:
+        start = time.perf_counter()
+        output = data
+        if self.output_format is not None:
+            output = _convert(data, self.output_format)
+            file_extension = f".{self.output_format}"
+        else:
+            file_extension = mimetypes.guess_extension(mime_type or "") or ".bin"
+        content_hash = hashlib.sha256(output).hexdigest()[:16]
+        file_name = os.path.join(output_dir, f"remixed_image_{content_hash}{file_extension}")
+
+        tmp_name = f"{file_name}.tmp{threading.get_ident()}"
+        with open(tmp_name, "wb") as f:
+            f.write(output)
+        os.replace(tmp_name, file_name)
+        print(f"File saved to: {file_name}")
+
+        with self._lock:
+            self.written.append(
+                WrittenImage(
+                    file_name=file_name,
+                    bytes_in=len(data),
+                    bytes_out=len(output),
+                    arrived_after=arrived_after,
+                    write_seconds=time.perf_counter() - start,
+                )
+            )
+        return file_name
+
+    def close(self) -> None:
+        """Waits for all queued images to be written."""
+        self._executor.shutdown(wait=True)
+
+    def summary(self) -> str:
+        """Describes the written images: sizes and timings."""
+        with self._lock:
+            written = list(self.written)
+        if not written:
+            return "No images written."
+        lines = []
+        if len(written) <= SUMMARY_MAX_LINES:
+            for image in written:
+                lines.append(
+                    f"  {image.file_name}: {image.bytes_out:,} bytes"
+                    f" (received {image.bytes_in:,}), arrived after {image.arrived_after:.2f}s,"
+                    f" written in {image.write_seconds * 1000:.1f}ms"
+                )
+        bytes_in = sum(image.bytes_in for image in written)
+        bytes_out = sum(image.bytes_out for image in written)
+        arrivals = [image.arrived_after for image in written]
+        lines.append(
+            f"Wrote {len(written)} image(s), {bytes_out:,} bytes (received {bytes_in:,});"
+            f" arrival avg {sum(arrivals) / len(arrivals):.2f}s, max {max(arrivals):.2f}s"
+        )
+        return "\n".join(lines)
+
+
+def _convert(data: bytes, output_format: str) -> bytes:
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as image:
+        output = BytesIO()
+        if output_format == "webp":
+            image.save(output, format="WEBP", quality=90)
+        else:
+            image.save(output, format="PNG", optimize=True)
+    return output.getvalue()
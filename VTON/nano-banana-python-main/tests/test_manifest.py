@@ -0,0 +1,85 @@
+import json
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from manifest import MULTI_IMAGE_PROMPT, completed_job_ids, load_manifest, run_manifest  # noqa: E402
+
+
+def _write_jsonl(path, rows):
+    path.write_text("".join(json.dumps(row) + "\n" for row in rows))
+    return str(path)
+
+
+def test_load_jsonl_and_csv(tmp_path):
+    jsonl = _write_jsonl(
+        tmp_path / "jobs.jsonl",
+        [
+            {"id": "a", "images": ["man.jpeg", "cap.jpeg"]},
+            {"images": "man.jpeg", "prompt": "Studio shoot"},
+        ],
+    )
+    csv_path = tmp_path / "jobs.csv"
+    csv_path.write_text("id,images,prompt\na,man.jpeg; cap.jpeg,\n")
+
+    jobs = load_manifest(jsonl)
+    assert jobs[0].id == "a"
+    assert jobs[0].image_paths == [str(tmp_path / "man.jpeg"), str(tmp_path / "cap.jpeg")]
+    assert jobs[0].prompt == MULTI_IMAGE_PROMPT
+    assert jobs[1].prompt == "Studio shoot"
+    # Derived ids are stable, so resuming finds the same jobs
+    assert jobs[1].id == load_manifest(jsonl)[1].id
+    assert load_manifest(str(csv_path)) == jobs[:1]
+
+
+def test_invalid_manifests(tmp_path):
+    with pytest.raises(ValueError, match="between 1 and 5"):
+        load_manifest(_write_jsonl(tmp_path / "none.jsonl", [{"images": []}]))
+    with pytest.raises(ValueError, match="duplicate"):
+        load_manifest(_write_jsonl(tmp_path / "dup.jsonl", [{"id": "a", "images": "x"}] * 2))
+
+
+def test_resume_skips_jobs_already_done(tmp_path):
+    jobs = load_manifest(
+        _write_jsonl(tmp_path / "jobs.jsonl", [{"id": name, "images": "x"} for name in "abcd"])
+    )
+    results_log = str(tmp_path / "results.jsonl")
+    calls = []
+    failing = {"c"}
+    lock = threading.Lock()
+
+    def remix(image_paths, prompt, job_output_dir):
+        job_id = Path(job_output_dir).name
+        with lock:
+            calls.append(job_id)
+        if job_id in failing:
+            raise RuntimeError("upstream failed")
+        return [f"{job_output_dir}/out.png"]
+
+    counts = run_manifest(jobs, remix, str(tmp_path / "out"), results_log, workers=2)
+    assert counts == {"done": 3, "failed": 1, "skipped": 0}
+    assert completed_job_ids(results_log) == {"a", "b", "d"}
+    failed = [json.loads(line) for line in open(results_log) if '"failed"' in line]
+    assert failed[0]["id"] == "c" and failed[0]["error"] == "upstream failed"
+
+    # An interrupted run can leave half a line behind
+    with open(results_log, "a") as f:
+        f.write('{"id": "d", "stat')
+    calls.clear()
+    failing.clear()
+    counts = run_manifest(jobs, remix, str(tmp_path / "out"), results_log, workers=2, resume=True)
+    assert calls == ["c"]
+    assert counts == {"done": 1, "failed": 0, "skipped": 3}
+    assert completed_job_ids(results_log) == {"a", "b", "c", "d"}
+
+
+def test_without_resume_everything_runs_again(tmp_path):
+    jobs = load_manifest(_write_jsonl(tmp_path / "jobs.jsonl", [{"id": "a", "images": "x"}]))
+    results_log = str(tmp_path / "results.jsonl")
+    run_manifest(jobs, lambda *args: [], str(tmp_path / "out"), results_log)
+    counts = run_manifest(jobs, lambda *args: [], str(tmp_path / "out"), results_log)
+    assert counts == {"done": 1, "failed": 0, "skipped": 0}
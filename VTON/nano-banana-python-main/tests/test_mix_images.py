@@ -1,5 +1,6 @@
 import os
 import subprocess
+import sys
 from pathlib import Path
 
 
@@ -49,3 +50,71 @@ def test_mix_images_cli_integration(tmp_path):
 
     # Assert that at least one remixed image file was created
     assert any(f.name.startswith("remixed_image_") for f in output_dir.iterdir())
+
+
+def test_mix_images_cli_replay_offline(tmp_path):
+    # Replays a recorded response, so no API key or network access is needed
+    project_dir = Path(__file__).parent.parent
+    sys.path.insert(0, str(project_dir / "src"))
+    from google.genai import types
+
+    from cassette import Cassette, request_key
+    from mix_images import MODEL_NAME, _load_image_parts
+
+    image_paths = [
+        str(project_dir / "images" / "man.jpeg"),
+        str(project_dir / "images" / "cap.jpeg"),
+    ]
+    prompt = "Combine the subjects of these images in a natural way, producing a new image."
+    contents = _load_image_parts(image_paths)
+    contents.append(types.Part.from_text(text=prompt))
+    config = types.GenerateContentConfig(response_modalities=["IMAGE", "TEXT"])
+
+    # Record a response the way "--cassette-mode record" would
+    with open(image_paths[0], "rb") as f:
+        image_data = f.read()
+    response = types.GenerateContentResponse(
+        candidates=[
+            types.Candidate(
+                content=types.Content(
+                    parts=[
+                        types.Part(text="Here is your image."),
+                        types.Part(
+                            inline_data=types.Blob(data=image_data, mime_type="image/jpeg")
+                        ),
+                    ]
+                )
+            )
+        ]
+    )
+    cassette_dir = tmp_path / "cassettes"
+    key = request_key("generate_content_stream", MODEL_NAME, contents, config)
+    Cassette(str(cassette_dir)).save(key, "generate_content_stream", MODEL_NAME, [response])
+
+    output_dir = tmp_path / "output"
+    env = os.environ.copy()
+    env.pop("GEMINI_API_KEY", None)
+    command = [
+        sys.executable,
+        "src/mix_images.py",
+        "-i",
+        image_paths[0],
+        "-i",
+        image_paths[1],
+        "--output-dir",
+        str(output_dir),
+        "--cassette-mode",
+        "replay",
+        "--cassette-dir",
+        str(cassette_dir),
+        "--replay-chunk-parts",
+        "1",
+    ]
+    result = subprocess.run(
+        command, capture_output=True, text=True, check=True, env=env, cwd=project_dir
+    )
+
+    assert "Here is your image." in result.stdout
+    saved = [f for f in output_dir.iterdir() if f.name.startswith("remixed_image_")]
+    assert len(saved) == 1
+    assert saved[0].read_bytes() == image_data
@@ -0,0 +1,74 @@
+import hashlib
+import sys
+import time
+from io import BytesIO
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from writer import ImageWriter, check_output_format  # noqa: E402
+
+
+def _png(colour):
+    from PIL import Image
+
+    output = BytesIO()
+    Image.new("RGB", (8, 8), colour).save(output, format="PNG")
+    return output.getvalue()
+
+
+def _write_all(writer, images, output_dir, mime_type="image/png"):
+    futures = [writer.submit(data, mime_type, str(output_dir), time.perf_counter()) for data in images]
+    writer.close()
+    return [future.result() for future in futures]
+
+
+def test_files_are_named_after_their_content(tmp_path):
+    red, blue = _png("red"), _png("blue")
+    names = _write_all(ImageWriter(), [red, blue], tmp_path)
+
+    assert names == [
+        str(tmp_path / f"remixed_image_{hashlib.sha256(data).hexdigest()[:16]}.png")
+        for data in (red, blue)
+    ]
+    assert [Path(name).read_bytes() for name in names] == [red, blue]
+
+
+def test_images_produced_together_do_not_overwrite_each_other(tmp_path):
+    images = [_png((index, 0, 0)) for index in range(20)]
+    names = _write_all(ImageWriter(), images, tmp_path)
+
+    assert len(set(names)) == 20
+    assert sorted(path.read_bytes() for path in tmp_path.iterdir()) == sorted(images)
+
+
+def test_identical_images_share_one_file(tmp_path):
+    writer = ImageWriter()
+    names = _write_all(writer, [_png("red")] * 2, tmp_path)
+
+    assert names[0] == names[1]
+    assert [path.name for path in tmp_path.iterdir()] == [Path(names[0]).name]
+    assert len(writer.written) == 2
+
+
+def test_unknown_mime_type(tmp_path):
+    (name,) = _write_all(ImageWriter(), [b"data"], tmp_path, mime_type=None)
+    assert name.endswith(".bin")
+
+
+def test_conversion_names_the_converted_content(tmp_path):
+    writer = ImageWriter(output_format="webp")
+    (name,) = _write_all(writer, [_png("red")], tmp_path)
+
+    converted = Path(name).read_bytes()
+    assert converted[8:12] == b"WEBP"
+    assert name.endswith(f"remixed_image_{hashlib.sha256(converted).hexdigest()[:16]}.webp")
+    assert writer.written[0].bytes_out == len(converted)
+    assert "Wrote 1 image(s)" in writer.summary()
+
+
+def test_unsupported_output_format():
+    with pytest.raises(ValueError, match="webp, png"):
+        check_output_format("gif")
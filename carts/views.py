@@ -4,6 +4,7 @@ from store.models import Product,Variation
 from django.core.paginator import Paginator
 from django.core.exceptions import ObjectDoesNotExist
 from django.contrib import messages
+from virtual_tryon.prewarm import prewarm_tryon
 
 
 # Create your views here.
@@ -96,6 +97,9 @@ def add_cart(request, product_id):
     cart_items = CartItem.objects.filter(cart=cart, is_active=True)
     request.session['cart_count'] = sum(item.quantity for item in cart_items)
     
+    # Start generating the try-on the shopper will likely ask for next (if enabled)
+    prewarm_tryon(request.user, product)
+    
     # Redirect back to the product detail page
     return redirect(product.get_url())
 
@@ -0,0 +1,198 @@
+"""
+Record and replay of Gemini API calls ("cassettes").
+
+With GENAI_CASSETTE_MODE set, get_genai_client() wraps the real client in a
+CassetteClient:
+- 'record' calls the API and stores every response in GENAI_CASSETTE_DIR,
+- 'replay' answers from the stored responses without any network access and
+  raises CassetteMissing for requests that were never recorded.
+
+Each interaction is one JSON file named after a hash of the method, model,
+contents and config, so identical requests map to the same recording.
+Replay can simulate upstream behaviour: GENAI_CASSETTE_LATENCY delays the
+first chunk, GENAI_CASSETTE_CHUNK_DELAY every following one, and
+GENAI_CASSETTE_CHUNK_PARTS re-splits streamed responses into chunks of at
+most that many parts.
+"""
+import hashlib
+import json
+import os
+import time
+
+from django.conf import settings
+
+try:
+    from google.genai import types
+except ImportError:
+    types = None
+
+RECORD = 'record'
+REPLAY = 'replay'
+CASSETTE_MODES = (RECORD, REPLAY)
+
+CASSETTE_SETTINGS = (
+    'GENAI_CASSETTE_MODE',
+    'GENAI_CASSETTE_DIR',
+    'GENAI_CASSETTE_LATENCY',
+    'GENAI_CASSETTE_CHUNK_DELAY',
+    'GENAI_CASSETTE_CHUNK_PARTS',
+)
+
+
+class CassetteMissing(Exception):
+    """Raised in replay mode for a request that has no recording."""
+
+
+def _jsonable(value):
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(mode='json', exclude_none=True)
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    return value
+
+
+def request_key(method, model, contents, config=None):
+    """Returns the name of the recording for a request."""
+    payload = json.dumps(
+        [method, model, _jsonable(contents), _jsonable(config)],
+        sort_keys=True, separators=(',', ':'),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Cassette:
+    """
+    A directory of recorded interactions.
+
+    Args:
+        directory: Where the recordings are kept.
+        latency: Seconds to wait before replaying the first response chunk.
+        chunk_delay: Seconds to wait before each further chunk.
+        chunk_parts: If set, streamed responses are replayed in chunks of at
+            most this many parts.
+    """
+
+    def __init__(self, directory, latency=0, chunk_delay=0, chunk_parts=None):
+        self.directory = directory
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_parts = chunk_parts
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def save(self, key, method, model, responses):
+        """Stores the responses of one interaction."""
+        os.makedirs(self.directory, exist_ok=True)
+        data = {
+            'method': method,
+            'model': model,
+            'responses': [_jsonable(response) for response in responses],
+        }
+        tmp_path = f'{self._path(key)}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self._path(key))
+
+    def load(self, key):
+        """Returns the recorded responses of an interaction, as GenerateContentResponse objects."""
+        try:
+            with open(self._path(key)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise CassetteMissing(
+                f'No recorded response for request {key} in {self.directory}; '
+                f'record it with GENAI_CASSETTE_MODE = "record"'
+            )
+        return [types.GenerateContentResponse.model_validate(response) for response in data['responses']]
+
+    def replay_stream(self, responses):
+        """Yields recorded stream chunks with the configured latency and chunking."""
+        if self.chunk_parts:
+            responses = _rechunk(responses, self.chunk_parts)
+        for index, response in enumerate(responses):
+            delay = self.latency if index == 0 else self.chunk_delay
+            if delay:
+                time.sleep(delay)
+            yield response
+
+
+def _rechunk(responses, chunk_parts):
+    """Splits the parts of every response across chunks of at most ``chunk_parts`` parts."""
+    for response in responses:
+        candidates = response.candidates
+        if not candidates or candidates[0].content is None or not candidates[0].content.parts:
+            yield response
+            continue
+        parts = candidates[0].content.parts
+        for start in range(0, len(parts), chunk_parts):
+            chunk = response.model_copy(deep=True)
+            chunk.candidates[0].content.parts = parts[start:start + chunk_parts]
+            yield chunk
+
+
+class _CassetteModels:
+    def __init__(self, models, cassette, mode):
+        self._models = models
+        self._cassette = cassette
+        self._mode = mode
+
+    def generate_content(self, *, model, contents, config=None, **kwargs):
+        key = request_key('generate_content', model, contents, config)
+        if self._mode == REPLAY:
+            return self._cassette.load(key)[0]
+        response = self._models.generate_content(model=model, contents=contents, config=config, **kwargs)
+        self._cassette.save(key, 'generate_content', model, [response])
+        return response
+
+    def generate_content_stream(self, *, model, contents, config=None, **kwargs):
+        key = request_key('generate_content_stream', model, contents, config)
+        if self._mode == REPLAY:
+            # Loaded lazily, like the real stream, which sends the request on first read
+            yield from self._cassette.replay_stream(self._cassette.load(key))
+            return
+        responses = []
+        for response in self._models.generate_content_stream(
+            model=model, contents=contents, config=config, **kwargs
+        ):
+            responses.append(response)
+            yield response
+        self._cassette.save(key, 'generate_content_stream', model, responses)
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+class CassetteClient:
+    """
+    Stands in for a genai.Client, recording or replaying its model calls.
+
+    ``client`` may be None in replay mode, where the network is never used.
+    """
+
+    def __init__(self, client, cassette, mode):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f'Cassette mode must be one of: {", ".join(CASSETTE_MODES)}')
+        self._client = client
+        self.models = _CassetteModels(client.models if client else None, cassette, mode)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def get_cassette_mode():
+    """Returns the configured cassette mode, or None when calls go to the API as usual."""
+    return getattr(settings, 'GENAI_CASSETTE_MODE', None) or None
+
+
+def wrap_client(client):
+    """Wraps ``client`` according to the cassette settings."""
+    cassette = Cassette(
+        getattr(settings, 'GENAI_CASSETTE_DIR', os.path.join(settings.BASE_DIR, 'cassettes')),
+        latency=getattr(settings, 'GENAI_CASSETTE_LATENCY', 0),
+        chunk_delay=getattr(settings, 'GENAI_CASSETTE_CHUNK_DELAY', 0),
+        chunk_parts=getattr(settings, 'GENAI_CASSETTE_CHUNK_PARTS', None),
+    )
+    return CassetteClient(client, cassette, get_cassette_mode())
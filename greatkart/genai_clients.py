@@ -0,0 +1,109 @@
+"""
+Process-wide registry of Google GenAI clients.
+
+Building a ``genai.Client`` creates a fresh HTTP connection pool, so doing it
+per request throws away keep-alive connections and TLS sessions.  The apps
+call get_genai_client() instead, which builds one client per configuration on
+first use and shares it between threads.  The registry is cleared whenever a
+relevant setting changes (e.g. override_settings in tests).
+
+When GENAI_CASSETTE_MODE is set the client is wrapped to record or replay
+its calls, see greatkart/cassettes.py.
+"""
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from .cassettes import REPLAY, get_cassette_mode, wrap_client
+
+try:
+    import httpx
+    from google import genai
+    from google.genai import types
+    GENAI_CLIENT_AVAILABLE = True
+except ImportError:
+    GENAI_CLIENT_AVAILABLE = False
+    genai = None
+
+# Settings that affect how clients are built
+CLIENT_SETTINGS = (
+    'GEMINI_API_KEY',
+    'GENAI_TIMEOUT',
+    'GENAI_MAX_CONNECTIONS',
+    'GENAI_MAX_KEEPALIVE_CONNECTIONS',
+    'GENAI_KEEPALIVE_EXPIRY',
+)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def _client_options():
+    return (
+        getattr(settings, 'GENAI_TIMEOUT', 120),
+        getattr(settings, 'GENAI_MAX_CONNECTIONS', 20),
+        getattr(settings, 'GENAI_MAX_KEEPALIVE_CONNECTIONS', 10),
+        getattr(settings, 'GENAI_KEEPALIVE_EXPIRY', 60),
+    )
+
+
+def get_genai_client(api_key=None):
+    """
+    Returns the shared client for ``api_key`` (GEMINI_API_KEY by default).
+
+    Raises ValueError when no API key is configured and ImportError when
+    google-genai is not installed.
+    """
+    if not GENAI_CLIENT_AVAILABLE:
+        raise ImportError('google-genai is not installed')
+    if api_key is None:
+        api_key = getattr(settings, 'GEMINI_API_KEY', None)
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not set in Django settings")
+
+    mode = get_cassette_mode()
+    if mode == REPLAY:
+        # Recorded responses only, never the network
+        return wrap_client(None)
+
+    options = _client_options()
+    key = (api_key,) + options
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _build_client(api_key, *options)
+                _clients[key] = client
+    if mode is not None:
+        return wrap_client(client)
+    return client
+
+
+def _build_client(api_key, timeout, max_connections, max_keepalive_connections, keepalive_expiry):
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    http_options = types.HttpOptions(
+        # HttpOptions.timeout is in milliseconds
+        timeout=int(timeout * 1000),
+        client_args={'limits': limits},
+        async_client_args={'limits': limits},
+    )
+    return genai.Client(api_key=api_key, http_options=http_options)
+
+
+def reset_genai_clients():
+    """Forgets all clients so the next call builds them from current settings."""
+    with _lock:
+        _clients.clear()
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    if setting in CLIENT_SETTINGS:
+        reset_genai_clients()
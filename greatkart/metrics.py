@@ -0,0 +1,160 @@
+"""
+In-process metrics shared by the apps.
+
+Counters and timing summaries are kept in memory per process and can be read
+with snapshot(), e.g. from a staff-only stats view, or in the Prometheus text
+format with render_text() from the local /metrics/ endpoint.
+
+Observations are also counted in histogram buckets.  span() times one stage
+of a request, records its duration and payload size and writes a structured
+(JSON) log line to the 'greatkart.metrics' logger.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets for durations in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Upper bounds of the histogram buckets for payload sizes in bytes
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+_lock = threading.Lock()
+_counters = {}
+_summaries = {}
+
+# Fields added to the log lines of all spans in the current context, see bind()
+_log_fields = contextvars.ContextVar('metrics_log_fields', default={})
+
+
+def incr(name, amount=1):
+    """Adds ``amount`` to the counter ``name``."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, value, buckets=LATENCY_BUCKETS):
+    """Records one observation (e.g. a duration in seconds) for ``name``."""
+    with _lock:
+        summary = _summaries.get(name)
+        if summary is None:
+            summary = _summaries[name] = {
+                'count': 0, 'sum': 0, 'min': value, 'max': value,
+                'buckets': dict.fromkeys(buckets, 0),
+            }
+        summary['count'] += 1
+        summary['sum'] += value
+        summary['min'] = min(summary['min'], value)
+        summary['max'] = max(summary['max'], value)
+        for bound in summary['buckets']:
+            if value <= bound:
+                summary['buckets'][bound] += 1
+                break
+
+
+@contextmanager
+def bind(**fields):
+    """Adds ``fields`` (e.g. a request id) to the log lines of spans run inside the block."""
+    token = _log_fields.set({**_log_fields.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_fields.reset(token)
+
+
+class Span:
+    """A timed stage; set ``bytes`` to the size of the payload it handled."""
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.bytes = None
+
+
+@contextmanager
+def span(name, **fields):
+    """
+    Times the enclosed block as stage ``name``.
+
+    Records ``<name>.seconds`` and, when the span's ``bytes`` is set,
+    ``<name>.bytes``, counts ``<name>.errors`` if the block raises, and logs
+    one JSON line with the duration, size and ``fields``.
+    """
+    current = Span(name, fields)
+    start = time.perf_counter()
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(f'{name}.seconds', elapsed)
+        if current.bytes is not None:
+            observe(f'{name}.bytes', current.bytes, buckets=SIZE_BUCKETS)
+        if error is not None:
+            incr(f'{name}.errors')
+        if logger.isEnabledFor(logging.INFO):
+            line = {'span': name, 'ms': round(elapsed * 1000, 2)}
+            if current.bytes is not None:
+                line['bytes'] = current.bytes
+            if error is not None:
+                line['error'] = error
+            line.update(_log_fields.get())
+            line.update(current.fields)
+            logger.info(json.dumps(line, default=str))
+
+
+def snapshot():
+    """Returns a copy of all counters and summaries."""
+    with _lock:
+        summaries = {}
+        for name, summary in _summaries.items():
+            summaries[name] = dict(
+                summary,
+                avg=summary['sum'] / summary['count'],
+                buckets={str(bound): count for bound, count in summary['buckets'].items()},
+            )
+        return {'counters': dict(_counters), 'summaries': summaries}
+
+
+def render_text():
+    """Returns all metrics in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        summaries = {name: dict(summary, buckets=dict(summary['buckets']))
+                     for name, summary in _summaries.items()}
+
+    lines = []
+    for name, value in sorted(counters.items()):
+        metric = _metric_name(name)
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {value}')
+    for name, summary in sorted(summaries.items()):
+        metric = _metric_name(name)
+        lines.append(f'# TYPE {metric} histogram')
+        cumulative = 0
+        for bound, count in summary['buckets'].items():
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {summary["count"]}')
+        lines.append(f'{metric}_sum {summary["sum"]}')
+        lines.append(f'{metric}_count {summary["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _metric_name(name):
+    return name.replace('.', '_').replace('-', '_')
+
+
+def reset():
+    """Clears all metrics."""
+    with _lock:
+        _counters.clear()
+        _summaries.clear()
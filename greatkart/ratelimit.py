@@ -0,0 +1,152 @@
+"""
+Per-client rate limiting of expensive views.
+
+Each client, i.e. the signed-in user, else the session, else the IP address
+of a visitor without a session, gets RATE_LIMITS[scope] = (requests, seconds)
+per scope.  The window slides: the count of the current fixed window is added
+to the count of the previous one, weighted by how much of it still overlaps
+the last ``seconds``.  That takes two cache operations per request, kept in
+Django's default cache, so all processes share the limits when CACHES points
+at a shared cache such as Redis.
+
+Limited views answer with the X-RateLimit-Limit, X-RateLimit-Remaining and
+X-RateLimit-Reset (seconds until the current window ends) headers.  Once the
+limit is reached they return 429 with a Retry-After header; refused requests
+are not counted.  A view doing the work of several requests, such as a batch,
+charges the rest with check_rate_limit(..., cost=n) once it knows n.
+"""
+import functools
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+
+from greatkart import metrics
+
+DEFAULT_RATE_LIMITS = {
+    'vton': (20, 60),
+    'outfit': (10, 60),
+}
+
+KEY_PREFIX = 'ratelimit:'
+
+
+class RateLimitResult:
+    """Outcome of one check; ``retry_after`` is set when the request is refused."""
+
+    def __init__(self, limit, remaining, reset, retry_after=None):
+        self.limit = limit
+        self.remaining = remaining
+        self.reset = reset
+        self.retry_after = retry_after
+
+    @property
+    def allowed(self):
+        return self.retry_after is None
+
+    def add_headers(self, response):
+        response['X-RateLimit-Limit'] = str(self.limit)
+        response['X-RateLimit-Remaining'] = str(self.remaining)
+        response['X-RateLimit-Reset'] = str(self.reset)
+        if self.retry_after is not None:
+            response['Retry-After'] = str(self.retry_after)
+        return response
+
+
+def _client_id(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'u{user.pk}'
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return f's{session.session_key}'
+    # Scripts that never keep a session cookie would otherwise get a fresh limit every time
+    return f'ip{request.META.get("REMOTE_ADDR", "")}'
+
+
+def _retry_after(previous, current, limit, window, elapsed, cost=1):
+    """Seconds until the weighted count leaves room for ``cost`` more requests."""
+    if current + cost <= limit and previous:
+        # Wait for enough of the previous window to slide out
+        return window * (1 - (limit - current - cost) / previous) - elapsed
+    # Wait for the next window, and then for enough of this one to slide out
+    return window - elapsed + (window * (1 - (limit - cost) / current) if current else 0)
+
+
+def check_rate_limit(scope, request, cost=1):
+    """
+    Counts ``cost`` requests of ``request``'s client against RATE_LIMITS[scope].
+
+    A cost above the limit is charged as the whole limit, so that it can
+    still pass in a fresh window. Returns a RateLimitResult, or None when the
+    scope is not limited.
+    """
+    if not getattr(settings, 'RATE_LIMIT_ENABLED', True):
+        return None
+    config = getattr(settings, 'RATE_LIMITS', DEFAULT_RATE_LIMITS).get(scope)
+    if config is None:
+        return None
+    limit, window = config
+    cost = min(cost, limit)
+
+    now = time.time()
+    window_index = int(now // window)
+    elapsed = now - window_index * window
+    prefix = f'{KEY_PREFIX}{scope}:{_client_id(request)}:'
+    key = f'{prefix}{window_index}'
+    previous_key = f'{prefix}{window_index - 1}'
+
+    counts = cache.get_many([key, previous_key])
+    current = counts.get(key, 0)
+    previous = counts.get(previous_key, 0)
+    used = previous * (1 - elapsed / window) + current
+    reset = math.ceil(window - elapsed)
+
+    if used + cost > limit:
+        metrics.incr(f'ratelimit.{scope}.limited')
+        retry_after = max(1, math.ceil(_retry_after(previous, current, limit, window, elapsed, cost)))
+        return RateLimitResult(limit, max(0, math.floor(limit - used)), reset, retry_after=retry_after)
+
+    # The key must outlive the next window, where it is the previous one
+    if not cache.add(key, cost, window * 2):
+        try:
+            cache.incr(key, cost)
+        except ValueError:
+            # Expired or evicted in between
+            cache.set(key, cost, window * 2)
+    return RateLimitResult(limit, max(0, math.floor(limit - used - cost)), reset)
+
+
+def too_many_requests(result):
+    """The 429 response for a refused RateLimitResult."""
+    return result.add_headers(JsonResponse(
+        {'error': 'Too many requests, please slow down', 'retry_after': result.retry_after},
+        status=429,
+    ))
+
+
+def rate_limit(scope, methods=('POST',)):
+    """
+    Decorator limiting a view's ``methods`` requests per client by RATE_LIMITS[scope].
+
+    Other methods pass through uncounted. Rate limit headers the view set
+    itself, after charging more with check_rate_limit, are kept.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in methods:
+                return view(request, *args, **kwargs)
+            result = check_rate_limit(scope, request)
+            if result is None:
+                return view(request, *args, **kwargs)
+            if not result.allowed:
+                return too_many_requests(result)
+            response = view(request, *args, **kwargs)
+            if response.has_header('X-RateLimit-Remaining'):
+                return response
+            return result.add_headers(response)
+        return wrapped
+    return decorator
@@ -147,3 +147,173 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 # Replace the empty string below with your actual Gemini API key
 # You can get one from: https://aistudio.google.com/app/apikey
 GEMINI_API_KEY = 'place_holder'  # Paste your actual API key here
+
+# Virtual try-on background jobs
+# Number of worker threads generating try-ons and how many jobs may wait for one.
+# Keep these small so try-on load cannot starve the rest of the store.
+VTON_JOB_WORKERS = 2
+VTON_JOB_QUEUE_DEPTH = 20
+# Seconds a finished job's result is kept for polling
+VTON_JOB_RESULT_TTL = 600
+# Seconds between keep-alive comments on an idle job progress stream
+VTON_JOB_EVENTS_HEARTBEAT = 15
+
+# Virtual try-on result cache
+# Identical (person image, cloth image, prompt, model) requests are served from disk.
+VTON_CACHE_ENABLED = True
+VTON_CACHE_DIR = os.path.join(BASE_DIR, 'vton_cache')
+VTON_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Largest try-on request body accepted; uploads are kept in memory, never spooled to disk
+VTON_MAX_UPLOAD_BYTES = 20 * 1024 * 1024
+# Lifetime in seconds of the signed links returned by try-on requests with response=url
+VTON_RESULT_URL_TTL = 300
+
+# Try-on input normalization: EXIF rotation, downscale to max edge (pixels), JPEG re-encode quality
+VTON_NORMALIZE_ENABLED = True
+VTON_NORMALIZE_MAX_EDGE = 1024
+VTON_NORMALIZE_QUALITY = 85
+
+# Shared Google GenAI client (greatkart/genai_clients.py)
+# Request timeout in seconds and HTTP connection pool limits per process
+GENAI_TIMEOUT = 120
+GENAI_MAX_CONNECTIONS = 20
+GENAI_MAX_KEEPALIVE_CONNECTIONS = 10
+GENAI_KEEPALIVE_EXPIRY = 60
+
+# Client-side limits shared by all Gemini calls in a process (greatkart/upstream.py):
+# calls in flight, sustained request rate and burst, attempts per call including
+# retries of 429/5xx responses, longest backoff in seconds, and how long a call
+# may wait for a free slot before failing
+GENAI_MAX_CONCURRENCY = 8
+GENAI_REQUESTS_PER_MINUTE = 60
+GENAI_BURST = 10
+GENAI_RETRY_ATTEMPTS = 4
+GENAI_RETRY_MAX_WAIT = 20
+GENAI_QUEUE_TIMEOUT = 60
+# Background calls (e.g. try-on pre-warming) in flight at the same time; they never
+# wait for a slot or a token, so interactive calls always go first
+GENAI_BACKGROUND_CONCURRENCY = 1
+
+# Circuit breaker per upstream call site: opens when, among the calls of the last
+# WINDOW_SECONDS (at least MIN_CALLS), the share of failures or of calls slower than
+# SLOW_CALL_SECONDS reaches its rate. While open, try-ons fail fast with a 503 and
+# outfit suggestions use the rule-based fallback; after OPEN_SECONDS one probe call
+# decides whether to close it again.
+GENAI_BREAKER_ENABLED = True
+GENAI_BREAKER_WINDOW_SECONDS = 60
+GENAI_BREAKER_MIN_CALLS = 5
+GENAI_BREAKER_FAILURE_RATE = 0.5
+GENAI_BREAKER_SLOW_CALL_SECONDS = 60
+GENAI_BREAKER_SLOW_CALL_RATE = 0.5
+GENAI_BREAKER_OPEN_SECONDS = 30
+
+# Try-on backends in order of preference (virtual_tryon/backends.py). A backend that
+# fails passes the request to the next one. With VTON_HEDGE_AFTER set to a number of
+# seconds, a backend that has not started answering by then is raced against the next.
+# For load tests, list only {'NAME': 'stub', 'BACKEND': 'virtual_tryon.backends.StubBackend',
+# 'OPTIONS': {'latency': 2}}, which needs no API key.
+VTON_BACKENDS = [
+    {
+        'NAME': 'gemini',
+        'BACKEND': 'virtual_tryon.backends.GeminiBackend',
+        'OPTIONS': {'model': 'gemini-2.5-flash-image-preview'},
+    },
+]
+VTON_HEDGE_AFTER = None
+
+# Batch try-on: garments per batch and how many of them are generated at the same time
+VTON_BATCH_MAX_ITEMS = 12
+VTON_BATCH_CONCURRENCY = 3
+
+# Cloth uploads that are re-encoded copies of a store product image are swapped for the
+# product image itself, sharing its cached results (virtual_tryon/phash.py). A match needs
+# the perceptual hashes within these Hamming distances (of 64 bits) and the colours within
+# COLOUR_MAX_DISTANCE (mean difference per channel, 0-255). Each process rebuilds
+# its product index after INDEX_TTL seconds; `python manage.py index_product_images`
+# prepares products created before matching existed.
+VTON_PHASH_ENABLED = True
+VTON_PHASH_MAX_DISTANCE = 4
+VTON_DHASH_MAX_DISTANCE = 6
+VTON_COLOUR_MAX_DISTANCE = 12
+VTON_PHASH_INDEX_TTL = 300
+
+# Try-on garment images prepared from store product images when products are saved:
+# cropped to the garment, downscaled to this max edge (pixels) and re-encoded at this JPEG quality
+VTON_GARMENT_MAX_EDGE = 1024
+VTON_GARMENT_QUALITY = 90
+
+# Pre-warming (virtual_tryon/prewarm.py): when a signed-in user with a saved person image
+# adds a product to the cart, generate that try-on into the result cache in the background.
+# It only runs while no interactive try-on is in progress and is dropped after waiting
+# MAX_WAIT seconds; budgets are per user and site-wide, per BUDGET_WINDOW seconds.
+VTON_PREWARM_ENABLED = False
+VTON_PREWARM_USER_BUDGET = 5
+VTON_PREWARM_GLOBAL_BUDGET = 100
+VTON_PREWARM_BUDGET_WINDOW = 60 * 60
+VTON_PREWARM_QUEUE_DEPTH = 10
+VTON_PREWARM_MAX_WAIT = 120
+
+# Outfit try-on: wardrobe items sent with the person image in one request (the model takes
+# at most 5 images), downscaled until all images together fit in this many bytes
+VTON_OUTFIT_MAX_ITEMS = 4
+VTON_OUTFIT_MAX_PAYLOAD_BYTES = 4 * 1024 * 1024
+
+# Optional async sidecar for /vton/ (greatkart.vton_asgi): try-ons one process runs at a time
+VTON_ASGI_MAX_CONCURRENCY = 64
+
+# Seconds a registered person image handle stays usable.
+# Run `python manage.py cleanup_person_images` periodically to delete expired ones.
+VTON_PERSON_HANDLE_TTL = 24 * 60 * 60
+
+# Storage each signed-in user may use for saved try-on results; least recently viewed ones are evicted first
+VTON_GALLERY_QUOTA_BYTES = 50 * 1024 * 1024
+
+# Identical concurrent try-ons share one upstream generation within a process.
+# Enable cross-process sharing when CACHES points at a cache shared by all workers (e.g. Redis).
+VTON_SINGLEFLIGHT_CROSS_PROCESS = False
+VTON_SINGLEFLIGHT_LOCK_TIMEOUT = 180
+VTON_SINGLEFLIGHT_POLL_INTERVAL = 0.5
+
+# Per-client rate limits (greatkart/ratelimit.py) of the try-on API ('vton': generate_vton,
+# outfit try-on and job submission) and AI outfit generation ('outfit'), as (requests, seconds)
+# over a sliding window, per signed-in user, else per session or IP address. Counts live in
+# the default cache, so point CACHES at a shared cache to apply them across processes.
+RATE_LIMIT_ENABLED = True
+RATE_LIMITS = {
+    'vton': (20, 60),
+    'outfit': (10, 60),
+}
+
+# Metrics (greatkart/metrics.py): /metrics/ is served to staff, and to scrapers sending
+# "Authorization: Bearer <METRICS_BEARER_TOKEN>" when a token is set.
+# Per-stage timing spans are logged as JSON lines by the 'greatkart.metrics' logger;
+# raise its level to WARNING to silence them.
+METRICS_BEARER_TOKEN = os.environ.get('METRICS_BEARER_TOKEN') or None
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'greatkart.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('METRICS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Record/replay of Gemini calls (greatkart/cassettes.py) for offline tests and demos:
+# None (call the API), 'record' (call it and store the responses) or 'replay' (stored responses only).
+# Replays can simulate latency before the first chunk, a delay between chunks and
+# smaller chunks (at most CHUNK_PARTS parts each).
+GENAI_CASSETTE_MODE = os.environ.get('GENAI_CASSETTE_MODE') or None
+GENAI_CASSETTE_DIR = os.path.join(BASE_DIR, 'cassettes')
+GENAI_CASSETTE_LATENCY = 0
+GENAI_CASSETTE_CHUNK_DELAY = 0
+GENAI_CASSETTE_CHUNK_PARTS = None
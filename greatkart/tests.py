@@ -0,0 +1,257 @@
+import threading
+import time
+from unittest import mock
+
+import httpx
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from greatkart.ratelimit import check_rate_limit
+from greatkart.views import metrics_view
+from greatkart.upstream import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen, UpstreamBusy, UpstreamLimiter, background_calls,
+)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMITS={'test': (5, 60)})
+class RateLimitTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.request = RequestFactory().post('/', REMOTE_ADDR='10.0.0.1')
+        self.clock = FakeClock()
+        # At the start of a window
+        self.clock.now = 6000.0
+        patcher = mock.patch('greatkart.ratelimit.time.time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cost_is_charged_at_once(self):
+        result = check_rate_limit('test', self.request, cost=3)
+        self.assertTrue(result.allowed)
+        self.assertEqual(result.remaining, 2)
+        refused = check_rate_limit('test', self.request, cost=3)
+        self.assertFalse(refused.allowed)
+        self.assertEqual(refused.retry_after, 80)
+        # A refused charge is not counted
+        self.assertTrue(check_rate_limit('test', self.request, cost=2).allowed)
+        self.assertFalse(check_rate_limit('test', self.request).allowed)
+
+    def test_retry_after_is_exact(self):
+        check_rate_limit('test', self.request, cost=3)
+        self.clock.now += 79
+        self.assertFalse(check_rate_limit('test', self.request, cost=3).allowed)
+        self.clock.now += 1
+        self.assertTrue(check_rate_limit('test', self.request, cost=3).allowed)
+
+    def test_previous_window_slides_out(self):
+        check_rate_limit('test', self.request, cost=5)
+        self.clock.now += 60
+        refused = check_rate_limit('test', self.request)
+        self.assertFalse(refused.allowed)
+        self.assertEqual(refused.retry_after, 12)
+        # Half of the previous window is left: 2.5 requests
+        self.clock.now += 30
+        result = check_rate_limit('test', self.request, cost=2)
+        self.assertTrue(result.allowed)
+        self.assertEqual(result.remaining, 0)
+        self.assertFalse(check_rate_limit('test', self.request).allowed)
+
+    def test_cost_above_the_limit_takes_the_whole_window(self):
+        self.assertTrue(check_rate_limit('test', self.request, cost=50).allowed)
+        self.assertFalse(check_rate_limit('test', self.request).allowed)
+        self.clock.now += 120
+        self.assertTrue(check_rate_limit('test', self.request, cost=50).allowed)
+
+
+@override_settings(METRICS_BEARER_TOKEN='s3cret')
+class MetricsViewTests(SimpleTestCase):
+
+    def _get(self, user=None, **headers):
+        request = RequestFactory().get('/metrics/', REMOTE_ADDR='127.0.0.1', **headers)
+        request.user = user or AnonymousUser()
+        return metrics_view(request)
+
+    def test_local_address_alone_is_refused(self):
+        self.assertEqual(self._get().status_code, 403)
+
+    def test_staff(self):
+        self.assertEqual(self._get(user=mock.Mock(is_staff=True)).status_code, 200)
+
+    def test_bearer_token(self):
+        self.assertEqual(self._get(HTTP_AUTHORIZATION='Bearer s3cret').status_code, 200)
+        self.assertEqual(self._get(HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+    @override_settings(METRICS_BEARER_TOKEN=None)
+    def test_no_token_configured(self):
+        self.assertEqual(self._get(HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch('greatkart.upstream.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker(window_seconds=60, min_calls=3, failure_rate=0.5, open_seconds=30)
+
+    def _fail(self, times):
+        opened = False
+        for _ in range(times):
+            self.assertTrue(self.breaker.allow())
+            opened = self.breaker.record(failed=True, duration=0.1)
+        return opened
+
+    def test_opens_after_min_calls_failures(self):
+        self.assertFalse(self._fail(2))
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self._fail(1))
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.assertEqual(self.breaker.retry_after(), 30)
+
+    def test_successes_keep_it_closed(self):
+        for _ in range(3):
+            self.breaker.allow()
+            self.breaker.record(failed=False, duration=0.1)
+        self.assertFalse(self._fail(2))
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_old_failures_leave_the_window(self):
+        self._fail(2)
+        self.clock.now += 61
+        self.assertFalse(self._fail(1))
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_half_opens_after_cooldown(self):
+        self._fail(3)
+        self.clock.now += 29
+        self.assertFalse(self.breaker.allow())
+        self.clock.now += 1
+        # One probe at a time
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+        self.breaker.record(failed=False, duration=0.1)
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self._fail(3)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.record(failed=True, duration=0.1))
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_cancelled_probe_lets_another_through(self):
+        self._fail(3)
+        self.clock.now += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.cancel()
+        self.assertTrue(self.breaker.allow())
+
+
+class UpstreamLimiterTests(SimpleTestCase):
+
+    def _limiter(self, breaker_options=None):
+        return UpstreamLimiter(retry_attempts=3, retry_max_wait=0, queue_timeout=1, breaker_options=breaker_options)
+
+    def test_transient_errors_are_retried(self):
+        func = mock.Mock(side_effect=[httpx.ConnectError('reset'), httpx.ReadTimeout('slow'), 'ok'])
+        self.assertEqual(self._limiter().call('test', func), 'ok')
+        self.assertEqual(func.call_count, 3)
+
+    def test_retries_give_up_after_the_last_attempt(self):
+        func = mock.Mock(side_effect=httpx.ConnectError('reset'))
+        with self.assertRaises(httpx.ConnectError):
+            self._limiter().call('test', func)
+        self.assertEqual(func.call_count, 3)
+
+    def test_permanent_errors_are_not_retried(self):
+        func = mock.Mock(side_effect=ValueError('bad request'))
+        with self.assertRaises(ValueError):
+            self._limiter().call('test', func)
+        self.assertEqual(func.call_count, 1)
+
+    def test_open_breaker_short_circuits(self):
+        limiter = self._limiter({'min_calls': 3, 'failure_rate': 0.5, 'open_seconds': 30})
+        func = mock.Mock(side_effect=httpx.ConnectError('reset'))
+        # The third attempt opens the breaker
+        with self.assertRaises(httpx.ConnectError):
+            limiter.call('test', func)
+        with self.assertRaises(CircuitOpen):
+            limiter.call('test', func)
+        self.assertEqual(func.call_count, 3)
+        self.assertTrue(limiter.is_open('test'))
+
+    def test_permanent_errors_do_not_open_the_breaker(self):
+        limiter = self._limiter({'min_calls': 3, 'failure_rate': 0.5, 'open_seconds': 30})
+        func = mock.Mock(side_effect=ValueError('bad request'))
+        for _ in range(5):
+            with self.assertRaises(ValueError):
+                limiter.call('test', func)
+        self.assertFalse(limiter.is_open('test'))
+
+    def test_any_error_of_the_half_open_probe_reopens_the_breaker(self):
+        clock = FakeClock()
+        with mock.patch('greatkart.upstream.time.monotonic', clock):
+            limiter = self._limiter({'min_calls': 3, 'failure_rate': 0.5, 'open_seconds': 30})
+            with self.assertRaises(httpx.ConnectError):
+                limiter.call('test', mock.Mock(side_effect=httpx.ConnectError('reset')))
+            self.assertTrue(limiter.is_open('test'))
+            clock.now += 30
+            with self.assertRaises(ValueError):
+                limiter.call('test', mock.Mock(side_effect=ValueError('bad request')))
+            self.assertEqual(limiter.get_breaker('test').state, OPEN)
+            self.assertTrue(limiter.is_open('test'))
+
+    def _hold_slot(self, limiter, background=False):
+        """Starts a call that keeps its slot until the returned event is set."""
+        started, release = threading.Event(), threading.Event()
+
+        def func():
+            started.set()
+            release.wait(5)
+
+        def target():
+            if background:
+                with background_calls():
+                    limiter.call('test', func)
+            else:
+                limiter.call('test', func)
+
+        thread = threading.Thread(target=target)
+        thread.start()
+        self.assertTrue(started.wait(5))
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        return release
+
+    def test_background_calls_have_their_own_slots(self):
+        limiter = UpstreamLimiter(max_concurrency=4, queue_timeout=5, background_concurrency=1)
+        self._hold_slot(limiter, background=True)
+        with background_calls(), self.assertRaises(UpstreamBusy):
+            limiter.call('test', mock.Mock())
+        self.assertEqual(limiter.call('test', lambda: 'ok'), 'ok')
+
+    def test_background_calls_do_not_wait_for_a_shared_slot(self):
+        limiter = UpstreamLimiter(max_concurrency=1, queue_timeout=5)
+        self._hold_slot(limiter)
+        func = mock.Mock()
+        start = time.monotonic()
+        with background_calls(), self.assertRaises(UpstreamBusy):
+            limiter.call('test', func)
+        self.assertLess(time.monotonic() - start, 1)
+        func.assert_not_called()
@@ -0,0 +1,410 @@
+"""
+Client-side limits for calls to the Gemini API.
+
+Every upstream call made by the apps goes through UpstreamLimiter.call(),
+which
+- caps the number of calls in flight per process (a semaphore),
+- spends a token from a token bucket sized to our request quota, and
+- retries rate-limit and transient server/network errors with jittered
+  exponential backoff (tenacity).
+
+Each call site ('vton', 'outfit') also has a circuit breaker.  When too many
+recent calls failed or were slow, the breaker opens and calls fail at once
+with CircuitOpen instead of waiting out the upstream timeout.  After
+GENAI_BREAKER_OPEN_SECONDS a single probe call is let through (half-open);
+its outcome closes the breaker or opens it again.
+
+Speculative work wraps its calls in background_calls().  Those get at most
+GENAI_BACKGROUND_CONCURRENCY slots of their own and never wait: when no
+slot or token is free right away they fail with UpstreamBusy, leaving the
+shared slots to interactive calls.
+
+Time spent waiting for a slot, attempts and retries are recorded in
+greatkart.metrics under ``upstream.*``.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from tenacity import (
+    Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential,
+)
+
+from greatkart import metrics
+
+try:
+    import httpx
+    from google.genai import errors as genai_errors
+except ImportError:
+    httpx = None
+    genai_errors = None
+
+# HTTP status codes worth retrying: rate limiting and transient server errors
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+LIMITER_SETTINGS = (
+    'GENAI_MAX_CONCURRENCY',
+    'GENAI_REQUESTS_PER_MINUTE',
+    'GENAI_BURST',
+    'GENAI_RETRY_ATTEMPTS',
+    'GENAI_RETRY_MAX_WAIT',
+    'GENAI_QUEUE_TIMEOUT',
+    'GENAI_BACKGROUND_CONCURRENCY',
+    'GENAI_BREAKER_ENABLED',
+    'GENAI_BREAKER_WINDOW_SECONDS',
+    'GENAI_BREAKER_MIN_CALLS',
+    'GENAI_BREAKER_FAILURE_RATE',
+    'GENAI_BREAKER_SLOW_CALL_SECONDS',
+    'GENAI_BREAKER_SLOW_CALL_RATE',
+    'GENAI_BREAKER_OPEN_SECONDS',
+)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_background = contextvars.ContextVar('upstream_background', default=False)
+
+
+@contextmanager
+def background_calls():
+    """Makes the upstream calls made within the block low-priority background calls."""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+class UpstreamBusy(Exception):
+    """Raised when no upstream slot became free within the queue timeout."""
+
+    def __init__(self, message, retry_after=5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpen(UpstreamBusy):
+    """Raised without calling upstream while its circuit breaker is open."""
+
+
+def is_retryable(exc):
+    """Tells whether a failed upstream call is worth retrying."""
+    if genai_errors is not None and isinstance(exc, genai_errors.APIError):
+        return exc.code in RETRYABLE_STATUS_CODES
+    if httpx is not None and isinstance(exc, httpx.TransportError):
+        return True
+    return False
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    Args:
+        rate: Tokens added per second.
+        capacity: Maximum number of tokens, i.e. the allowed burst.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        """Takes one token, waiting for it up to ``timeout`` seconds. Returns success."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Tracks recent outcomes of calls to one upstream and decides whether to allow more.
+
+    Args:
+        window_seconds: How far back outcomes are considered.
+        min_calls: Outcomes needed in the window before the breaker may open.
+        failure_rate: Share of failed calls that opens the breaker.
+        slow_call_seconds: Duration above which a successful call counts as slow.
+        slow_call_rate: Share of slow calls that opens the breaker.
+        open_seconds: Time the breaker stays open before letting a probe through.
+    """
+
+    def __init__(self, window_seconds=60, min_calls=5, failure_rate=0.5,
+                 slow_call_seconds=60, slow_call_rate=0.5, open_seconds=30):
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.state = CLOSED
+        self.opened_at = None
+        self._probing = False
+        # (finished at, failed, slow) for recent calls
+        self._outcomes = deque()
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """Seconds until a probe will be let through, 0 when calls are allowed."""
+        with self._lock:
+            if self.state != OPEN:
+                return 0
+            return max(0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self):
+        """
+        Returns whether a call may go ahead.
+
+        When the open period is over, the first caller gets to probe the
+        upstream and everybody else is refused until the probe has finished.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def cancel(self):
+        """Gives back a permission from allow() for a call that never reached upstream."""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def record(self, failed, duration):
+        """Records the outcome of an allowed call; returns True if it opened the breaker."""
+        now = time.monotonic()
+        slow = not failed and duration > self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed or slow:
+                    self._open(now)
+                    return True
+                self.state = CLOSED
+                self._outcomes.clear()
+                return False
+            if self.state == OPEN:
+                # A call let through before the breaker opened
+                return False
+
+            self._outcomes.append((now, failed, slow))
+            while self._outcomes and self._outcomes[0][0] < now - self.window_seconds:
+                self._outcomes.popleft()
+            calls = len(self._outcomes)
+            if calls < self.min_calls:
+                return False
+            failures = sum(1 for _, f, _ in self._outcomes if f)
+            slow_calls = sum(1 for _, _, s in self._outcomes if s)
+            if failures / calls >= self.failure_rate or slow_calls / calls >= self.slow_call_rate:
+                self._open(now)
+                return True
+            return False
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self._outcomes.clear()
+
+
+class UpstreamLimiter:
+    """
+    Concurrency limit, rate limit and retry policy for upstream calls.
+
+    Args:
+        max_concurrency: Calls allowed in flight at the same time.
+        requests_per_minute: Sustained request rate of the token bucket.
+        burst: Token bucket capacity.
+        retry_attempts: Total attempts per call, including the first one.
+        retry_max_wait: Upper bound in seconds of a single backoff.
+        queue_timeout: Seconds to wait for a slot and a token before giving up.
+        breaker_options: CircuitBreaker arguments for each call site, or None
+            to disable the breakers.
+        background_concurrency: Background calls allowed in flight at the same time.
+    """
+
+    def __init__(self, max_concurrency=8, requests_per_minute=60, burst=10,
+                 retry_attempts=4, retry_max_wait=20, queue_timeout=60,
+                 breaker_options=None, background_concurrency=1):
+        self._semaphore = threading.BoundedSemaphore(max_concurrency)
+        self._background_semaphore = threading.BoundedSemaphore(background_concurrency)
+        self._bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.retry_attempts = retry_attempts
+        self.retry_max_wait = retry_max_wait
+        self.queue_timeout = queue_timeout
+        self.breaker_options = breaker_options
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def in_flight(self):
+        """Number of calls currently holding a concurrency slot."""
+        return self._in_flight
+
+    def get_breaker(self, name):
+        """Returns the circuit breaker of call site ``name``, or None if breakers are disabled."""
+        if self.breaker_options is None:
+            return None
+        with self._breakers_lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(**self.breaker_options)
+            return breaker
+
+    def is_open(self, name):
+        """Tells whether calls for ``name`` are currently being refused."""
+        breaker = self.get_breaker(name)
+        return breaker is not None and breaker.retry_after() > 0
+
+    def breaker_states(self):
+        """Returns the state of every breaker created so far, for stats views."""
+        with self._breakers_lock:
+            breakers = dict(self._breakers)
+        return {
+            name: {'state': breaker.state, 'retry_after': round(breaker.retry_after(), 1)}
+            for name, breaker in breakers.items()
+        }
+
+    def call(self, name, func, *args, **kwargs):
+        """
+        Calls ``func(*args, **kwargs)`` within the limits, retrying transient errors.
+
+        ``name`` labels the call site in metrics, e.g. 'vton' or 'outfit', and
+        selects its circuit breaker. Raises CircuitOpen while that breaker is open.
+        """
+        retrying = Retrying(
+            stop=stop_after_attempt(self.retry_attempts),
+            wait=wait_random_exponential(multiplier=1, max=self.retry_max_wait),
+            # CircuitOpen is not retryable, so an opening breaker also ends the retries
+            retry=retry_if_exception(is_retryable),
+            before_sleep=lambda retry_state: metrics.incr(f'upstream.{name}.retries'),
+            reraise=True,
+        )
+        return retrying(self._call_once, name, func, args, kwargs)
+
+    def _call_once(self, name, func, args, kwargs):
+        breaker = self.get_breaker(name)
+        if breaker is not None and not breaker.allow():
+            metrics.incr(f'upstream.{name}.short_circuited')
+            raise CircuitOpen(
+                'The AI service is currently unavailable, please retry shortly',
+                retry_after=max(1, breaker.retry_after()),
+            )
+        # Only one call at a time is let through while half-open
+        probe = breaker is not None and breaker.state == HALF_OPEN
+        background = _background.get()
+        if background and not self._background_semaphore.acquire(blocking=False):
+            self._reject(breaker, name, 'Background calls to the AI service are already in progress')
+        try:
+            return self._call_in_slot(breaker, name, probe, background, func, args, kwargs)
+        finally:
+            if background:
+                self._background_semaphore.release()
+
+    def _call_in_slot(self, breaker, name, probe, background, func, args, kwargs):
+        # Background calls give up at once rather than queue with interactive ones
+        timeout = 0 if background else self.queue_timeout
+        start = time.perf_counter()
+        if not self._semaphore.acquire(timeout=timeout):
+            self._reject(breaker, name, 'Too many requests to the AI service are in progress')
+        with self._in_flight_lock:
+            self._in_flight += 1
+        try:
+            if not self._bucket.acquire(timeout=timeout):
+                self._reject(breaker, name, 'The AI service request quota is exhausted, please retry shortly')
+            metrics.observe(f'upstream.{name}.queue_wait_seconds', time.perf_counter() - start)
+            metrics.incr(f'upstream.{name}.attempts')
+            call_start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                metrics.incr(f'upstream.{name}.errors')
+                # Only upstream trouble counts against the breaker, not e.g. rejected input,
+                # unless the call was the half-open probe: that must succeed to close it
+                failed = probe or is_retryable(e)
+                self._record(breaker, name, failed, time.perf_counter() - call_start)
+                raise
+            self._record(breaker, name, False, time.perf_counter() - call_start)
+            return result
+        finally:
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            self._semaphore.release()
+
+    def _reject(self, breaker, name, message):
+        metrics.incr(f'upstream.{name}.rejected')
+        if breaker is not None:
+            breaker.cancel()
+        raise UpstreamBusy(message)
+
+    def _record(self, breaker, name, failed, duration):
+        if breaker is not None and breaker.record(failed, duration):
+            metrics.incr(f'upstream.{name}.breaker_opened')
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_upstream_limiter():
+    """Returns the process-wide limiter shared by all Gemini calls."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = UpstreamLimiter(
+                    max_concurrency=getattr(settings, 'GENAI_MAX_CONCURRENCY', 8),
+                    requests_per_minute=getattr(settings, 'GENAI_REQUESTS_PER_MINUTE', 60),
+                    burst=getattr(settings, 'GENAI_BURST', 10),
+                    retry_attempts=getattr(settings, 'GENAI_RETRY_ATTEMPTS', 4),
+                    retry_max_wait=getattr(settings, 'GENAI_RETRY_MAX_WAIT', 20),
+                    queue_timeout=getattr(settings, 'GENAI_QUEUE_TIMEOUT', 60),
+                    breaker_options=_breaker_options(),
+                    background_concurrency=getattr(settings, 'GENAI_BACKGROUND_CONCURRENCY', 1),
+                )
+    return _limiter
+
+
+def _breaker_options():
+    if not getattr(settings, 'GENAI_BREAKER_ENABLED', True):
+        return None
+    return {
+        'window_seconds': getattr(settings, 'GENAI_BREAKER_WINDOW_SECONDS', 60),
+        'min_calls': getattr(settings, 'GENAI_BREAKER_MIN_CALLS', 5),
+        'failure_rate': getattr(settings, 'GENAI_BREAKER_FAILURE_RATE', 0.5),
+        'slow_call_seconds': getattr(settings, 'GENAI_BREAKER_SLOW_CALL_SECONDS', 60),
+        'slow_call_rate': getattr(settings, 'GENAI_BREAKER_SLOW_CALL_RATE', 0.5),
+        'open_seconds': getattr(settings, 'GENAI_BREAKER_OPEN_SECONDS', 30),
+    }
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    global _limiter
+    if setting in LIMITER_SETTINGS:
+        with _limiter_lock:
+            _limiter = None
@@ -1,9 +1,34 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
 from store.models import Product
 
+from . import metrics
+
 def home(request):
     products = Product.objects.all().filter(is_available=True)
     context={
         'products':products,
     }
-    return render(request,'home.html',context)
\ No newline at end of file
+    return render(request,'home.html',context)
+
+def metrics_view(request):
+    """
+    Exposes this process's metrics in the Prometheus text format.
+
+    Only reachable by staff, or by scrapers sending ``Authorization: Bearer
+    <METRICS_BEARER_TOKEN>`` when that setting is set.
+    """
+    if not request.user.is_staff and not _has_metrics_token(request):
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render_text(), content_type='text/plain; version=0.0.4')
+
+
+def _has_metrics_token(request):
+    token = getattr(settings, 'METRICS_BEARER_TOKEN', None)
+    if not token:
+        return False
+    scheme, _, credentials = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(credentials.encode(), token.encode())
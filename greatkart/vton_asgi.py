@@ -0,0 +1,17 @@
+"""
+ASGI config of the optional try-on sidecar (see virtual_tryon/asgi.py).
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+It serves /vton/ only; the rest of the site stays on greatkart.wsgi.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'greatkart.settings')
+django.setup()
+
+from virtual_tryon.asgi import create_app  # noqa: E402
+
+application = create_app()
@@ -1,3 +1,21 @@
 from django.contrib import admin
+from .models import PersonImage, ProductGarment, TryOnResult
 
-# Register your models here.
+@admin.register(PersonImage)
+class PersonImageAdmin(admin.ModelAdmin):
+    list_display = ['handle', 'user', 'created_at', 'expires_at']
+    search_fields = ['handle', 'content_hash', 'user__username']
+    readonly_fields = ['handle', 'content_hash', 'created_at']
+
+@admin.register(TryOnResult)
+class TryOnResultAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'product', 'size_bytes', 'created_at', 'last_accessed_at']
+    list_filter = ['created_at']
+    search_fields = ['user__username', 'cache_key', 'person_hash', 'cloth_hash']
+    readonly_fields = ['cache_key', 'person_hash', 'cloth_hash', 'size_bytes', 'created_at']
+
+@admin.register(ProductGarment)
+class ProductGarmentAdmin(admin.ModelAdmin):
+    list_display = ['product', 'phash', 'dhash', 'updated_at']
+    search_fields = ['product__product_name', 'phash']
+    readonly_fields = ['phash', 'dhash', 'source_name', 'updated_at']
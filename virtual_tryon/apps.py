@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class VirtualTryonConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'virtual_tryon'
+
+    def ready(self):
+        from . import signals  # noqa: F401
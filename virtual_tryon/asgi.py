@@ -0,0 +1,152 @@
+"""
+Optional ASGI sidecar for the try-on API (/vton/).
+
+Try-on requests spend nearly all their time waiting: for the upload, for the
+upstream generation and for the client to read the answer.  Under WSGI each
+of those waits holds a worker.  This Starlette app receives uploads and sends
+responses on the event loop; the views themselves are not async.  Each one
+runs unchanged in anyio's worker thread pool (anyio.to_thread.run_sync),
+where it generates through the shared cache, single flight and upstream
+limiter.  A CapacityLimiter of VTON_ASGI_MAX_CONCURRENCY tokens caps those
+threads, so one process serves that many try-ons at a time while slow
+uploads and downloads wait on the event loop without a thread; the upstream
+limiter still caps the calls to the AI service.
+
+The upload endpoints (generate_vton, outfit, jobs, batch and person, all
+csrf_exempt) skip Django's middleware stack: only the session is loaded from
+the session store by the session cookie, and the user from the session, as
+SessionMiddleware and AuthenticationMiddleware would.  Every other /vton/ URL,
+e.g. job status polls and event streams, is passed to Django's own ASGI
+handler in the same process, so jobs submitted here can be followed here.
+
+Serve greatkart.vton_asgi:application with any ASGI server, e.g.
+``uvicorn greatkart.vton_asgi:application --port 8001``, and route /vton/ to
+it at the reverse proxy; everything else stays on the WSGI app.
+"""
+from io import BytesIO
+
+import anyio
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.asgi import get_asgi_application
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route, Router
+
+from . import views
+from .uploads import get_max_upload_bytes
+
+PREFIX = '/vton'
+
+# Room for the form fields and multipart framing around the uploaded files
+FORM_OVERHEAD_BYTES = 64 * 1024
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+async def _read_body(request, limit):
+    """Reads the request body, refusing to buffer more than ``limit`` bytes."""
+    content_length = request.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > limit:
+        raise _BodyTooLarge
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) > limit:
+            raise _BodyTooLarge
+    return bytes(body)
+
+
+# Only their request and response hooks are used, never the rest of the stack
+_sessions = SessionMiddleware(lambda request: None)
+_authentication = AuthenticationMiddleware(lambda request: None)
+
+
+def _with_content_length(scope, body):
+    """Returns ``scope`` declaring the size of the body read, which may have been sent chunked."""
+    headers = [
+        (name, value) for name, value in scope['headers']
+        if name not in (b'content-length', b'transfer-encoding')
+    ]
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    return {**scope, 'headers': headers}
+
+
+def _run_view(view, scope, body, kwargs):
+    """Runs a Django view on a request built from the ASGI scope and body (worker thread)."""
+    request = ASGIRequest(_with_content_length(scope, body), BytesIO(body))
+    try:
+        _sessions.process_request(request)
+        _authentication.process_request(request)
+        response = view(request, **kwargs)
+        # Saves a session the view created, e.g. for anonymous person image handles
+        return _sessions.process_response(request, response)
+    finally:
+        close_old_connections()
+
+
+def _to_starlette(response):
+    result = Response(response.content, status_code=response.status_code)
+    result.raw_headers.extend(
+        (name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.items()
+    )
+    for cookie in response.cookies.values():
+        result.raw_headers.append((b'set-cookie', cookie.output(header='').strip().encode('latin-1')))
+    return result
+
+
+_limiter = None
+
+
+def _get_limiter():
+    # Created lazily as it belongs to the running event loop
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(getattr(settings, 'VTON_ASGI_MAX_CONCURRENCY', 64))
+    return _limiter
+
+
+def _endpoint(view):
+    async def endpoint(request):
+        try:
+            body = await _read_body(request, get_max_upload_bytes() + FORM_OVERHEAD_BYTES)
+        except _BodyTooLarge:
+            return JSONResponse(
+                {'error': f'Upload is too large, the limit is {get_max_upload_bytes() // (1024 * 1024)} MB'},
+                status_code=413,
+            )
+        response = await anyio.to_thread.run_sync(
+            _run_view, view, request.scope, body, request.path_params, limiter=_get_limiter()
+        )
+        return _to_starlette(response)
+    return endpoint
+
+
+def create_app():
+    """Returns the sidecar ASGI app; Django must be set up already."""
+    django_app = get_asgi_application()
+
+    async def fallback(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(PREFIX + '/'):
+            await django_app(scope, receive, send)
+        else:
+            # Not served by the sidecar; the proxy should send it to the WSGI app
+            await JSONResponse({'error': 'Not found'}, status_code=404)(scope, receive, send)
+
+    # The views answer other methods with their usual JSON errors
+    methods = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+    return Router(
+        routes=[
+            Route(f'{PREFIX}/generate_vton/', _endpoint(views.generate_vton), methods=methods),
+            Route(f'{PREFIX}/outfit/{{outfit_id:int}}/', _endpoint(views.generate_outfit_tryon), methods=methods),
+            Route(f'{PREFIX}/jobs/', _endpoint(views.submit_vton_job), methods=methods),
+            Route(f'{PREFIX}/batch/', _endpoint(views.submit_vton_batch), methods=methods),
+            Route(f'{PREFIX}/person/', _endpoint(views.register_person_image), methods=methods),
+        ],
+        redirect_slashes=False,
+        default=fallback,
+    )
@@ -0,0 +1,314 @@
+"""
+Try-on generation backends.
+
+VTON_BACKENDS lists the backends in order of preference, much like DATABASES
+or CACHES::
+
+    VTON_BACKENDS = [
+        {
+            'NAME': 'gemini',
+            'BACKEND': 'virtual_tryon.backends.GeminiBackend',
+            'OPTIONS': {'model': 'gemini-2.5-flash-image-preview'},
+        },
+        {'NAME': 'stub', 'BACKEND': 'virtual_tryon.backends.StubBackend'},
+    ]
+
+generate() runs the first backend and fails over to the next one when it
+raises.  With VTON_HEDGE_AFTER set, a backend that has not produced its first
+chunk within that many seconds gets company: the next backend is started as
+well, whichever finishes first wins and the other is told to stop.  It
+returns the winning backend along with the images, so that callers can tell
+fallback results from the preferred backend's.
+
+A backend is a TryOnBackend subclass; a self-hosted model only needs to
+implement generate().
+"""
+import contextvars
+import itertools
+import queue
+import threading
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps
+
+from greatkart import metrics
+from greatkart.genai_clients import get_genai_client
+from greatkart.upstream import get_upstream_limiter
+
+from .imaging import sniff_mime_type
+from .jobs import GENERATING, TEXT, UPLOADING, report_image, report_progress
+
+try:
+    from google.genai import types
+except ImportError:
+    types = None
+
+DEFAULT_MODEL_NAME = 'gemini-2.5-flash-image-preview'
+
+DEFAULT_BACKENDS = [
+    {
+        'NAME': 'gemini',
+        'BACKEND': 'virtual_tryon.backends.GeminiBackend',
+        'OPTIONS': {'model': DEFAULT_MODEL_NAME},
+    },
+]
+
+
+class Attempt:
+    """Signals shared between generate() and one running backend."""
+
+    def __init__(self, cancelled=None):
+        # Set by the backend once the upstream has started answering
+        self.first_chunk = threading.Event()
+        # Set by generate() when another backend has won; the backend should stop early
+        self.cancelled = cancelled or threading.Event()
+
+
+class TryOnBackend:
+    """
+    Base class of try-on backends.
+
+    Args:
+        name: The backend's NAME in VTON_BACKENDS, used in metrics.
+    """
+    # Whether the backend calls the Gemini API and so needs google-genai and an API key
+    uses_genai = False
+
+    def __init__(self, name):
+        self.name = name
+
+    @property
+    def identity(self):
+        """Identifies the backend's results in result cache keys."""
+        return self.name
+
+    def generate(self, images, prompt, attempt):
+        """
+        Returns the images generated from ``images`` (bytes, person first) and ``prompt``.
+
+        Implementations set ``attempt.first_chunk`` when the first part of the
+        answer arrives and should return early once ``attempt.cancelled`` is set.
+        """
+        raise NotImplementedError
+
+
+class GeminiBackend(TryOnBackend):
+    """Streams the try-on from a Gemini image model through the shared client and limiter."""
+    uses_genai = True
+
+    def __init__(self, name, model=DEFAULT_MODEL_NAME):
+        super().__init__(name)
+        self.model = model
+
+    @property
+    def identity(self):
+        return self.model
+
+    def generate(self, images, prompt, attempt):
+        with metrics.span('vton.payload', images=len(images)) as span:
+            contents = [
+                types.Part(inline_data=types.Blob(data=image_data, mime_type=sniff_mime_type(image_data)))
+                for image_data in images
+            ]
+            contents.append(types.Part.from_text(text=prompt))
+            span.bytes = sum(len(image_data) for image_data in images)
+
+        # Shared client, so HTTP connections and TLS sessions are reused between requests
+        client = get_genai_client()
+        config = types.GenerateContentConfig(
+            response_modalities=["IMAGE", "TEXT"],
+        )
+        # Rate limited, and retried on transient errors; a retry re-sends the whole request
+        return get_upstream_limiter().call(
+            f'vton.{self.name}', self._stream_images, client, contents, config, attempt
+        )
+
+    def _stream_images(self, client, contents, config, attempt):
+        """Streams one generation and returns the inline image data it contains."""
+        stream = iter(client.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config=config,
+        ))
+
+        # The request is sent on the first read, so the time to the first chunk covers
+        # the upload and the model's work; the drain covers the rest of the response
+        report_progress(UPLOADING)
+        with metrics.span('vton.upstream.ttfb', model=self.model):
+            first_chunk = next(stream, None)
+        attempt.first_chunk.set()
+        if first_chunk is None:
+            return []
+        report_progress(GENERATING)
+
+        images_data = []
+        with metrics.span('vton.upstream.drain', model=self.model) as span:
+            for chunk in itertools.chain([first_chunk], stream):
+                if attempt.cancelled.is_set():
+                    # Another backend won; stop reading and drop the connection
+                    if hasattr(stream, 'close'):
+                        stream.close()
+                    break
+                if (
+                    chunk.candidates is None
+                    or chunk.candidates[0].content is None
+                    or chunk.candidates[0].content.parts is None
+                ):
+                    continue
+
+                for part in chunk.candidates[0].content.parts:
+                    if part.inline_data and part.inline_data.data:
+                        images_data.append(part.inline_data.data)
+                        # Lets job clients fetch the image before the stream has ended,
+                        # unless another backend won meanwhile
+                        if not attempt.cancelled.is_set():
+                            report_image(part.inline_data.data)
+                    elif part.text:
+                        report_progress(TEXT, text=part.text)
+            span.bytes = sum(len(image_data) for image_data in images_data)
+
+        return images_data
+
+
+class StubBackend(TryOnBackend):
+    """
+    Local deterministic backend for load tests and development.
+
+    Pastes a scaled-down garment onto the person image; the same inputs always
+    give the same output. ``latency`` seconds are waited before answering to
+    imitate an upstream.
+    """
+
+    def __init__(self, name, latency=0):
+        super().__init__(name)
+        self.latency = latency
+
+    def generate(self, images, prompt, attempt):
+        if self.latency and attempt.cancelled.wait(self.latency):
+            return []
+        attempt.first_chunk.set()
+        with Image.open(BytesIO(images[0])) as person, Image.open(BytesIO(images[-1])) as cloth:
+            canvas = ImageOps.exif_transpose(person).convert('RGB')
+            garment = ImageOps.exif_transpose(cloth).convert('RGB')
+            garment.thumbnail((canvas.width // 2, canvas.height // 2))
+            canvas.paste(garment, ((canvas.width - garment.width) // 2, (canvas.height - garment.height) // 2))
+        output = BytesIO()
+        canvas.save(output, format='JPEG', quality=90)
+        image_data = output.getvalue()
+        if attempt.cancelled.is_set():
+            return []
+        report_image(image_data)
+        return [image_data]
+
+
+_backends = None
+_backends_lock = threading.Lock()
+
+
+def get_backends():
+    """Returns the configured backends, in order of preference."""
+    global _backends
+    if _backends is None:
+        with _backends_lock:
+            if _backends is None:
+                _backends = [
+                    import_string(config['BACKEND'])(config['NAME'], **config.get('OPTIONS', {}))
+                    for config in getattr(settings, 'VTON_BACKENDS', DEFAULT_BACKENDS)
+                ]
+    return _backends
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    global _backends
+    if setting == 'VTON_BACKENDS':
+        with _backends_lock:
+            _backends = None
+
+
+def generate(images, prompt, backends=None):
+    """
+    Generates a try-on with the first backend that succeeds, hedging slow ones.
+
+    Returns (backend, images) for the backend whose images were used. Raises
+    the first error if every backend fails.
+    """
+    backends = list(backends or get_backends())
+    hedge_after = getattr(settings, 'VTON_HEDGE_AFTER', None)
+    if hedge_after is None or len(backends) == 1:
+        return _generate_in_order(images, prompt, backends)
+    return _generate_hedged(images, prompt, backends, hedge_after)
+
+
+def _run(backend, images, prompt, attempt):
+    with metrics.span(f'vton.backend.{backend.name}'):
+        return backend.generate(images, prompt, attempt)
+
+
+def _generate_in_order(images, prompt, backends):
+    first_error = None
+    for backend in backends:
+        try:
+            return backend, _run(backend, images, prompt, Attempt())
+        except Exception as e:
+            first_error = first_error or e
+            metrics.incr(f'vton.backend.{backend.name}.failed')
+    raise first_error
+
+
+def _generate_hedged(images, prompt, backends, hedge_after):
+    cancelled = threading.Event()
+    outcomes = queue.Queue()
+    pending = list(backends)
+    attempts = []
+    errors = []
+
+    def start():
+        backend = pending.pop(0)
+        attempt = Attempt(cancelled)
+        attempts.append(attempt)
+        # Keeps the job progress and log fields of the caller in the new thread
+        context = contextvars.copy_context()
+
+        def target():
+            try:
+                outcomes.put((backend, context.run(_run, backend, images, prompt, attempt), None))
+            except Exception as e:
+                outcomes.put((backend, None, e))
+
+        threading.Thread(target=target, name=f'vton-backend-{backend.name}', daemon=True).start()
+        return time.monotonic() + hedge_after
+
+    hedge_at = start()
+    running = 1
+    while running:
+        timeout = max(0, hedge_at - time.monotonic()) if pending else None
+        try:
+            backend, result, error = outcomes.get(timeout=timeout)
+        except queue.Empty:
+            if not any(attempt.first_chunk.is_set() for attempt in attempts):
+                # Nothing has started answering in time: hedge with the next backend
+                metrics.incr('vton.backend.hedged')
+                hedge_at = start()
+                running += 1
+            else:
+                hedge_at = time.monotonic() + hedge_after
+            continue
+
+        running -= 1
+        if error is None:
+            cancelled.set()
+            metrics.incr(f'vton.backend.{backend.name}.won')
+            return backend, result
+        errors.append(error)
+        metrics.incr(f'vton.backend.{backend.name}.failed')
+        if pending and not running:
+            # Fail over straight away instead of waiting for the hedge deadline
+            hedge_at = start()
+            running += 1
+    raise errors[0]
@@ -0,0 +1,196 @@
+"""
+Content-addressed cache of virtual try-on results.
+
+Results are keyed on a hash of the input image bytes, the prompt and the
+model name, so retrying the same person photo against the same garment is
+served from disk instead of running a new upstream generation.  The cache is
+bounded in bytes and evicts the least recently used entries first.
+
+Each entry is a directory ``<root>/<key[:2]>/<key>/`` holding one file per
+generated image.  Entries are written to a temporary directory and renamed
+into place, so readers in other processes never see half-written entries.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+def digest(data):
+    """Returns the hex sha256 digest of a bytes-like object."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(image_digests, prompt, model_name):
+    """Builds the cache key for a generation from per-image digests."""
+    h = hashlib.sha256()
+    for value in (model_name, prompt, *image_digests):
+        h.update(value.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of generated images stored on disk.
+
+    Args:
+        directory: Root directory of the cache.
+        max_bytes: Total size the cache may use before evicting entries.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = None  # key -> size in bytes, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, record_stats=True):
+        """
+        Returns the cached list of images for ``key`` or None.
+
+        Pass record_stats=False for reads that should not count as cache
+        hits or misses, such as serving an already generated result.
+        """
+        path = self._entry_path(key)
+        try:
+            names = sorted(os.listdir(path), key=lambda name: int(name.split('.')[0]))
+            images = []
+            for name in names:
+                with open(os.path.join(path, name), 'rb') as f:
+                    images.append(f.read())
+        except (OSError, ValueError):
+            images = None
+
+        with self._lock:
+            self._load_index()
+            if not images:
+                if record_stats:
+                    self.misses += 1
+                if key in self._entries:
+                    self._size -= self._entries.pop(key)
+                return None
+            if record_stats:
+                self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:
+                # Written by another process since our index was built
+                self._entries[key] = sum(len(image) for image in images)
+                self._size += self._entries[key]
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return images
+
+    def contains(self, key):
+        """Tells whether ``key`` is cached, without reading it or marking it as used."""
+        return os.path.isdir(self._entry_path(key))
+
+    def set(self, key, images):
+        """Stores ``images`` under ``key`` and evicts old entries if needed."""
+        size = sum(len(image) for image in images)
+        if not images or size > self.max_bytes:
+            return
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            for index, image in enumerate(images):
+                with open(os.path.join(temp_path, f'{index}.bin'), 'wb') as f:
+                    f.write(image)
+            os.rename(temp_path, path)
+        except OSError:
+            # Most likely another request stored the same entry first
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+        with self._lock:
+            self._load_index()
+            if key in self._entries:
+                self._size -= self._entries.pop(key)
+            self._entries[key] = size
+            self._size += size
+            self._evict()
+
+    def stats(self):
+        with self._lock:
+            self._load_index()
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+            }
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load_index(self):
+        """Builds the LRU index from the entries already on disk (lock held)."""
+        if self._entries is not None:
+            return
+        found = []
+        os.makedirs(self.directory, exist_ok=True)
+        for prefix in os.listdir(self.directory):
+            prefix_path = os.path.join(self.directory, prefix)
+            if prefix.startswith('.') or not os.path.isdir(prefix_path):
+                continue
+            for key in os.listdir(prefix_path):
+                path = os.path.join(prefix_path, key)
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(path))
+                    found.append((os.stat(path).st_mtime, key, size))
+                except OSError:
+                    continue
+        found.sort()
+        self._entries = OrderedDict((key, size) for _, key, size in found)
+        self._size = sum(size for _, _, size in found)
+        self._evict()
+
+    def _evict(self):
+        """Removes least recently used entries until the cache fits (lock held)."""
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Returns the process-wide result cache, or None when it is disabled."""
+    global _result_cache
+    if not getattr(settings, 'VTON_CACHE_ENABLED', True):
+        return None
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                _result_cache = ResultCache(
+                    directory=getattr(settings, 'VTON_CACHE_DIR', os.path.join(settings.BASE_DIR, 'vton_cache')),
+                    max_bytes=getattr(settings, 'VTON_CACHE_MAX_BYTES', 512 * 1024 * 1024),
+                )
+    return _result_cache
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    global _result_cache
+    if setting in ('VTON_CACHE_DIR', 'VTON_CACHE_MAX_BYTES'):
+        with _result_cache_lock:
+            _result_cache = None
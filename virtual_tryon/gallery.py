@@ -0,0 +1,132 @@
+"""
+Per-user gallery of generated try-ons.
+
+Results of signed-in users are stored as TryOnResult rows with a thumbnail.
+Each user has a storage quota (VTON_GALLERY_QUOTA_BYTES); when it is exceeded
+the least recently accessed results are deleted first.
+"""
+import mimetypes
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from PIL import Image
+
+from .cache import digest, get_result_cache
+from .generation import generate_tryon_result
+from .imaging import sniff_mime_type
+from .models import TryOnResult
+
+THUMBNAIL_SIZE = (256, 256)
+
+
+def generate_and_save(images, prompt, cache_key, user=None, person_hash=None, product=None):
+    """
+    Runs generate_tryon_result and keeps the first image in ``user``'s gallery.
+
+    Returns (images, result_key) like generate_tryon_result. A result the
+    user already has in their gallery is returned without generating it
+    again, even if it has left the result cache, and is put back into the
+    cache for url responses. Anonymous requests (user=None) and results of
+    a fallback backend, which ``cache_key`` does not describe, are not
+    stored.
+    """
+    if user is None:
+        return generate_tryon_result(images, prompt, cache_key=cache_key)
+
+    existing = find_result(user, cache_key)
+    if existing is not None:
+        existing.touch()
+        image_data = existing.read()
+        cache = get_result_cache()
+        if cache is not None and not cache.contains(cache_key):
+            # url responses are served from the result cache
+            cache.set(cache_key, [image_data])
+        return [image_data], cache_key
+
+    generated_images, result_key = generate_tryon_result(images, prompt, cache_key=cache_key)
+    if generated_images and result_key == cache_key:
+        save_result(
+            user, generated_images[0], cache_key,
+            person_hash=person_hash or digest(images[0]),
+            cloth_hash=digest(images[1]),
+            product=product,
+        )
+    return generated_images, result_key
+
+
+def find_result(user, cache_key):
+    """Returns the user's stored result for ``cache_key`` or None."""
+    return TryOnResult.objects.filter(user=user, cache_key=cache_key).first()
+
+
+def save_result(user, image_data, cache_key, person_hash, cloth_hash, product=None):
+    """
+    Stores a generated image in the user's gallery and enforces their quota.
+
+    If the user already has a result for ``cache_key`` it is marked as used
+    and returned instead of storing a duplicate.
+    """
+    existing = find_result(user, cache_key)
+    if existing is not None:
+        existing.touch()
+        return existing
+
+    result = TryOnResult(
+        user=user,
+        product=product,
+        person_hash=person_hash,
+        cloth_hash=cloth_hash,
+        cache_key=cache_key,
+    )
+    try:
+        extension = mimetypes.guess_extension(sniff_mime_type(image_data)) or '.png'
+    except ValueError:
+        extension = '.png'
+    result.image.save(f'{cache_key}{extension}', ContentFile(image_data), save=False)
+    thumbnail = make_thumbnail(image_data)
+    if thumbnail:
+        result.thumbnail.save(f'{cache_key}.jpg', ContentFile(thumbnail), save=False)
+    result.size_bytes = len(image_data) + len(thumbnail or b'')
+
+    try:
+        with transaction.atomic():
+            result.save()
+    except IntegrityError:
+        # Stored concurrently by another request for the same inputs
+        result.image.delete(save=False)
+        result.thumbnail.delete(save=False)
+        return find_result(user, cache_key)
+
+    enforce_quota(user)
+    return result
+
+
+def make_thumbnail(image_data):
+    """Returns a JPEG thumbnail of ``image_data``, or None if it cannot be decoded."""
+    try:
+        with Image.open(BytesIO(image_data)) as image:
+            image.thumbnail(THUMBNAIL_SIZE)
+            output = BytesIO()
+            image.convert('RGB').save(output, format='JPEG', quality=80)
+    except (OSError, ValueError):
+        return None
+    return output.getvalue()
+
+
+def enforce_quota(user):
+    """Deletes the user's least recently accessed results until they fit their quota."""
+    quota = getattr(settings, 'VTON_GALLERY_QUOTA_BYTES', 50 * 1024 * 1024)
+    results = TryOnResult.objects.filter(user=user)
+    used = results.aggregate(total=Sum('size_bytes'))['total'] or 0
+    if used <= quota:
+        return
+    # Never evict the newest result, which was just stored
+    newest = results.order_by('-created_at').values_list('pk', flat=True).first()
+    for result in list(results.exclude(pk=newest).order_by('last_accessed_at')):
+        if used <= quota:
+            break
+        used -= result.size_bytes
+        result.delete()
@@ -0,0 +1,79 @@
+"""
+Try-on data derived from store products.
+
+When a product is saved with a new image, its garment image is prepared
+once (cropped, downscaled and re-encoded, see imaging.prepare_garment) and
+stored as a ProductGarment together with its content hash and the
+perceptual hashes used to recognise the product in uploads.  Try-ons of the
+product then send the stored garment image as is and build their cache key
+from the stored hash, instead of reading and re-encoding the original.
+"""
+import mimetypes
+
+from django.core.files.base import ContentFile
+
+from greatkart import metrics
+
+from .cache import digest
+from .imaging import prepare_garment, sniff_mime_type
+from .models import ProductGarment
+from .phash import colour_signature, dhash, phash, to_hex
+
+
+def update_product_garment(product, force=False):
+    """
+    Computes the ProductGarment of ``product``; returns it, or None without an image.
+
+    Unless ``force`` is set nothing is recomputed while the image is unchanged.
+    """
+    if not product.images:
+        for garment in ProductGarment.objects.filter(product=product):
+            garment.delete()
+        return None
+    garment = ProductGarment.objects.filter(product=product).first()
+    if (
+        garment is not None and garment.source_name == product.images.name
+        and garment.image and garment.colours and not force
+    ):
+        return garment
+
+    with metrics.span('vton.garment.prepare', product=product.pk) as span:
+        with product.images.open('rb') as f:
+            image_data = f.read()
+        garment_data = prepare_garment(image_data)
+        span.bytes = len(garment_data)
+
+    if garment is None:
+        garment = ProductGarment(product=product)
+    old_image = garment.image.name if garment.image else None
+    content_hash = digest(garment_data)
+    extension = mimetypes.guess_extension(sniff_mime_type(garment_data)) or '.jpg'
+    garment.image.save(f'{product.pk}-{content_hash[:16]}{extension}', ContentFile(garment_data), save=False)
+    garment.content_hash = content_hash
+    # Hashed from the original, which is what shoppers re-upload
+    garment.phash = to_hex(phash(image_data))
+    garment.dhash = to_hex(dhash(image_data))
+    garment.colours = colour_signature(image_data).hex()
+    garment.source_name = product.images.name
+    garment.save()
+    if old_image and old_image != garment.image.name:
+        garment.image.storage.delete(old_image)
+    return garment
+
+
+def get_garment(product):
+    """
+    Returns the up-to-date ProductGarment of ``product``, preparing it if missing.
+
+    Returns None if the product has no image.
+    """
+    garment = ProductGarment.objects.filter(product=product).first()
+    if garment is None or garment.source_name != product.images.name or not garment.image:
+        garment = update_product_garment(product)
+    return garment
+
+
+def read_garment(product):
+    """Returns (garment image bytes, their sha256 digest) for a store product with an image."""
+    garment = get_garment(product)
+    return garment.read(), garment.content_hash
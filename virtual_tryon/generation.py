@@ -0,0 +1,114 @@
+from django.conf import settings
+
+from greatkart import metrics
+
+from . import backends
+from .cache import digest, get_result_cache, make_key
+from .imaging import normalize_image
+from .singleflight import get_single_flight
+
+# Test import at module level to catch issues early; the Gemini backend imports it itself
+try:
+    import google.genai  # noqa: F401
+    GOOGLE_GENAI_IMPORT_SUCCESS = True
+    GOOGLE_GENAI_IMPORT_ERROR = None
+except ImportError as e:
+    GOOGLE_GENAI_IMPORT_SUCCESS = False
+    GOOGLE_GENAI_IMPORT_ERROR = str(e)
+
+# Use the exact prompt from working implementation
+VTON_PROMPT = "Combine the subjects of these images in a natural way, producing a new image."
+
+# Outfit try-ons send the person first and then every garment of the outfit in one call
+VTON_OUTFIT_PROMPT = (
+    "Dress the person from the first image in all of the clothing, shoes and accessories "
+    "shown in the other images, worn together as one outfit, producing a new natural photo of them."
+)
+
+def _prepare_images(images):
+    """Normalizes input images before upload, if enabled in settings."""
+    if not getattr(settings, 'VTON_NORMALIZE_ENABLED', True):
+        return images
+    return [normalize_image(image) for image in images]
+
+def get_tryon_key(images, prompt=VTON_PROMPT, digests=None):
+    """
+    Returns the result cache key for generating from ``images`` with ``prompt``.
+
+    ``digests`` may supply known sha256 digests of the original images (None
+    for the ones to compute), e.g. for a stored person image whose bytes were
+    normalized after upload.
+    """
+    digests = digests or [None] * len(images)
+    return make_key(
+        [known or digest(image) for image, known in zip(images, digests)],
+        prompt,
+        # Results of other backends are stored under their own key (see fallback_key)
+        backends.get_backends()[0].identity,
+    )
+
+def generate_tryon(images, prompt=VTON_PROMPT, cache_key=None):
+    """
+    Generates a try-on from in-memory images, serving repeats from the result cache.
+    Identical requests arriving while a generation is running wait for it
+    instead of starting another one.
+
+    Args:
+        images: A list of image bytes, person image first.
+        prompt: The prompt for remixing the images.
+        cache_key: The result of get_tryon_key, if the caller already has it.
+
+    Returns:
+        List of generated images data
+    """
+    generated_images, _ = generate_tryon_result(images, prompt, cache_key)
+    return generated_images
+
+def generate_tryon_result(images, prompt=VTON_PROMPT, cache_key=None):
+    """
+    Like generate_tryon, but returns (images, result_key).
+
+    ``result_key`` is the result cache key the images are stored under. It is
+    the given key unless a fallback or hedged backend produced the images:
+    as the key names the preferred backend, those are stored under
+    fallback_key() instead, and should not be stored under the key elsewhere
+    either.
+    """
+    key = cache_key or get_tryon_key(images, prompt)
+    cache = get_result_cache()
+    if cache is not None:
+        generated_images = cache.get(key)
+        if generated_images is not None:
+            return generated_images, key
+
+    lookup = (lambda: _from_cache(cache, key)) if cache is not None else None
+    return get_single_flight().do(key, _generate_uncached, images, prompt, key, lookup=lookup)
+
+def fallback_key(key, backend):
+    """Result cache key of a generation for ``key`` that ``backend`` produced instead of the preferred one."""
+    return digest(f'{key}\0{backend.identity}'.encode('utf-8'))
+
+def _from_cache(cache, key):
+    generated_images = cache.get(key, record_stats=False)
+    return None if generated_images is None else (generated_images, key)
+
+def _generate_uncached(images, prompt, key):
+    """Runs the upstream generation and stores its result in the result cache."""
+    cache = get_result_cache()
+    if cache is not None:
+        # A concurrent leader may have finished just before we took over
+        cached = _from_cache(cache, key)
+        if cached is not None:
+            return cached
+
+    with metrics.span('vton.prepare') as span:
+        prepared = _prepare_images(images)
+        span.bytes = sum(len(image_data) for image_data in prepared)
+    backend, generated_images = backends.generate(prepared, prompt)
+    result_key = key
+    if backend is not backends.get_backends()[0]:
+        metrics.incr('vton.cache.fallback')
+        result_key = fallback_key(key, backend)
+    if cache is not None:
+        cache.set(result_key, generated_images)
+    return generated_images, result_key
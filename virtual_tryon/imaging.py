@@ -0,0 +1,163 @@
+"""
+Normalization of try-on input images before they are sent upstream.
+
+Phone photos are often 8-12 MP and several megabytes, far more than the model
+needs.  Images are rotated according to their EXIF orientation, downscaled so
+their longest edge fits VTON_NORMALIZE_MAX_EDGE and re-encoded.  JPEGs are
+decoded in draft mode, letting libjpeg scale them down by a power of two while
+decoding instead of materialising the full-resolution bitmap.
+"""
+import time
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image, ImageChops, ImageOps
+
+from greatkart import metrics
+
+# Formats that are decoded and re-encoded; anything else is passed through untouched
+NORMALIZED_FORMATS = ('JPEG', 'PNG', 'WEBP')
+
+# EXIF tag holding the camera orientation
+ORIENTATION_TAG = 0x0112
+
+# Garment images: how far a pixel may differ from the backdrop colour and still count
+# as backdrop, and the margin kept around the garment, as a share of its size
+GARMENT_BACKDROP_TOLERANCE = 16
+GARMENT_MARGIN = 0.04
+
+
+def normalize_image(image_data, max_edge=None, quality=None):
+    """
+    Returns a reoriented, downscaled and re-encoded copy of ``image_data``.
+
+    Images with transparency are written as PNG, everything else as JPEG.
+    The original bytes are returned when the image cannot be decoded or when
+    re-encoding would not make it any smaller.
+    """
+    if max_edge is None:
+        max_edge = getattr(settings, 'VTON_NORMALIZE_MAX_EDGE', 1024)
+    if quality is None:
+        quality = getattr(settings, 'VTON_NORMALIZE_QUALITY', 85)
+
+    start = time.perf_counter()
+    result = _normalize(image_data, max_edge, quality)
+    metrics.observe('vton.normalize.seconds', time.perf_counter() - start)
+    metrics.incr('vton.normalize.images')
+    metrics.incr('vton.normalize.bytes_in', len(image_data))
+    metrics.incr('vton.normalize.bytes_out', len(result))
+    return result
+
+
+def _normalize(image_data, max_edge, quality):
+    try:
+        with Image.open(BytesIO(image_data)) as image:
+            if image.format not in NORMALIZED_FORMATS:
+                return image_data
+            changed = max(image.size) > max_edge or image.getexif().get(ORIENTATION_TAG, 1) != 1
+            if image.format == 'JPEG':
+                image.draft('RGB', (max_edge, max_edge))
+            oriented = ImageOps.exif_transpose(image)
+            oriented.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+            output = BytesIO()
+            if oriented.mode in ('RGBA', 'LA') or 'transparency' in oriented.info:
+                oriented.save(output, format='PNG', optimize=True)
+            else:
+                oriented.convert('RGB').save(
+                    output, format='JPEG', quality=quality, optimize=True
+                )
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return image_data
+
+    normalized = output.getvalue()
+    if not changed and len(normalized) >= len(image_data):
+        return image_data
+    return normalized
+
+
+def fit_to_budget(images, max_bytes, max_edge=None, min_edge=256, quality=None):
+    """
+    Downscales ``images`` until together they take at most ``max_bytes``.
+
+    Images already within the budget are returned untouched. Otherwise every
+    round re-encodes the originals with a longest edge a quarter shorter, down
+    to ``min_edge``; the smallest versions are returned if even those are too big.
+    """
+    if max_edge is None:
+        max_edge = getattr(settings, 'VTON_NORMALIZE_MAX_EDGE', 1024)
+    if quality is None:
+        quality = getattr(settings, 'VTON_NORMALIZE_QUALITY', 85)
+
+    fitted = images
+    edge = max_edge
+    while sum(len(image_data) for image_data in fitted) > max_bytes and edge >= min_edge:
+        fitted = [_normalize(image_data, edge, quality) for image_data in images]
+        edge = int(edge * 0.75)
+    return fitted
+
+
+def prepare_garment(image_data, max_edge=None, quality=None):
+    """
+    Returns a try-on-ready copy of a product image.
+
+    The image is reoriented, cropped to the garment by trimming the uniform
+    backdrop around it (the colour of the top-left pixel, or transparency),
+    downscaled to VTON_GARMENT_MAX_EDGE and encoded as JPEG, or PNG when it
+    has transparency.  Raises OSError or ValueError for undecodable images.
+    """
+    if max_edge is None:
+        max_edge = getattr(settings, 'VTON_GARMENT_MAX_EDGE', 1024)
+    if quality is None:
+        quality = getattr(settings, 'VTON_GARMENT_QUALITY', 90)
+
+    with Image.open(BytesIO(image_data)) as image:
+        image = ImageOps.exif_transpose(image)
+        transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+
+    image = image.crop(_garment_box(image, transparent))
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    output = BytesIO()
+    if transparent:
+        image.save(output, format='PNG', optimize=True)
+    else:
+        image.save(output, format='JPEG', quality=quality, optimize=True)
+    return output.getvalue()
+
+
+def _garment_box(image, transparent):
+    """The bounding box of everything but the backdrop, with a margin; the whole image if it is all backdrop."""
+    if transparent:
+        box = image.getchannel('A').getbbox()
+    else:
+        backdrop = Image.new('RGB', image.size, image.getpixel((0, 0)))
+        difference = ImageChops.difference(image, backdrop).convert('L')
+        box = difference.point(lambda value: 255 if value > GARMENT_BACKDROP_TOLERANCE else 0).getbbox()
+    if box is None:
+        return (0, 0, image.width, image.height)
+    left, top, right, bottom = box
+    margin_x = round((right - left) * GARMENT_MARGIN)
+    margin_y = round((bottom - top) * GARMENT_MARGIN)
+    return (
+        max(0, left - margin_x),
+        max(0, top - margin_y),
+        min(image.width, right + margin_x),
+        min(image.height, bottom + margin_y),
+    )
+
+
+def sniff_mime_type(image_data):
+    """Identifies the image format from its leading bytes."""
+    header = bytes(image_data[:16])
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if header[4:8] == b'ftyp' and header[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return 'image/heic'
+    raise ValueError("Could not determine MIME type: unsupported image format")
@@ -0,0 +1,332 @@
+"""
+Background job queue for virtual try-on generation.
+
+Try-on requests submitted in job mode are run by a small pool of daemon
+worker threads owned by the web process, so the request worker that accepted
+the upload is released immediately.  The pool size and the number of jobs
+allowed to wait are bounded by settings so that try-on traffic cannot take
+over the whole server.
+
+A batch is a group of jobs of which at most ``concurrency`` are queued or
+running at any time; finishing one releases the next.  Every item is an
+ordinary job, so results can be collected as soon as each one completes and
+a failing item does not affect the others.
+
+While it runs, a job collects progress events (queued, uploading,
+generating, text, image, done/failed) that clients can follow as a
+server-sent event stream.  Code running inside a job reports them with
+report_progress() and report_image(), which do nothing outside a job.
+
+Jobs live in the memory of the process that accepted them: run gunicorn with
+a single worker process and ``--threads`` (or use sticky routing) so that
+status polls reach the same process.
+"""
+import contextvars
+import logging
+import queue
+import threading
+from collections import deque
+import time
+import uuid
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+# Progress events; the statuses above double as events
+UPLOADING = 'uploading'
+GENERATING = 'generating'
+TEXT = 'text'
+IMAGE = 'image'
+
+# The job being run by the current worker thread
+_current_job = contextvars.ContextVar('current_tryon_job', default=None)
+
+
+class QueueFull(Exception):
+    """Raised when the job queue already holds the maximum number of jobs."""
+
+
+class TryOnJob:
+    """A single unit of work and its outcome."""
+
+    def __init__(self, func, args, kwargs):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        # Result cache key the generated images are stored under, set by the job function
+        self.cache_key = None
+        # What the job generates, e.g. {'product_id': 3}, set by the submitter
+        self.label = {}
+        # Who may follow the job, e.g. 'user:3', set by the submitter
+        self.owner = None
+        self.batch = None
+        # First generated image, available before the job has finished
+        self.first_image = None
+        self.events = []
+        self._events_changed = threading.Condition()
+        self.add_event(QUEUED)
+
+    @property
+    def is_finished(self):
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self):
+        """Status information that is safe to hand back to the client."""
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+    def add_event(self, event, **data):
+        """Appends a progress event and wakes up everybody waiting for one."""
+        with self._events_changed:
+            self.events.append({'id': len(self.events), 'event': event, 'data': data})
+            self._events_changed.notify_all()
+
+    def wait_for_events(self, after, timeout):
+        """
+        Returns the events with an id of ``after`` or more, waiting up to
+        ``timeout`` seconds for one if there are none yet.
+        """
+        with self._events_changed:
+            self._events_changed.wait_for(lambda: len(self.events) > after, timeout)
+            return self.events[after:]
+
+    def run(self):
+        self.status = RUNNING
+        self.started_at = time.time()
+        self.add_event(RUNNING)
+        token = _current_job.set(self)
+        try:
+            self.result = self.func(*self.args, **self.kwargs)
+            self.status = DONE
+        except Exception as e:
+            self.error = str(e)
+            self.status = FAILED
+            logger.exception('Try-on job %s failed', self.id)
+        finally:
+            _current_job.reset(token)
+            self.finished_at = time.time()
+            # Drop references to the (potentially large) inputs
+            self.args = ()
+            self.kwargs = {}
+        if self.status == DONE:
+            self.add_event(DONE, images=len(self.result or []))
+        else:
+            self.add_event(FAILED, error=self.error)
+
+
+def current_job():
+    """Returns the job running in this thread, or None."""
+    return _current_job.get()
+
+
+def report_progress(event, **data):
+    """Adds a progress event to the job running in this thread, if any."""
+    job = _current_job.get()
+    if job is not None:
+        job.add_event(event, **data)
+
+
+def report_image(image_data):
+    """Makes the first image generated by the running job available straight away."""
+    job = _current_job.get()
+    if job is not None and job.first_image is None:
+        job.first_image = image_data
+        job.add_event(IMAGE)
+
+
+class TryOnBatch:
+    """A group of jobs released to the queue a few at a time."""
+
+    def __init__(self, jobs, concurrency):
+        self.id = uuid.uuid4().hex
+        self.jobs = jobs
+        self.concurrency = concurrency
+        self.created_at = time.time()
+        self.owner = None
+        self._pending = deque(jobs)
+
+    @property
+    def is_finished(self):
+        return all(job.is_finished for job in self.jobs)
+
+    @property
+    def finished_at(self):
+        if not self.is_finished:
+            return None
+        return max(job.finished_at for job in self.jobs)
+
+    def to_dict(self):
+        return {
+            'batch_id': self.id,
+            'status': DONE if self.is_finished else RUNNING,
+            'total': len(self.jobs),
+            'completed': sum(1 for job in self.jobs if job.status == DONE),
+            'failed': sum(1 for job in self.jobs if job.status == FAILED),
+            'created_at': self.created_at,
+        }
+
+
+class JobQueue:
+    """
+    Bounded FIFO queue served by a fixed number of worker threads.
+
+    Args:
+        workers: Number of worker threads running jobs concurrently.
+        max_depth: Maximum number of jobs waiting to start.
+        result_ttl: Seconds a finished job is kept for polling.
+    """
+
+    def __init__(self, workers=2, max_depth=20, result_ttl=600):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.result_ttl = result_ttl
+        # Depth is enforced in submit() so that batches can release their
+        # remaining jobs without being refused
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._batches = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, func, *args, **kwargs):
+        """Queues ``func(*args, **kwargs)`` and returns its job."""
+        self._ensure_workers()
+        self._prune()
+        job = TryOnJob(func, args, kwargs)
+        with self._lock:
+            if self._queue.qsize() >= self.max_depth:
+                raise QueueFull('Too many try-on jobs are waiting, please retry shortly')
+            self._jobs[job.id] = job
+            self._queue.put(job)
+        return job
+
+    def submit_batch(self, func, calls, concurrency):
+        """
+        Queues ``func(*args, **kwargs)`` for each ``(args, kwargs)`` in ``calls``,
+        running at most ``concurrency`` of them at the same time.
+
+        Returns the batch; its jobs are in the same order as ``calls``.
+        """
+        self._ensure_workers()
+        self._prune()
+        jobs = [TryOnJob(func, args, kwargs) for args, kwargs in calls]
+        batch = TryOnBatch(jobs, max(1, concurrency))
+        for job in jobs:
+            job.batch = batch
+        with self._lock:
+            initial = min(batch.concurrency, len(jobs))
+            if self._queue.qsize() + initial > self.max_depth:
+                raise QueueFull('Too many try-on jobs are waiting, please retry shortly')
+            self._batches[batch.id] = batch
+            for job in jobs:
+                self._jobs[job.id] = job
+            for _ in range(initial):
+                self._queue.put(batch._pending.popleft())
+        return batch
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+        return {
+            'workers': self.workers,
+            'max_depth': self.max_depth,
+            'queued': self._queue.qsize(),
+            'running': running,
+        }
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._work, name=f'vton-job-worker-{index}', daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                job.run()
+                if job.batch is not None:
+                    self._release_next(job.batch)
+            finally:
+                # Jobs may use the database; don't keep broken or expired connections around
+                close_old_connections()
+                self._queue.task_done()
+
+    def _release_next(self, batch):
+        """Queues the next waiting job of ``batch`` now that one has finished."""
+        with self._lock:
+            if batch._pending:
+                self._queue.put(batch._pending.popleft())
+
+    def _prune(self):
+        """Forgets finished jobs whose results have not been collected in time."""
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.is_finished and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                del self._jobs[job_id]
+            expired = [
+                batch_id for batch_id, batch in self._batches.items()
+                if batch.is_finished and batch.finished_at < cutoff
+            ]
+            for batch_id in expired:
+                del self._batches[batch_id]
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Returns the process-wide job queue, creating it from settings on first use."""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue(
+                    workers=getattr(settings, 'VTON_JOB_WORKERS', 2),
+                    max_depth=getattr(settings, 'VTON_JOB_QUEUE_DEPTH', 20),
+                    result_ttl=getattr(settings, 'VTON_JOB_RESULT_TTL', 600),
+                )
+    return _job_queue
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from virtual_tryon.models import PersonImage
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired person image handles and their stored photos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many handles would be deleted.',
+        )
+
+    def handle(self, *args, **options):
+        expired = PersonImage.objects.filter(expires_at__lte=timezone.now())
+        count = expired.count()
+        if options['dry_run']:
+            self.stdout.write(f'{count} expired person image(s) would be deleted.')
+            return
+
+        # Delete one by one so the stored files are removed as well
+        for person_image in expired.iterator():
+            person_image.delete()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {count} expired person image(s).'))
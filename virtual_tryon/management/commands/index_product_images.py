@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from store.models import Product
+from virtual_tryon.garments import update_product_garment
+
+
+class Command(BaseCommand):
+    help = 'Prepares the try-on garment images and perceptual hashes of store products.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Recompute products whose image has not changed as well.',
+        )
+
+    def handle(self, *args, **options):
+        indexed = failed = 0
+        for product in Product.objects.exclude(images='').iterator():
+            try:
+                update_product_garment(product, force=options['force'])
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                failed += 1
+                self.stderr.write(f'{product}: {e}')
+            else:
+                indexed += 1
+        self.stdout.write(self.style.SUCCESS(f'Prepared {indexed} product garment(s), {failed} failed.'))
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:13
+
+import django.db.models.deletion
+import virtual_tryon.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('handle', models.CharField(default=virtual_tryon.models._new_handle, editable=False, max_length=32, unique=True)),
+                ('session_key', models.CharField(blank=True, max_length=40)),
+                ('image', models.ImageField(upload_to='vton/persons/')),
+                ('content_hash', models.CharField(db_index=True, help_text='sha256 of the original upload, so cached results are shared with direct uploads', max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True, default=virtual_tryon.models._person_image_expiry)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='person_images', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
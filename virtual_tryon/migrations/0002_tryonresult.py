@@ -0,0 +1,38 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:14
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_variation'),
+        ('virtual_tryon', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TryOnResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('image', models.ImageField(upload_to='vton/results/')),
+                ('thumbnail', models.ImageField(blank=True, upload_to='vton/results/thumbnails/')),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('person_hash', models.CharField(db_index=True, max_length=64)),
+                ('cloth_hash', models.CharField(max_length=64)),
+                ('cache_key', models.CharField(db_index=True, max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_accessed_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tryon_results', to='store.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tryon_results', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'constraints': [models.UniqueConstraint(fields=('user', 'cache_key'), name='unique_tryon_result_per_user')],
+            },
+        ),
+    ]
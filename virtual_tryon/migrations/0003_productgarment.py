@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0002_variation'),
+        ('virtual_tryon', '0002_tryonresult'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductGarment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phash', models.CharField(db_index=True, max_length=16)),
+                ('dhash', models.CharField(max_length=16)),
+                ('source_name', models.CharField(max_length=255)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='garment', to='store.product')),
+            ],
+        ),
+    ]
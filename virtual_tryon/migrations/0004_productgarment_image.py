@@ -0,0 +1,25 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('virtual_tryon', '0003_productgarment'),
+    ]
+
+    operations = [
+        # Garments indexed before this have no image yet; they are prepared on first use
+        # or by `python manage.py index_product_images --force`
+        migrations.AddField(
+            model_name='productgarment',
+            name='image',
+            field=models.ImageField(default='', upload_to='vton/garments/'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='productgarment',
+            name='content_hash',
+            field=models.CharField(default='', help_text='sha256 of the garment image, used in result cache keys', max_length=64),
+            preserve_default=False,
+        ),
+    ]
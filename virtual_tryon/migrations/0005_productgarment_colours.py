@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 12:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('virtual_tryon', '0004_productgarment_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productgarment',
+            name='colours',
+            field=models.CharField(blank=True, max_length=96),
+        ),
+    ]
@@ -1,3 +1,127 @@
+import uuid
+from datetime import timedelta
+
 from django.db import models
+from django.conf import settings
+from django.utils import timezone
+
+
+def _new_handle():
+    return uuid.uuid4().hex
+
+
+def _person_image_expiry():
+    return timezone.now() + timedelta(seconds=getattr(settings, 'VTON_PERSON_HANDLE_TTL', 24 * 60 * 60))
+
+
+class PersonImage(models.Model):
+    """A normalized person photo uploaded once and reused by handle for many try-ons"""
+    handle = models.CharField(max_length=32, unique=True, default=_new_handle, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, blank=True, null=True,
+                             related_name='person_images')
+    # Owner of handles registered by anonymous visitors
+    session_key = models.CharField(max_length=40, blank=True)
+
+    image = models.ImageField(upload_to='vton/persons/')
+    content_hash = models.CharField(max_length=64, db_index=True,
+                                    help_text="sha256 of the original upload, so cached results are shared with direct uploads")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=_person_image_expiry, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return self.handle
+
+    def is_expired(self):
+        return self.expires_at <= timezone.now()
+
+    def is_owned_by(self, request):
+        """Checks that ``request`` comes from the user or session that registered the image"""
+        if self.user_id is not None:
+            return request.user.is_authenticated and request.user.pk == self.user_id
+        return bool(self.session_key) and self.session_key == request.session.session_key
+
+    def read(self):
+        """Returns the stored image bytes"""
+        with self.image.open('rb') as f:
+            return f.read()
+
+    def delete(self, *args, **kwargs):
+        # Remove the stored file together with the row
+        self.image.delete(save=False)
+        return super().delete(*args, **kwargs)
+
+
+class TryOnResult(models.Model):
+    """A generated try-on image kept in the user's gallery"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tryon_results')
+
+    image = models.ImageField(upload_to='vton/results/')
+    thumbnail = models.ImageField(upload_to='vton/results/thumbnails/', blank=True)
+    # Stored size of image and thumbnail, counted against the user's quota
+    size_bytes = models.PositiveIntegerField(default=0)
+
+    # What produced the result
+    product = models.ForeignKey('store.Product', on_delete=models.SET_NULL, blank=True, null=True,
+                                related_name='tryon_results')
+    person_hash = models.CharField(max_length=64, db_index=True)
+    cloth_hash = models.CharField(max_length=64)
+    cache_key = models.CharField(max_length=64, db_index=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'cache_key'], name='unique_tryon_result_per_user'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}'s try-on {self.pk}"
+
+    def read(self):
+        """Returns the stored image bytes"""
+        with self.image.open('rb') as f:
+            return f.read()
+
+    def touch(self):
+        """Marks the result as recently used, protecting it from eviction"""
+        self.last_accessed_at = timezone.now()
+        TryOnResult.objects.filter(pk=self.pk).update(last_accessed_at=self.last_accessed_at)
+
+    def delete(self, *args, **kwargs):
+        # Remove the stored files together with the row
+        self.image.delete(save=False)
+        self.thumbnail.delete(save=False)
+        return super().delete(*args, **kwargs)
+
+
+class ProductGarment(models.Model):
+    """Try-on data derived from a store product's image, kept up to date by signals"""
+    product = models.OneToOneField('store.Product', on_delete=models.CASCADE, related_name='garment')
+
+    # The product image cropped, downscaled and re-encoded for try-on, sent instead of the original
+    image = models.ImageField(upload_to='vton/garments/')
+    content_hash = models.CharField(max_length=64, help_text="sha256 of the garment image, used in result cache keys")
+
+    # Perceptual hashes (hex) used to recognise re-encoded copies of the product image in uploads
+    phash = models.CharField(max_length=16, db_index=True)
+    dhash = models.CharField(max_length=16)
+    # 4x4 RGB thumbnail (hex) telling colour variants with the same hashes apart
+    colours = models.CharField(max_length=96, blank=True)
+    # Name of the product image the data was computed from
+    source_name = models.CharField(max_length=255)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Garment of {self.product}"
 
-# Create your models here.
+    def read(self):
+        """Returns the stored garment image bytes"""
+        with self.image.open('rb') as f:
+            return f.read()
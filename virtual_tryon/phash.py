@@ -0,0 +1,259 @@
+"""
+Perceptual hashes of garment images and matching of uploads to store products.
+
+Shoppers upload the same product shot over and over, re-saved, resized or
+recompressed along the way, so the bytes (and the result cache key) differ
+each time.  A perceptual hash summarises what the image looks like in 64 bits
+and barely changes under such re-encodes:
+
+- dHash compares the brightness of neighbouring pixels of a 9x8 thumbnail,
+- pHash keeps the signs of the lowest 8x8 DCT frequencies of a 32x32
+  thumbnail relative to their median.
+
+Both only look at brightness, so colour variants of the same cut (a brown
+and a yellow jacket) can hash alike.  A 4x4 RGB thumbnail, the colour
+signature, tells those apart.
+
+Every store product with an image gets both hashes and its colour signature
+(ProductGarment).  An upload is matched when a product's pHash is within
+VTON_PHASH_MAX_DISTANCE bits of the upload's, its dHash within
+VTON_DHASH_MAX_DISTANCE bits and its colour signature within
+VTON_COLOUR_MAX_DISTANCE (mean difference per channel, 0-255); the pHash
+lookup goes through a BK-tree so it does not scan the whole catalogue.
+"""
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+from greatkart import metrics
+
+HASH_BITS = 64
+DHASH_SIZE = (9, 8)
+PHASH_SIZE = 32
+PHASH_LOW_FREQUENCIES = 8
+COLOUR_SIZE = (4, 4)
+
+
+def _thumbnail(image_data, size, mode):
+    """Decodes ``image_data`` into a ``mode`` image of ``size`` (width, height)."""
+    with Image.open(BytesIO(image_data)) as image:
+        if image.format == 'JPEG':
+            # Let libjpeg scale down while decoding; the thumbnail is tiny anyway
+            image.draft(mode, (size[0] * 4, size[1] * 4))
+        image = ImageOps.exif_transpose(image).convert(mode)
+        return image.resize(size, Image.BILINEAR)
+
+
+def _grayscale(image_data, size):
+    """Decodes ``image_data`` into a grayscale float array of ``size`` (width, height)."""
+    return np.asarray(_thumbnail(image_data, size, 'L'), dtype=np.float64)
+
+
+def _to_int(bits):
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image_data):
+    """Returns the 64-bit difference hash of an image."""
+    pixels = _grayscale(image_data, DHASH_SIZE)
+    return _to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def _dct_matrix(size):
+    """Orthonormal DCT-II basis, so the 2D transform is two matrix products."""
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[np.newaxis, :] + 1) * n[:, np.newaxis] / (2 * size))
+    matrix[0] *= np.sqrt(1 / size)
+    matrix[1:] *= np.sqrt(2 / size)
+    return matrix
+
+
+_DCT = _dct_matrix(PHASH_SIZE)
+
+
+def phash(image_data):
+    """Returns the 64-bit perceptual (DCT) hash of an image."""
+    pixels = _grayscale(image_data, (PHASH_SIZE, PHASH_SIZE))
+    frequencies = (_DCT @ pixels @ _DCT.T)[:PHASH_LOW_FREQUENCIES, :PHASH_LOW_FREQUENCIES]
+    # The DC term only reflects overall brightness and would skew the median
+    median = np.median(frequencies.ravel()[1:])
+    return _to_int(frequencies > median)
+
+
+def colour_signature(image_data):
+    """Returns the 48 bytes of a 4x4 RGB thumbnail of an image."""
+    return _thumbnail(image_data, COLOUR_SIZE, 'RGB').tobytes()
+
+
+def colour_distance(a, b):
+    """Mean difference per channel (0-255) between two colour signatures."""
+    return float(np.mean(np.abs(
+        np.frombuffer(a, dtype=np.uint8).astype(np.int16) - np.frombuffer(b, dtype=np.uint8).astype(np.int16)
+    )))
+
+
+def hamming(a, b):
+    """Number of bits in which two hashes differ."""
+    return (a ^ b).bit_count()
+
+
+def to_hex(value):
+    return f'{value:016x}'
+
+
+def from_hex(value):
+    return int(value, 16)
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of 64-bit hashes for Hamming-distance range queries.
+
+    Each node keeps the values added under its exact hash, so duplicate
+    product shots share a node.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, hash_value, value):
+        self._size += 1
+        if self._root is None:
+            self._root = (hash_value, [value], {})
+            return
+        node = self._root
+        while True:
+            node_hash, values, children = node
+            distance = hamming(hash_value, node_hash)
+            if distance == 0:
+                values.append(value)
+                return
+            child = children.get(distance)
+            if child is None:
+                children[distance] = (hash_value, [value], {})
+                return
+            node = child
+
+    def search(self, hash_value, max_distance):
+        """Returns (distance, value) pairs within ``max_distance`` bits, closest first."""
+        found = []
+        pending = [self._root] if self._root is not None else []
+        while pending:
+            node_hash, values, children = pending.pop()
+            distance = hamming(hash_value, node_hash)
+            if distance <= max_distance:
+                found.extend((distance, value) for value in values)
+            # By the triangle inequality only these subtrees can hold matches
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    pending.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class ProductIndex:
+    """BK-tree of the pHashes of all store products, with their dHashes and colours for verification."""
+
+    def __init__(self, garments):
+        self.tree = BKTree()
+        self.built_at = time.monotonic()
+        for garment in garments:
+            if not garment.colours:
+                # Indexed before colour signatures existed; cannot be verified
+                continue
+            self.tree.add(
+                from_hex(garment.phash),
+                (garment.product_id, from_hex(garment.dhash), bytes.fromhex(garment.colours)),
+            )
+
+    def match(self, phash_value, dhash_value, colours, max_phash_distance, max_dhash_distance,
+              max_colour_distance):
+        """Returns the id of the closest product passing all three checks, or None."""
+        for _, (product_id, product_dhash, product_colours) in self.tree.search(phash_value, max_phash_distance):
+            if (
+                hamming(dhash_value, product_dhash) <= max_dhash_distance
+                and colour_distance(colours, product_colours) <= max_colour_distance
+            ):
+                return product_id
+        return None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_product_index():
+    """Returns the in-process product index, rebuilding it once it is older than VTON_PHASH_INDEX_TTL."""
+    global _index
+    ttl = getattr(settings, 'VTON_PHASH_INDEX_TTL', 300)
+    index = _index
+    if index is None or time.monotonic() - index.built_at > ttl:
+        with _index_lock:
+            if _index is None or time.monotonic() - _index.built_at > ttl:
+                from .models import ProductGarment
+
+                with metrics.span('vton.phash.index') as span:
+                    _index = ProductIndex(ProductGarment.objects.only('product_id', 'phash', 'dhash', 'colours'))
+                    span.fields['products'] = len(_index.tree)
+            index = _index
+    return index
+
+
+def invalidate_product_index():
+    """Drops the in-process index so the next lookup sees catalogue changes."""
+    global _index
+    with _index_lock:
+        _index = None
+
+
+@receiver(setting_changed)
+def _reset_on_setting_changed(sender, setting, **kwargs):
+    if setting == 'VTON_PHASH_INDEX_TTL':
+        invalidate_product_index()
+
+
+def match_product(image_data):
+    """
+    Returns the store product whose image ``image_data`` is a copy of, or None.
+
+    Returns None as well when matching is disabled (VTON_PHASH_ENABLED) or
+    the upload cannot be decoded.
+    """
+    if not getattr(settings, 'VTON_PHASH_ENABLED', True):
+        return None
+    from store.models import Product
+
+    with metrics.span('vton.phash.match') as span:
+        try:
+            phash_value = phash(image_data)
+            dhash_value = dhash(image_data)
+            colours = colour_signature(image_data)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return None
+        product_id = get_product_index().match(
+            phash_value,
+            dhash_value,
+            colours,
+            getattr(settings, 'VTON_PHASH_MAX_DISTANCE', 4),
+            getattr(settings, 'VTON_DHASH_MAX_DISTANCE', 6),
+            getattr(settings, 'VTON_COLOUR_MAX_DISTANCE', 12),
+        )
+        span.fields['matched'] = product_id is not None
+    if product_id is None:
+        metrics.incr('vton.phash.misses')
+        return None
+    metrics.incr('vton.phash.hits')
+    return Product.objects.filter(pk=product_id, is_available=True).exclude(images='').first()
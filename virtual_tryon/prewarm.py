@@ -0,0 +1,217 @@
+"""
+Speculative try-ons of products added to the cart ("pre-warming").
+
+A signed-in shopper with a saved person image who adds a product to their
+cart will likely try it on next.  With VTON_PREWARM_ENABLED, add_cart hands
+(person image, product) to a single low-priority worker thread that
+generates the try-on into the result cache, so the real request is a cache
+hit, or joins the running generation through the single flight.
+
+Speculative work must never slow down interactive try-ons:
+
+- it only starts while no try-on job is queued or running and no upstream
+  call is in flight, and is dropped after waiting VTON_PREWARM_MAX_WAIT
+  seconds for that, or when the backend's circuit breaker is open; this is
+  checked again just before the upstream call,
+- its upstream calls are background calls (greatkart.upstream), which have
+  their own slots and give up instead of waiting for a shared one,
+- one runs at a time, at most VTON_PREWARM_QUEUE_DEPTH wait, and a try-on
+  already waiting is not queued twice,
+- each user gets VTON_PREWARM_USER_BUDGET and the whole site
+  VTON_PREWARM_GLOBAL_BUDGET of them per VTON_PREWARM_BUDGET_WINDOW seconds,
+  counted in Django's cache so that all processes share the budgets.
+"""
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db import close_old_connections
+from django.utils import timezone
+
+from greatkart import metrics
+from greatkart.upstream import UpstreamBusy, background_calls, get_upstream_limiter
+from store.models import Product
+
+from .backends import get_backends
+from .cache import get_result_cache
+from .garments import read_garment
+from .generation import VTON_PROMPT, generate_tryon, get_tryon_key
+from .jobs import get_job_queue
+from .models import PersonImage
+
+logger = logging.getLogger(__name__)
+
+BUDGET_PREFIX = 'vton:prewarm:'
+
+
+def _take_budget(name, limit, window):
+    """Counts one use of budget ``name``; returns False once ``limit`` uses were made this window."""
+    if limit is None:
+        return True
+    key = f'{BUDGET_PREFIX}{name}:{int(time.time() // window)}'
+    django_cache.add(key, 0, window)
+    try:
+        return django_cache.incr(key) <= limit
+    except ValueError:
+        # Evicted in between; let this one through
+        return True
+
+
+def _interactive_busy():
+    """Tells whether interactive try-ons are waiting or running in this process."""
+    stats = get_job_queue().stats()
+    return bool(stats['queued'] or stats['running'] or get_upstream_limiter().in_flight)
+
+
+def _upstream_unavailable():
+    backend = get_backends()[0]
+    return backend.uses_genai and get_upstream_limiter().is_open(f'vton.{backend.name}')
+
+
+def _is_busy():
+    return _interactive_busy() or _upstream_unavailable()
+
+
+class Prewarmer:
+    """
+    One worker thread running speculative try-ons while the process is otherwise idle.
+
+    Args:
+        max_depth: Maximum number of try-ons waiting to start; more are dropped.
+        max_wait: Seconds a try-on may wait for an idle moment before it is dropped.
+        poll_interval: Seconds between checks for an idle moment.
+    """
+
+    def __init__(self, max_depth=10, max_wait=120, poll_interval=1):
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._pending = set()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, person_id, product_id):
+        """Queues a try-on of a PersonImage and a Product; returns False if it is full or already queued."""
+        self._ensure_worker()
+        with self._lock:
+            if (person_id, product_id) in self._pending:
+                return False
+            try:
+                self._queue.put_nowait((person_id, product_id, time.monotonic()))
+            except queue.Full:
+                return False
+            self._pending.add((person_id, product_id))
+        return True
+
+    def _ensure_worker(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='vton-prewarm', daemon=True)
+                self._thread.start()
+
+    def _work(self):
+        while True:
+            person_id, product_id, queued_at = self._queue.get()
+            with self._lock:
+                self._pending.discard((person_id, product_id))
+            try:
+                if self._wait_until_idle(queued_at + self.max_wait):
+                    self._run(person_id, product_id)
+                else:
+                    metrics.incr('vton.prewarm.dropped')
+            except UpstreamBusy:
+                metrics.incr('vton.prewarm.dropped')
+            except Exception:
+                metrics.incr('vton.prewarm.failed')
+                logger.exception('Pre-warming try-on of product %s failed', product_id)
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def _wait_until_idle(self, deadline):
+        while _is_busy():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    def _run(self, person_id, product_id):
+        person = PersonImage.objects.filter(pk=person_id, expires_at__gt=timezone.now()).first()
+        product = Product.objects.filter(pk=product_id).exclude(images='').first()
+        cache = get_result_cache()
+        if person is None or product is None or cache is None:
+            metrics.incr('vton.prewarm.skipped')
+            return
+
+        cloth_image, cloth_digest = read_garment(product)
+        images = [person.read(), cloth_image]
+        cache_key = get_tryon_key(images, VTON_PROMPT, digests=[person.content_hash, cloth_digest])
+        if cache.contains(cache_key):
+            metrics.incr('vton.prewarm.skipped')
+            return
+        # Interactive try-ons may have arrived while the images were read
+        if _is_busy():
+            metrics.incr('vton.prewarm.dropped')
+            return
+        with metrics.span('vton.prewarm', product=product_id), background_calls():
+            generate_tryon(images, VTON_PROMPT, cache_key=cache_key)
+        metrics.incr('vton.prewarm.done')
+
+
+_prewarmer = None
+_prewarmer_lock = threading.Lock()
+
+
+def get_prewarmer():
+    """Returns the process-wide pre-warmer, creating it from settings on first use."""
+    global _prewarmer
+    if _prewarmer is None:
+        with _prewarmer_lock:
+            if _prewarmer is None:
+                _prewarmer = Prewarmer(
+                    max_depth=getattr(settings, 'VTON_PREWARM_QUEUE_DEPTH', 10),
+                    max_wait=getattr(settings, 'VTON_PREWARM_MAX_WAIT', 120),
+                )
+    return _prewarmer
+
+
+def prewarm_tryon(user, product):
+    """
+    Queues a speculative try-on of ``product`` on ``user``'s latest saved person image.
+
+    Does nothing unless VTON_PREWARM_ENABLED is set, the result cache is on,
+    the user has a person image and the budgets allow it. Never raises, so it
+    can be called from any view. Returns whether a try-on was queued.
+    """
+    if not getattr(settings, 'VTON_PREWARM_ENABLED', False) or not user.is_authenticated:
+        return False
+    try:
+        if not product.images or get_result_cache() is None:
+            return False
+        person_id = (
+            PersonImage.objects.filter(user=user, expires_at__gt=timezone.now())
+            .values_list('pk', flat=True).first()
+        )
+        if person_id is None:
+            return False
+
+        window = getattr(settings, 'VTON_PREWARM_BUDGET_WINDOW', 60 * 60)
+        if not (
+            _take_budget(f'user:{user.pk}', getattr(settings, 'VTON_PREWARM_USER_BUDGET', 5), window)
+            and _take_budget('global', getattr(settings, 'VTON_PREWARM_GLOBAL_BUDGET', 100), window)
+        ):
+            metrics.incr('vton.prewarm.over_budget')
+            return False
+        if not get_prewarmer().submit(person_id, product.pk):
+            metrics.incr('vton.prewarm.dropped')
+            return False
+    except Exception:
+        logger.exception('Could not queue pre-warming try-on of product %s', product.pk)
+        return False
+    metrics.incr('vton.prewarm.queued')
+    return True
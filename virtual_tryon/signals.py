@@ -0,0 +1,43 @@
+"""
+Keeps the try-on data derived from store products (ProductGarment) in sync.
+
+The garment is prepared when a product is saved with a new image and
+dropped together with the product; the in-process product index is
+invalidated on every change.  Products saved before this existed are
+prepared with the index_product_images management command.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from PIL import Image
+
+from store.models import Product
+
+from .garments import update_product_garment
+from .models import ProductGarment
+from .phash import invalidate_product_index
+
+
+@receiver(post_save, sender=Product)
+def _product_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        # Loading fixtures; the image files may not exist yet
+        return
+    try:
+        update_product_garment(instance)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        # An unreadable or oversized image must not break saving the product
+        for garment in ProductGarment.objects.filter(product=instance):
+            garment.delete()
+
+
+@receiver(post_save, sender=ProductGarment)
+def _garment_saved(sender, **kwargs):
+    invalidate_product_index()
+
+
+@receiver(post_delete, sender=ProductGarment)
+def _garment_deleted(sender, instance, **kwargs):
+    # Also runs for garments deleted together with their product
+    if instance.image:
+        instance.image.delete(save=False)
+    invalidate_product_index()
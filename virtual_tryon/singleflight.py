@@ -0,0 +1,111 @@
+"""
+Coalescing of identical concurrent generations ("single flight").
+
+When a user double-clicks or the frontend retries, several requests for the
+same inputs can arrive while the first is still generating.  Only the first
+caller (the leader) runs the generation; the others wait for it and receive
+the same result or exception.
+
+Within a process this is done with threads waiting on an Event.  With
+VTON_SINGLEFLIGHT_CROSS_PROCESS enabled, a lock in Django's cache extends
+this to other processes sharing that cache: a caller that finds the lock
+taken polls the shared result store until the leader's result shows up, and
+takes over if the lock is released without one.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache as django_cache
+
+from greatkart import metrics
+
+LOCK_PREFIX = 'vton:inflight:'
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its outcome."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, lookup=None, **kwargs):
+        """
+        Returns ``func(*args, **kwargs)``, shared with concurrent callers using ``key``.
+
+        ``lookup`` is a callable returning the stored result for ``key`` or None;
+        when given and cross-process coalescing is enabled, it is how waiting
+        processes pick up the leader's result.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not leader:
+            metrics.incr('vton.singleflight.coalesced')
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            if lookup is not None and getattr(settings, 'VTON_SINGLEFLIGHT_CROSS_PROCESS', False):
+                call.result = _do_cross_process(key, lookup, func, args, kwargs)
+            else:
+                call.result = func(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def _do_cross_process(key, lookup, func, args, kwargs):
+    """Leads the call if no other process holds the lock, otherwise waits for its result."""
+    lock_key = LOCK_PREFIX + key
+    lock_timeout = getattr(settings, 'VTON_SINGLEFLIGHT_LOCK_TIMEOUT', 180)
+    poll_interval = getattr(settings, 'VTON_SINGLEFLIGHT_POLL_INTERVAL', 0.5)
+    deadline = time.monotonic() + lock_timeout
+
+    while True:
+        if django_cache.add(lock_key, 1, timeout=lock_timeout):
+            try:
+                return func(*args, **kwargs)
+            finally:
+                django_cache.delete(lock_key)
+
+        metrics.incr('vton.singleflight.coalesced_remote')
+        # Another process is generating; wait for its result or for the lock to go away
+        while django_cache.get(lock_key) is not None:
+            result = lookup()
+            if result is not None:
+                return result
+            if time.monotonic() > deadline:
+                raise TimeoutError('Timed out waiting for an identical try-on in another process')
+            time.sleep(poll_interval)
+
+        result = lookup()
+        if result is not None:
+            return result
+        # The other process failed without storing a result: try to take over
+
+
+_flights = SingleFlight()
+
+
+def get_single_flight():
+    return _flights
@@ -1,3 +1,1107 @@
-from django.test import TestCase
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.contrib.auth import get_user_model
+from django.core.cache import cache as django_cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image, ImageDraw
+
+from category.models import Category
+from store.models import Product
+from wardrobe.models import Outfit, WardrobeItem
+
+from .asgi import create_app
+from .backends import Attempt, StubBackend, TryOnBackend
+from .cache import ResultCache, digest, get_result_cache, make_key
+from .garments import read_garment
+from .generation import VTON_OUTFIT_PROMPT, generate_tryon_result, get_tryon_key
+from .jobs import (
+    DONE, FAILED, GENERATING, IMAGE, QUEUED, RUNNING, TEXT, UPLOADING, JobQueue, QueueFull, get_job_queue,
+    report_image, report_progress,
+)
+from .imaging import ORIENTATION_TAG, normalize_image
+from .models import PersonImage, ProductGarment, TryOnResult
+from .phash import dhash, hamming, invalidate_product_index, match_product, phash
+from .prewarm import Prewarmer
+from .singleflight import SingleFlight
+from .views import generate_vton
+
+
+def _jacket(colour, size=(256, 320), image_format='PNG', quality=95):
+    """A jacket-like silhouette in ``colour`` on a white background."""
+    image = Image.new('RGB', (256, 320), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.polygon([(60, 40), (196, 40), (240, 130), (210, 140), (200, 300), (56, 300), (46, 140), (16, 130)],
+                 fill=colour)
+    draw.line([(128, 40), (128, 300)], fill='black', width=3)
+    image = image.resize(size)
+    output = BytesIO()
+    image.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+
+BROWN = (120, 72, 30)
+YELLOW = (225, 190, 40)
+
+
+def _user(name):
+    return get_user_model().objects.create_user(
+        first_name=name, last_name='Test', email=f'{name}@example.com', username=name, password='secret',
+    )
+
+
+def _use_temporary_media(test):
+    media_root = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    media = test.settings(MEDIA_ROOT=media_root)
+    media.enable()
+    test.addCleanup(media.disable)
+
+
+class ProductTestCase(TestCase):
+    """Stores product images in a temporary MEDIA_ROOT."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        invalidate_product_index()
+        self.category = Category.objects.create(category_name='Jackets', slug='jackets', description='')
+
+    def tearDown(self):
+        invalidate_product_index()
+
+    def _product(self, name, colour):
+        product = Product(product_name=name, slug=name, price=100, stock=1, category=self.category)
+        product.images.save(f'{name}.png', ContentFile(_jacket(colour)), save=False)
+        product.save()
+        return product
+
+
+class ProductMatchTests(ProductTestCase):
+
+    def test_colour_variants_hash_alike(self):
+        # Within the distances once used by default, hence the colour check
+        brown, yellow = _jacket(BROWN), _jacket(YELLOW)
+        self.assertLessEqual(hamming(phash(brown), phash(yellow)), 6)
+        self.assertLessEqual(hamming(dhash(brown), dhash(yellow)), 10)
+
+    def test_re_encoded_copy_matches(self):
+        brown = self._product('brown-jacket', BROWN)
+        upload = _jacket(BROWN, size=(200, 250), image_format='JPEG', quality=70)
+        self.assertEqual(match_product(upload), brown)
+
+    def test_colour_variant_does_not_match(self):
+        self._product('brown-jacket', BROWN)
+        upload = _jacket(YELLOW, image_format='JPEG', quality=80)
+        self.assertIsNone(match_product(upload))
+        # Even where the hashes alone would let it through
+        with self.settings(VTON_PHASH_MAX_DISTANCE=6, VTON_DHASH_MAX_DISTANCE=10):
+            self.assertIsNone(match_product(upload))
+
+    def test_colour_variant_matches_its_own_product(self):
+        self._product('brown-jacket', BROWN)
+        yellow = self._product('yellow-jacket', YELLOW)
+        self.assertEqual(match_product(_jacket(YELLOW, image_format='JPEG', quality=80)), yellow)
+
+
+@override_settings(
+    VTON_BACKENDS=[{'NAME': 'stub', 'BACKEND': 'virtual_tryon.backends.StubBackend'}],
+    RATE_LIMIT_ENABLED=False,
+)
+class UnreadableProductTests(ProductTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.product = self._product('brown-jacket', BROWN)
+        ProductGarment.objects.filter(product=self.product).delete()
+        with open(self.product.images.path, 'wb') as f:
+            f.write(b'not an image')
+
+    def _post(self, url, data):
+        data['person_image'] = ContentFile(_jacket(YELLOW), name='person.png')
+        return self.client.post(url, data)
+
+    def test_generate_vton(self):
+        response = self._post('/vton/generate_vton/', {'product_id': self.product.pk})
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('cannot be read', response.json()['error'])
+
+    def test_batch(self):
+        response = self._post('/vton/batch/', {'product_ids': str(self.product.pk)})
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('cannot be read', response.json()['error'])
+
+
+@mock.patch('PIL.Image.MAX_IMAGE_PIXELS', 1000)
+class DecompressionBombTests(ProductTestCase):
+
+    def test_saving_the_product(self):
+        product = self._product('brown-jacket', BROWN)
+        self.assertFalse(ProductGarment.objects.filter(product=product).exists())
+
+    def test_index_product_images(self):
+        self._product('brown-jacket', BROWN)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('index_product_images', stdout=stdout, stderr=stderr)
+        self.assertIn('0 product garment(s), 1 failed', stdout.getvalue())
+        self.assertIn('brown-jacket', stderr.getvalue())
+
+
+class FailingBackend(TryOnBackend):
+
+    def generate(self, images, prompt, attempt):
+        raise OSError('upstream unavailable')
+
+
+class ResultCacheTestCase(TestCase):
+    """Keeps the result cache in a temporary directory."""
+
+    def setUp(self):
+        super().setUp()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        cache_settings = self.settings(VTON_CACHE_ENABLED=True, VTON_CACHE_DIR=cache_dir)
+        cache_settings.enable()
+        self.addCleanup(cache_settings.disable)
+        self.cache = get_result_cache()
+
+
+STUB_BACKENDS = [{'NAME': 'stub', 'BACKEND': 'virtual_tryon.backends.StubBackend'}]
+FAILOVER_BACKENDS = [
+    {'NAME': 'broken', 'BACKEND': 'virtual_tryon.tests.FailingBackend'},
+    {'NAME': 'stub', 'BACKEND': 'virtual_tryon.backends.StubBackend'},
+]
+
+
+def _wait_for_job(job_id, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = get_job_queue().get(job_id)
+        if job is not None and job.is_finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f'Job {job_id} did not finish')
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False)
+class FallbackResultTests(ResultCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.images = [_jacket(BROWN), _jacket(YELLOW)]
+
+    @override_settings(VTON_BACKENDS=STUB_BACKENDS)
+    def test_preferred_result_is_cached(self):
+        key = get_tryon_key(self.images)
+        generated_images, result_key = generate_tryon_result(self.images, cache_key=key)
+        self.assertTrue(generated_images)
+        self.assertEqual(result_key, key)
+        self.assertTrue(self.cache.contains(key))
+
+    @override_settings(VTON_BACKENDS=FAILOVER_BACKENDS)
+    def test_fallback_result_is_cached_under_its_own_key(self):
+        key = get_tryon_key(self.images)
+        generated_images, result_key = generate_tryon_result(self.images, cache_key=key)
+        self.assertTrue(generated_images)
+        self.assertNotEqual(result_key, key)
+        self.assertFalse(self.cache.contains(key))
+        self.assertEqual(self.cache.get(result_key), generated_images)
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False, VTON_BACKENDS=FAILOVER_BACKENDS, RATE_LIMIT_ENABLED=False)
+class FailoverUrlResponseTests(ResultCacheTestCase):
+
+    def _files(self):
+        return {
+            'person_image': ContentFile(_jacket(BROWN), name='person.png'),
+            'cloth_image': ContentFile(_jacket(YELLOW), name='cloth.png'),
+        }
+
+    def _assert_serves_image(self, image_url):
+        response = self.client.get(image_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_generate_vton(self):
+        response = self.client.post('/vton/generate_vton/?response=url', self._files())
+        self.assertEqual(response.status_code, 200)
+        self._assert_serves_image(response.json()['image_url'])
+
+    def test_job(self):
+        response = self.client.post('/vton/jobs/', self._files())
+        self.assertEqual(response.status_code, 202)
+        job = _wait_for_job(response.json()['job_id'])
+        self.assertEqual(job.status, DONE)
+        response = self.client.get(response.json()['status_url'] + '?response=url')
+        self.assertEqual(response.status_code, 200)
+        self._assert_serves_image(response.json()['image_url'])
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False, VTON_BACKENDS=STUB_BACKENDS, RATE_LIMIT_ENABLED=False,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class GalleryHitTests(ResultCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        _use_temporary_media(self)
+        self.client.force_login(_user('ada'))
+
+    def _generate(self):
+        response = self.client.post('/vton/generate_vton/?response=url', {
+            'person_image': ContentFile(_jacket(BROWN), name='person.png'),
+            'cloth_image': ContentFile(_jacket(YELLOW), name='cloth.png'),
+        })
+        self.assertEqual(response.status_code, 200)
+        return response.json()['image_url']
+
+    def test_url_after_the_result_left_the_cache(self):
+        self._generate()
+        self.assertEqual(TryOnResult.objects.count(), 1)
+        # A new cache directory stands for the result being evicted
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir, ignore_errors=True)
+        empty_cache = self.settings(VTON_CACHE_DIR=cache_dir)
+        empty_cache.enable()
+        self.addCleanup(empty_cache.disable)
+        with mock.patch('virtual_tryon.gallery.generate_tryon_result') as generate:
+            image_url = self._generate()
+        generate.assert_not_called()
+        response = self.client.get(image_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, TryOnResult.objects.get().read())
+
+
+class CancelledAttemptTests(TestCase):
+
+    def test_cancelled_backend_does_not_report_images(self):
+        attempt = Attempt()
+        attempt.cancelled.set()
+        with mock.patch('virtual_tryon.backends.report_image') as report_image:
+            self.assertEqual(StubBackend('stub').generate([_jacket(BROWN), _jacket(YELLOW)], '', attempt), [])
+        report_image.assert_not_called()
+
+
+class SingleFlightTests(TestCase):
+
+    def _run_concurrently(self, func, callers=5):
+        """Calls ``func`` from several threads once all of them are waiting; returns the outcomes."""
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+        outcomes = []
+        coalesced = threading.Semaphore(0)
+
+        def upstream():
+            calls.append(1)
+            release.wait(5)
+            return func()
+
+        def caller():
+            try:
+                outcomes.append(flight.do('key', upstream))
+            except Exception as e:
+                outcomes.append(e)
+
+        def incr(name, *args, **kwargs):
+            if name == 'vton.singleflight.coalesced':
+                coalesced.release()
+
+        with mock.patch('virtual_tryon.singleflight.metrics.incr', side_effect=incr):
+            threads = [threading.Thread(target=caller) for _ in range(callers)]
+            for thread in threads:
+                thread.start()
+            for _ in range(callers - 1):
+                self.assertTrue(coalesced.acquire(timeout=5))
+            release.set()
+            for thread in threads:
+                thread.join(5)
+        return calls, outcomes
+
+    def test_identical_requests_make_one_upstream_call(self):
+        result = object()
+        calls, outcomes = self._run_concurrently(lambda: result)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [result] * 5)
+
+    def test_error_is_shared(self):
+        error = OSError('upstream failed')
+
+        def fail():
+            raise error
+
+        calls, outcomes = self._run_concurrently(fail)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(outcomes, [error] * 5)
+
+    def test_later_calls_run_again(self):
+        flight = SingleFlight()
+        func = mock.Mock(return_value='ok')
+        flight.do('key', func)
+        flight.do('key', func)
+        self.assertEqual(func.call_count, 2)
+
+
+class CountingBackend(TryOnBackend):
+    """StubBackend counting its calls, slow enough for concurrent requests to overlap."""
+    calls = 0
+
+    def generate(self, images, prompt, attempt):
+        type(self).calls += 1
+        time.sleep(0.2)
+        return StubBackend(self.name).generate(images, prompt, attempt)
+
+
+@override_settings(
+    VTON_NORMALIZE_ENABLED=False,
+    VTON_BACKENDS=[{'NAME': 'counting', 'BACKEND': 'virtual_tryon.tests.CountingBackend'}],
+)
+class GenerateTryonSingleFlightTests(TestCase):
+
+    def test_concurrent_identical_tryons_generate_once(self):
+        CountingBackend.calls = 0
+        images = [_jacket(BROWN), _jacket(YELLOW)]
+        results = []
+        with mock.patch('virtual_tryon.generation.get_result_cache', return_value=None):
+            threads = [
+                threading.Thread(target=lambda: results.append(generate_tryon_result(images)))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+        self.assertEqual(CountingBackend.calls, 1)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len({result[0][0] for result in results}), 1)
+
+
+@override_settings(
+    VTON_BACKENDS=[{'NAME': 'stub', 'BACKEND': 'virtual_tryon.backends.StubBackend'}],
+    RATE_LIMIT_ENABLED=False,
+    VTON_MAX_UPLOAD_BYTES=1024,
+)
+class UploadLimitTests(TestCase):
+
+    def _request(self, size):
+        return RequestFactory().post(
+            '/vton/generate_vton/', {'person_image': ContentFile(b'x' * size, name='person.png')},
+        )
+
+    def test_body_above_the_limit_is_refused(self):
+        self.assertEqual(generate_vton(self._request(4096)).status_code, 413)
+
+    def test_body_without_content_length_is_refused(self):
+        # E.g. sent with Transfer-Encoding: chunked, so the limit cannot be checked up front
+        request = self._request(4096)
+        del request.META['CONTENT_LENGTH']
+        response = generate_vton(request)
+        self.assertEqual(response.status_code, 411)
+        self.assertIn(b'Content-Length', response.content)
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False, VTON_BACKENDS=STUB_BACKENDS, VTON_PREWARM_ENABLED=True,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class PrewarmTests(ResultCacheTestCase, ProductTestCase):
+
+    def setUp(self):
+        super().setUp()
+        django_cache.clear()
+        self.user = _user('ada')
+        self.person = PersonImage(user=self.user, content_hash=digest(_jacket(BROWN)))
+        self.person.image.save('person.png', ContentFile(_jacket(BROWN)))
+        self.product = self._product('jacket', YELLOW)
+        self.prewarmer = Prewarmer(max_wait=0, poll_interval=0)
+        # Run try-ons in the test thread instead of the worker
+        patcher = mock.patch.object(Prewarmer, '_ensure_worker')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _key(self):
+        cloth_image, cloth_digest = read_garment(self.product)
+        return get_tryon_key([_jacket(BROWN), cloth_image], digests=[self.person.content_hash, cloth_digest])
+
+    def test_adding_to_the_cart_queues_a_try_on(self):
+        self.client.force_login(self.user)
+        with mock.patch('virtual_tryon.prewarm.get_prewarmer') as get_prewarmer:
+            self.client.get(f'/cart/add/{self.product.pk}/')
+        get_prewarmer.return_value.submit.assert_called_once_with(self.person.pk, self.product.pk)
+
+    def test_anonymous_cart_queues_nothing(self):
+        with mock.patch('virtual_tryon.prewarm.get_prewarmer') as get_prewarmer:
+            self.client.get(f'/cart/add/{self.product.pk}/')
+        get_prewarmer.assert_not_called()
+
+    def test_waiting_try_on_is_queued_once(self):
+        self.assertTrue(self.prewarmer.submit(self.person.pk, self.product.pk))
+        self.assertFalse(self.prewarmer.submit(self.person.pk, self.product.pk))
+
+    def test_cached_try_on_is_not_generated_again(self):
+        self.prewarmer._run(self.person.pk, self.product.pk)
+        self.assertTrue(self.cache.contains(self._key()))
+        with mock.patch('virtual_tryon.prewarm.generate_tryon') as generate:
+            self.prewarmer._run(self.person.pk, self.product.pk)
+        generate.assert_not_called()
+
+    def test_waits_for_idle_moment(self):
+        with mock.patch('virtual_tryon.prewarm._interactive_busy', return_value=True):
+            self.assertFalse(self.prewarmer._wait_until_idle(time.monotonic()))
+        self.assertTrue(self.prewarmer._wait_until_idle(time.monotonic()))
+
+    def test_busy_again_before_the_upstream_call(self):
+        with mock.patch('virtual_tryon.prewarm._interactive_busy', return_value=True), \
+                mock.patch('virtual_tryon.prewarm.generate_tryon') as generate:
+            self.prewarmer._run(self.person.pk, self.product.pk)
+        generate.assert_not_called()
+        self.assertFalse(self.cache.contains(self._key()))
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False, VTON_BACKENDS=STUB_BACKENDS, RATE_LIMIT_ENABLED=False)
+class SidecarTests(ResultCacheTestCase):
+    """The ASGI sidecar, driven through httpx without a server."""
+
+    def setUp(self):
+        super().setUp()
+        # The capacity limiter belongs to the event loop of each test
+        patcher = mock.patch('virtual_tryon.asgi._limiter', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _client(self):
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app()), base_url='http://testserver')
+
+    def _form(self):
+        """The multipart body of a try-on upload and its Content-Type."""
+        request = httpx.Request('POST', 'http://testserver/', files={
+            'person_image': ('person.png', _jacket(BROWN), 'image/png'),
+            'cloth_image': ('cloth.png', _jacket(YELLOW), 'image/png'),
+        })
+        return request.read(), request.headers['Content-Type']
+
+    async def _post_chunked(self, client, url):
+        body, content_type = self._form()
+
+        async def chunks():
+            for start in range(0, len(body), 4096):
+                yield body[start:start + 4096]
+
+        return await client.post(url, content=chunks(), headers={'Content-Type': content_type})
+
+    async def test_generate(self):
+        body, content_type = self._form()
+        async with self._client() as client:
+            response = await client.post('/vton/generate_vton/?response=binary', content=body,
+                                         headers={'Content-Type': content_type})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'image/jpeg')
+
+    async def test_chunked_upload_is_measured_instead_of_refused(self):
+        # Without the sidecar such a body gets a 411 (see UploadLimitTests)
+        async with self._client() as client:
+            response = await self._post_chunked(client, '/vton/generate_vton/?response=binary')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(VTON_MAX_UPLOAD_BYTES=1024)
+    async def test_upload_above_the_limit(self):
+        body, content_type = self._form()
+        async with self._client() as client:
+            declared = await client.post('/vton/generate_vton/', content=body + b'x' * (64 * 1024),
+                                         headers={'Content-Type': content_type})
+            self.assertEqual(declared.status_code, 413)
+            self.assertIn('too large', declared.json()['error'])
+
+            # Refused once more than the limit has arrived
+            async def chunks():
+                for _ in range(20):
+                    yield b'x' * 8192
+
+            chunked = await client.post('/vton/generate_vton/', content=chunks(),
+                                        headers={'Content-Type': content_type})
+            self.assertEqual(chunked.status_code, 413)
+
+    async def test_job_polling(self):
+        async with self._client() as client:
+            submitted = await self._post_chunked(client, '/vton/jobs/')
+            self.assertEqual(submitted.status_code, 202)
+            status_url = submitted.json()['status_url']
+            for _ in range(500):
+                status = await client.get(status_url)
+                self.assertEqual(status.status_code, 200)
+                if status.json()['status'] not in ('queued', 'running'):
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(status.json()['status'], DONE)
+            self.assertTrue(status.json()['image_data'])
+
+
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.queue = JobQueue(workers=1, max_depth=2)
+
+    def _events(self, job):
+        return [event['event'] for event in job.events]
+
+    def _wait(self, job):
+        """Waits for the done or failed event, which follows the final status."""
+        deadline = time.monotonic() + 5
+        while self._events(job)[-1] not in (DONE, FAILED) and time.monotonic() < deadline:
+            job.wait_for_events(len(job.events), 0.1)
+        self.assertTrue(job.is_finished)
+
+    def test_job_runs_to_done(self):
+        job = self.queue.submit(lambda: report_progress(GENERATING) or [b'image'])
+        self.assertIn(job.status, (QUEUED, RUNNING, DONE))
+        self.assertIs(self.queue.get(job.id), job)
+        self._wait(job)
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(job.result, [b'image'])
+        self.assertEqual(self._events(job), [QUEUED, RUNNING, GENERATING, DONE])
+        self.assertLessEqual(job.created_at, job.started_at)
+        self.assertLessEqual(job.started_at, job.finished_at)
+        self.assertEqual(job.args, ())
+
+    def test_failed_job(self):
+        def fail():
+            raise ValueError('upstream said no')
+
+        with self.assertLogs('virtual_tryon.jobs', 'ERROR'):
+            job = self.queue.submit(fail)
+            self._wait(job)
+        self.assertEqual(job.status, FAILED)
+        self.assertEqual(job.to_dict()['error'], 'upstream said no')
+        self.assertEqual(self._events(job), [QUEUED, RUNNING, FAILED])
+        self.assertEqual(job.events[-1]['data'], {'error': 'upstream said no'})
+
+    def test_full_queue(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        running = self.queue.submit(lambda: release.wait(5) and [])
+        # Waits for its running event
+        running.wait_for_events(1, 5)
+        self.queue.submit(len, [])
+        self.queue.submit(len, [])
+        with self.assertRaises(QueueFull):
+            self.queue.submit(len, [])
+
+    def test_finished_jobs_expire(self):
+        self.queue.result_ttl = 0
+        job = self.queue.submit(len, [])
+        self._wait(job)
+        job.finished_at -= 1
+        self.queue.submit(len, [])
+        self.assertIsNone(self.queue.get(job.id))
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False, VTON_BACKENDS=STUB_BACKENDS, RATE_LIMIT_ENABLED=False,
+                   PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class JobOwnershipTests(ResultCacheTestCase):
+
+    def _submit(self, client, url='/vton/jobs/', **data):
+        data.setdefault('cloth_image', ContentFile(_jacket(YELLOW), name='cloth.png'))
+        response = client.post(url, {'person_image': ContentFile(_jacket(BROWN), name='person.png'), **data})
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def _job_urls(self, job_id):
+        return [
+            reverse('vton_job_status', args=[job_id]),
+            reverse('vton_job_events', args=[job_id]),
+            reverse('vton_job_image', args=[job_id]),
+        ]
+
+    def test_anonymous_session(self):
+        job_id = self._submit(self.client)['job_id']
+        _wait_for_job(job_id)
+        for url in self._job_urls(job_id):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+            self.assertEqual(Client().get(url).status_code, 404, url)
+
+    def test_signed_in_user(self):
+        self.client.force_login(_user('ada'))
+        job_id = self._submit(self.client)['job_id']
+        _wait_for_job(job_id)
+        other = Client()
+        other.force_login(_user('bob'))
+        for url in self._job_urls(job_id):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+            self.assertEqual(other.get(url).status_code, 404, url)
+
+    def test_batch(self):
+        batch = self._submit(self.client, url='/vton/batch/', cloth_images=[
+            ContentFile(_jacket(YELLOW), name='yellow.png'), ContentFile(_jacket(BROWN), name='brown.png'),
+        ])
+        self.assertEqual(self.client.get(batch['status_url']).status_code, 200)
+        self.assertEqual(Client().get(batch['status_url']).status_code, 404)
+        for item in batch['items']:
+            _wait_for_job(item['job_id'])
+            self.assertEqual(self.client.get(item['status_url']).status_code, 200)
+            self.assertEqual(Client().get(item['status_url']).status_code, 404)
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False, VTON_BACKENDS=STUB_BACKENDS, RATE_LIMIT_ENABLED=False,
+                   VTON_BATCH_MAX_ITEMS=3, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BatchTests(ResultCacheTestCase):
+
+    def _post(self, colours):
+        return self.client.post('/vton/batch/', {
+            'person_image': ContentFile(_jacket(BROWN), name='person.png'),
+            'cloth_images': [
+                ContentFile(_jacket(colour), name=f'cloth{index}.png') for index, colour in enumerate(colours)
+            ],
+        })
+
+    def test_over_the_limit_is_refused_before_reading(self):
+        with mock.patch('virtual_tryon.views._read_person_image') as read_person, \
+                mock.patch('virtual_tryon.views._read_image_upload') as read_upload:
+            response = self._post([YELLOW, BROWN, YELLOW, BROWN])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at most 3', response.json()['error'])
+        read_person.assert_not_called()
+        read_upload.assert_not_called()
+
+    def test_items_fail_on_their_own(self):
+        def generate(images, prompt, cache_key, **kwargs):
+            if images[1] == failing_cloth:
+                raise RuntimeError('No image for this garment')
+            return [b'image'], cache_key
+
+        failing_cloth = _jacket((40, 90, 200))
+        with mock.patch('virtual_tryon.views.generate_and_save', side_effect=generate):
+            response = self._post([YELLOW, (40, 90, 200), BROWN])
+            self.assertEqual(response.status_code, 202)
+            items = response.json()['items']
+            jobs = [_wait_for_job(item['job_id']) for item in items]
+        self.assertEqual([job.status for job in jobs], [DONE, FAILED, DONE])
+        self.assertEqual([item['cloth_index'] for item in items], [0, 1, 2])
+        status = self.client.get(response.json()['status_url']).json()
+        self.assertEqual((status['status'], status['completed'], status['failed']), (DONE, 2, 1))
+
+    @override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMITS={'vton': (4, 60)})
+    def test_each_garment_counts_against_the_rate_limit(self):
+        django_cache.clear()
+        self.addCleanup(django_cache.clear)
+        self.client.force_login(_user('ada'))
+        response = self._post([YELLOW, BROWN, YELLOW])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['X-RateLimit-Remaining'], '1')
+        # The request itself still fits, its second garment does not
+        refused = self._post([YELLOW, BROWN])
+        self.assertEqual(refused.status_code, 429)
+        self.assertIn('Retry-After', refused)
+
+    def test_at_most_concurrency_items_run_at_once(self):
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def generate(index):
+            with lock:
+                running.append(index)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(index)
+            return [index]
+
+        batch = JobQueue(workers=4, max_depth=10).submit_batch(generate, [((i,), {}) for i in range(6)], 2)
+        deadline = time.monotonic() + 5
+        while not batch.is_finished and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(batch.is_finished)
+        self.assertEqual(max(peak), 2)
+        self.assertEqual([job.result for job in batch.jobs], [[i] for i in range(6)])
+
+
+class ResultCacheTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        # Room for three 100-byte entries
+        self.cache = ResultCache(self.directory, max_bytes=300)
+
+    def _fill(self, *keys):
+        for key in keys:
+            self.cache.set(key, [key.encode() * (100 // len(key))])
+
+    def test_least_recently_stored_is_evicted(self):
+        self._fill('aa', 'bb', 'cc', 'dd')
+        self.assertFalse(self.cache.contains('aa'))
+        self.assertTrue(all(self.cache.contains(key) for key in ('bb', 'cc', 'dd')))
+        stats = self.cache.stats()
+        self.assertEqual((stats['entries'], stats['size_bytes'], stats['evictions']), (3, 300, 1))
+
+    def test_hit_refreshes_recency(self):
+        self._fill('aa', 'bb', 'cc')
+        self.assertEqual(self.cache.get('aa'), [b'aa' * 50])
+        self._fill('dd')
+        self.assertTrue(self.cache.contains('aa'))
+        self.assertFalse(self.cache.contains('bb'))
+
+    def test_entry_larger_than_the_cache_is_not_stored(self):
+        self._fill('aa')
+        self.cache.set('bb', [b'x' * 301])
+        self.assertFalse(self.cache.contains('bb'))
+        self.assertTrue(self.cache.contains('aa'))
+
+    def test_order_survives_a_restart(self):
+        self._fill('aa', 'bb')
+        os.utime(self.cache._entry_path('aa'), (time.time() + 10,) * 2)
+        cache = ResultCache(self.directory, max_bytes=300)
+        cache.set('cc', [b'c' * 200])
+        self.assertTrue(cache.contains('aa'))
+        self.assertFalse(cache.contains('bb'))
+
+    def test_key_is_content_addressed(self):
+        person, cloth = _jacket(BROWN), _jacket(YELLOW)
+        key = make_key([digest(person), digest(cloth)], 'prompt', 'model')
+        # Stable across calls and equal for identical bytes from elsewhere
+        self.assertEqual(key, make_key([digest(bytes(person)), digest(cloth)], 'prompt', 'model'))
+        # Keys must not change between releases, or every cached result is lost
+        self.assertEqual(
+            make_key(['d1', 'd2'], 'p', 'm'), hashlib.sha256(b'm\0p\0d1\0d2\0').hexdigest(),
+        )
+        for other in (
+            make_key([digest(cloth), digest(person)], 'prompt', 'model'),
+            make_key([digest(person), digest(cloth)], 'other prompt', 'model'),
+            make_key([digest(person), digest(cloth)], 'prompt', 'other model'),
+            make_key([digest(person), digest(_jacket(BROWN, quality=80, image_format='JPEG'))], 'prompt', 'model'),
+        ):
+            self.assertNotEqual(key, other)
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False, VTON_BACKENDS=STUB_BACKENDS, RATE_LIMIT_ENABLED=False,
+                   VTON_RESULT_URL_TTL=300)
+class ResponseModeTests(ResultCacheTestCase):
+
+    def _post(self, mode):
+        return self.client.post(f'/vton/generate_vton/?response={mode}', {
+            'person_image': ContentFile(_jacket(BROWN), name='person.png'),
+            'cloth_image': ContentFile(_jacket(YELLOW), name='cloth.png'),
+        })
+
+    def test_json(self):
+        response = self._post('json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(BytesIO(base64.b64decode(response.json()['image_data']))).format, 'JPEG')
+
+    def test_binary(self):
+        response = self._post('binary')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response.content, base64.b64decode(self._post('json').json()['image_data']))
+
+    def test_signed_url(self):
+        data = self._post('url').json()
+        self.assertEqual(data['expires_in'], 300)
+        self.assertNotIn('image_data', data)
+        response = self.client.get(data['image_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Cache-Control'], 'private, max-age=300')
+        self.assertEqual(response.content, self._post('binary').content)
+
+    def test_expired_signature(self):
+        image_url = self._post('url').json()['image_url']
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 301):
+            response = self.client.get(image_url)
+        self.assertEqual(response.status_code, 410)
+        self.assertIn('expired', response.json()['error'])
+
+    def test_tampered_signature(self):
+        image_url = self._post('url').json()['image_url']
+        self.assertEqual(self.client.get(image_url.rstrip('/') + 'x/').status_code, 404)
+
+    def test_evicted_result(self):
+        image_url = self._post('url').json()['image_url']
+        shutil.rmtree(self.cache.directory)
+        self.assertEqual(self.client.get(image_url).status_code, 404)
+
+    def test_unknown_mode(self):
+        self.assertEqual(self._post('xml').status_code, 400)
+
+    @override_settings(VTON_CACHE_ENABLED=False)
+    def test_url_needs_the_result_cache(self):
+        response = self._post('url')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('VTON_CACHE_ENABLED', response.json()['error'])
+
+
+class NormalizeImageTests(TestCase):
+
+    def _encode(self, image, image_format='JPEG', **params):
+        output = BytesIO()
+        image.save(output, format=image_format, **params)
+        return output.getvalue()
+
+    def _open(self, image_data):
+        image = Image.open(BytesIO(image_data))
+        image.load()
+        return image
+
+    def test_large_photo_is_downscaled(self):
+        photo = self._encode(Image.new('RGB', (3000, 2000), BROWN), quality=95)
+        normalized = self._open(normalize_image(photo, max_edge=1024))
+        self.assertEqual(normalized.format, 'JPEG')
+        self.assertEqual(normalized.size, (1024, 683))
+
+    def test_exif_orientation_is_applied(self):
+        # Stored sideways: the camera was turned, so the left half is the top of the picture
+        image = Image.new('RGB', (400, 200), 'blue')
+        image.paste((255, 0, 0), (0, 0, 200, 200))
+        exif = Image.Exif()
+        exif[ORIENTATION_TAG] = 6
+        normalized = self._open(normalize_image(self._encode(image, exif=exif), max_edge=1024))
+        self.assertEqual(normalized.size, (200, 400))
+        self.assertEqual(normalized.getexif().get(ORIENTATION_TAG, 1), 1)
+        red, _, blue = normalized.getpixel((100, 50))
+        self.assertGreater(red, 200)
+        self.assertLess(blue, 50)
+
+    def test_transparency_is_kept(self):
+        image = Image.new('RGBA', (2000, 1000), (0, 0, 0, 0))
+        normalized = self._open(normalize_image(self._encode(image, 'PNG'), max_edge=500))
+        self.assertEqual((normalized.format, normalized.mode, normalized.size), ('PNG', 'RGBA', (500, 250)))
+
+    def test_other_data_is_passed_through(self):
+        gif = self._encode(Image.new('P', (2000, 100)), 'GIF')
+        self.assertEqual(normalize_image(gif, max_edge=500), gif)
+        self.assertEqual(normalize_image(b'not an image'), b'not an image')
+
+    def test_small_image_is_not_made_larger(self):
+        small = _jacket(YELLOW, size=(64, 80), image_format='JPEG', quality=20)
+        self.assertLessEqual(len(normalize_image(small, max_edge=1024, quality=95)), len(small))
+
+
+@override_settings(VTON_NORMALIZE_ENABLED=False, VTON_BACKENDS=STUB_BACKENDS, RATE_LIMIT_ENABLED=False)
+class PersonHandleTests(ResultCacheTestCase):
+
+    def setUp(self):
+        super().setUp()
+        _use_temporary_media(self)
+
+    def _register(self, client=None):
+        response = (client or self.client).post(
+            '/vton/person/', {'person_image': ContentFile(_jacket(BROWN), name='person.png')},
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()['person_handle']
+
+    def _generate(self, person, client=None):
+        return (client or self.client).post('/vton/generate_vton/?response=binary', {
+            **person, 'cloth_image': ContentFile(_jacket(YELLOW), name='cloth.png'),
+        })
+
+    def test_handle_shares_results_with_the_upload(self):
+        handle = self._register()
+        by_handle = self._generate({'person_handle': handle})
+        self.assertEqual(by_handle.status_code, 200)
+        by_upload = self._generate({'person_image': ContentFile(_jacket(BROWN), name='person.png')})
+        self.assertEqual(by_upload.content, by_handle.content)
+
+    def test_expired_handle(self):
+        handle = self._register()
+        with override_settings(VTON_PERSON_HANDLE_TTL=0):
+            expired = self._register()
+        self.assertEqual(self._generate({'person_handle': handle}).status_code, 200)
+        response = self._generate({'person_handle': expired})
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('expired', response.json()['error'])
+
+    def test_handle_of_another_visitor(self):
+        handle = self._register(Client())
+        self.assertEqual(self._generate({'person_handle': handle}).status_code, 404)
+
+    def test_cleanup_command(self):
+        self._register()
+        with override_settings(VTON_PERSON_HANDLE_TTL=0):
+            self._register()
+        expired = PersonImage.objects.get(expires_at__lte=timezone.now())
+        path = expired.image.path
+        self.assertTrue(os.path.exists(path))
+
+        stdout = StringIO()
+        call_command('cleanup_person_images', '--dry-run', stdout=stdout)
+        self.assertIn('1 expired person image(s) would be deleted', stdout.getvalue())
+        self.assertEqual(PersonImage.objects.count(), 2)
+
+        call_command('cleanup_person_images', stdout=StringIO())
+        self.assertFalse(PersonImage.objects.filter(pk=expired.pk).exists())
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(PersonImage.objects.count(), 1)
+
+
+class StreamingBackend(TryOnBackend):
+    """Reports progress like GeminiBackend, pausing before the image so that clients can follow along."""
+
+    def generate(self, images, prompt, attempt):
+        report_progress(UPLOADING)
+        report_progress(GENERATING)
+        attempt.first_chunk.set()
+        report_progress(TEXT, text='Here is the try-on')
+        time.sleep(0.05)
+        report_image(b'image')
+        return [b'image']
+
+
+@override_settings(
+    VTON_NORMALIZE_ENABLED=False, RATE_LIMIT_ENABLED=False, VTON_JOB_EVENTS_HEARTBEAT=0.01,
+    VTON_BACKENDS=[{'NAME': 'streaming', 'BACKEND': 'virtual_tryon.tests.StreamingBackend'}],
+)
+class JobEventsTests(ResultCacheTestCase):
+
+    def _submit(self):
+        response = self.client.post('/vton/jobs/', {
+            'person_image': ContentFile(_jacket(BROWN), name='person.png'),
+            'cloth_image': ContentFile(_jacket(YELLOW), name='cloth.png'),
+        })
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def _events(self, response):
+        """Parses a server-sent event stream into (id, event, data) tuples, skipping comments."""
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        events = []
+        for message in b''.join(response.streaming_content).decode().split('\n\n'):
+            fields = dict(line.split(': ', 1) for line in message.splitlines() if not line.startswith(':'))
+            if fields:
+                events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+        return events
+
+    def test_event_sequence(self):
+        job = self._submit()
+        # Opened straight away, so most events arrive while the job runs
+        events = self._events(self.client.get(job['events_url']))
+        self.assertEqual(
+            [event for _, event, _ in events],
+            [QUEUED, RUNNING, UPLOADING, GENERATING, TEXT, IMAGE, DONE],
+        )
+        self.assertEqual([event_id for event_id, _, _ in events], list(range(7)))
+        data = {event: data for _, event, data in events}
+        self.assertEqual(data[TEXT], {'text': 'Here is the try-on'})
+        image_url = reverse('vton_job_image', args=[job['job_id']])
+        self.assertEqual(data[IMAGE], {'image_url': image_url})
+        self.assertEqual(data[DONE], {'images': 1, 'image_url': image_url})
+        self.assertEqual(self.client.get(image_url).content, b'image')
+
+    def test_resume_after_last_event_id(self):
+        job = self._submit()
+        _wait_for_job(job['job_id'])
+        events = self._events(self.client.get(job['events_url'], HTTP_LAST_EVENT_ID='4'))
+        self.assertEqual([(event_id, event) for event_id, event, _ in events], [(5, IMAGE), (6, DONE)])
+
+    def test_failed_job(self):
+        with mock.patch.object(StreamingBackend, 'generate', side_effect=RuntimeError('Upstream refused')), \
+                self.assertLogs('virtual_tryon.jobs', 'ERROR'):
+            job = self._submit()
+            events = self._events(self.client.get(job['events_url']))
+        self.assertEqual(events[-1][1:], (FAILED, {'error': 'Upstream refused'}))
+
+
+class CapturingBackend(StubBackend):
+    """StubBackend remembering the images and prompt of its last call."""
+    calls = []
+
+    def generate(self, images, prompt, attempt):
+        type(self).calls.append((list(images), prompt))
+        return super().generate(images, prompt, attempt)
+
+
+@override_settings(
+    VTON_NORMALIZE_ENABLED=False, RATE_LIMIT_ENABLED=False, VTON_OUTFIT_MAX_ITEMS=4,
+    VTON_BACKENDS=[{'NAME': 'capturing', 'BACKEND': 'virtual_tryon.tests.CapturingBackend'}],
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class OutfitTryonTests(ResultCacheTestCase, ProductTestCase):
+
+    def setUp(self):
+        super().setUp()
+        CapturingBackend.calls = []
+        self.user = _user('ada')
+        self.client.force_login(self.user)
+        self.outfit = Outfit.objects.create(user=self.user, name='Weekend')
+
+    def _item(self, category, image_data=None, store_product=None):
+        item = WardrobeItem(user=self.user, name=category, category=category, store_product=store_product)
+        if image_data is not None:
+            item.image.save(f'{category}.png', ContentFile(image_data), save=False)
+        item.save()
+        self.outfit.items.add(item)
+        return item
+
+    def _post(self, outfit_id=None):
+        return self.client.post(f'/vton/outfit/{outfit_id or self.outfit.pk}/', {
+            'person_image': ContentFile(_jacket(BROWN), name='person.png'),
+        })
+
+    def test_items_are_sent_in_one_generation(self):
+        shoes, dress, accessory = _jacket((20, 20, 20)), _jacket((200, 30, 60)), _jacket((30, 90, 200))
+        product = self._product('jacket', YELLOW)
+        self._item('shoes', shoes)
+        self._item('accessories', accessory)
+        self._item('tops', store_product=product)
+        self._item('dresses', dress)
+        # Ranked last and beyond VTON_OUTFIT_MAX_ITEMS
+        self._item('other', _jacket((0, 160, 0)))
+
+        response = self._post()
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(len(CapturingBackend.calls), 1)
+        images, prompt = CapturingBackend.calls[0]
+        self.assertEqual(prompt, VTON_OUTFIT_PROMPT)
+        # The person first, then the items by category, the store item as its prepared garment
+        self.assertEqual(images, [_jacket(BROWN), dress, read_garment(product)[0], shoes, accessory])
+
+    def test_unreadable_items_are_left_out(self):
+        top = _jacket(YELLOW)
+        self._item('tops', top)
+        self._item('bottoms', b'not an image')
+        # Neither a photo nor a store product
+        self._item('shoes')
+        self.assertEqual(self._post().status_code, 200)
+        self.assertEqual(CapturingBackend.calls[0][0], [_jacket(BROWN), top])
+
+    def test_outfit_without_images(self):
+        self._item('bottoms', b'not an image')
+        response = self._post()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CapturingBackend.calls, [])
+
+    def test_outfit_of_another_user(self):
+        other = Outfit.objects.create(user=_user('bob'), name='Office')
+        self._item('tops', _jacket(YELLOW))
+        other.items.add(*self.outfit.items.all())
+        self.assertEqual(self._post(other.pk).status_code, 404)
+        self.assertEqual(CapturingBackend.calls, [])
+
+    def test_sign_in_required(self):
+        self._item('tops', _jacket(YELLOW))
+        self.client.logout()
+        self.assertEqual(self._post().status_code, 401)
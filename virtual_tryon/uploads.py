@@ -0,0 +1,43 @@
+from django.conf import settings
+from django.core.files.uploadhandler import MemoryFileUploadHandler
+
+
+def get_max_upload_bytes():
+    return getattr(settings, 'VTON_MAX_UPLOAD_BYTES', 20 * 1024 * 1024)
+
+
+class InMemoryUploadHandler(MemoryFileUploadHandler):
+    """
+    Keeps try-on uploads in memory regardless of FILE_UPLOAD_MAX_MEMORY_SIZE.
+
+    Django spools uploads above 2.5 MB (i.e. most phone photos) into temporary
+    files.  The try-on views only ever need the raw bytes, so they install this
+    handler instead and reject request bodies above VTON_MAX_UPLOAD_BYTES.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.activated = content_length <= get_max_upload_bytes()
+
+
+def get_content_length(request):
+    """Returns the body size declared by ``request``, or None if it is missing or invalid."""
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH', ''))
+    except ValueError:
+        return None
+    return content_length if content_length >= 0 else None
+
+
+def use_in_memory_uploads(request):
+    """
+    Switches ``request`` to in-memory upload handling.
+
+    Must be called before request.POST or request.FILES is accessed.
+    Returns False when the request body is too large to accept, or when its
+    size is not declared (e.g. a chunked body), as it could not be capped.
+    """
+    content_length = get_content_length(request)
+    if content_length is None or content_length > get_max_upload_bytes():
+        return False
+    request.upload_handlers = [InMemoryUploadHandler(request)]
+    return True
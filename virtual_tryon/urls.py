@@ -3,4 +3,16 @@ from . import views
 
 urlpatterns = [
     path('generate_vton/', views.generate_vton, name='generate_vton'),
+    path('jobs/', views.submit_vton_job, name='submit_vton_job'),
+    path('jobs/<str:job_id>/', views.vton_job_status, name='vton_job_status'),
+    path('jobs/<str:job_id>/events/', views.vton_job_events, name='vton_job_events'),
+    path('jobs/<str:job_id>/image/', views.vton_job_image, name='vton_job_image'),
+    path('outfit/<int:outfit_id>/', views.generate_outfit_tryon, name='generate_outfit_tryon'),
+    path('batch/', views.submit_vton_batch, name='submit_vton_batch'),
+    path('batch/<str:batch_id>/', views.vton_batch_status, name='vton_batch_status'),
+    path('person/', views.register_person_image, name='register_person_image'),
+    path('gallery/', views.tryon_gallery, name='tryon_gallery'),
+    path('gallery/<int:result_id>/image/', views.tryon_gallery_image, name='tryon_gallery_image'),
+    path('results/<str:token>/', views.vton_result, name='vton_result'),
+    path('stats/', views.vton_stats, name='vton_stats'),
 ]
\ No newline at end of file
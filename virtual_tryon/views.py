@@ -1,174 +1,737 @@
-import os
+import math
+import uuid
 import mimetypes
-import time
 import json
-from django.shortcuts import render
-from django.http import JsonResponse, HttpResponse
+import base64
+from django.shortcuts import get_object_or_404
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core import signing
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.paginator import Paginator
+from django.db.models import Sum
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-import tempfile
-from django.core.files.storage import default_storage
+from django.urls import reverse
 from django.core.files.base import ContentFile
+from PIL import Image
 
-# Test import at module level to catch issues early
-try:
-    from google import genai
-    from google.genai import types
-    GOOGLE_GENAI_IMPORT_SUCCESS = True
-except ImportError as e:
-    GOOGLE_GENAI_IMPORT_SUCCESS = False
-    GOOGLE_GENAI_IMPORT_ERROR = str(e)
-
-def _get_mime_type(file_path):
-    """Guesses the MIME type of a file based on its extension."""
-    mime_type, _ = mimetypes.guess_type(file_path)
-    if mime_type is None:
-        raise ValueError(f"Could not determine MIME type for {file_path}")
-    return mime_type
-
-def _load_image_parts(image_paths):
-    """Loads image files and converts them into GenAI Part objects."""
-    # This will only be called if imports are successful
-    parts = []
-    for image_path in image_paths:
-        with open(image_path, "rb") as f:
-            image_data = f.read()
-        mime_type = _get_mime_type(image_path)
-        parts.append(
-            types.Part(inline_data=types.Blob(data=image_data, mime_type=mime_type))
-        )
-    return parts
+from .generation import (
+    GOOGLE_GENAI_IMPORT_SUCCESS, GOOGLE_GENAI_IMPORT_ERROR, VTON_PROMPT, VTON_OUTFIT_PROMPT,
+    get_tryon_key,
+)
+from .backends import get_backends
+from .cache import digest, get_result_cache
+from .imaging import fit_to_budget, normalize_image, sniff_mime_type
+from .garments import read_garment
+from .models import PersonImage, TryOnResult
+from .phash import match_product
+from .gallery import generate_and_save
+from .jobs import current_job, get_job_queue, QueueFull, DONE, FAILED, IMAGE
+from store.models import Product
+from wardrobe.models import Outfit
+from .uploads import use_in_memory_uploads, get_content_length, get_max_upload_bytes
+from greatkart import metrics
+from greatkart.ratelimit import check_rate_limit, rate_limit, too_many_requests
+from greatkart.upstream import UpstreamBusy, get_upstream_limiter
+
+# How a generated image is returned: base64 inside JSON (the original contract),
+# the raw image bytes, or JSON holding a short-lived URL to the stored image.
+RESPONSE_MODES = ('json', 'binary', 'url')
+RESULT_URL_SALT = 'virtual_tryon.result_url'
+
+# Which outfit items are sent first when an outfit has more than fit in one request
+OUTFIT_CATEGORY_ORDER = ('dresses', 'tops', 'bottoms', 'outerwear', 'formal', 'activewear', 'casual', 'shoes', 'accessories')
 
-def remix_images(image_paths, prompt):
+def _check_vton_available():
+    """Returns an error response if try-on generation cannot run, otherwise None."""
+    # Backends such as the local stub need neither the library nor a key
+    if not any(backend.uses_genai for backend in get_backends()):
+        return None
+    
+    # Check if Google Generative AI library is available
+    if not GOOGLE_GENAI_IMPORT_SUCCESS:
+        return JsonResponse({'error': f'Google Generative AI library is not installed: {GOOGLE_GENAI_IMPORT_ERROR}'}, status=500)
+    
+    # Check API key
+    api_key = getattr(settings, 'GEMINI_API_KEY', None)
+    if not api_key or not api_key.strip():
+        return JsonResponse({'error': 'GEMINI_API_KEY is not set in Django settings. Please add your API key to settings.py'}, status=500)
+    return None
+
+def _read_image_upload(upload, name):
     """
-    Remixes images using the Google Generative AI model.
-    Exactly matches the working nano-banana implementation.
+    Reads an uploaded image into memory and checks that it is a supported format.
+
+    Returns (image_data, None) on success or (None, error_response).
+    """
+    image_data = upload.read()
+    try:
+        sniff_mime_type(image_data)
+    except ValueError:
+        return None, JsonResponse({'error': f'{name} must be a JPEG, PNG, WebP, GIF or HEIC image'}, status=400)
+    return image_data, None
 
-    Args:
-        image_paths: A list of paths to input images.
-        prompt: The prompt for remixing the images.
+def _upload_rejected_response(request):
+    """The answer to a request refused by use_in_memory_uploads: too large, or of unknown size."""
+    if get_content_length(request) is None:
+        return JsonResponse({'error': 'Uploads must be sent with a Content-Length header'}, status=411)
+    return JsonResponse({'error': f'Upload is too large, the limit is {get_max_upload_bytes() // (1024 * 1024)} MB'}, status=413)
 
-    Returns:
-        List of generated images data
+def _read_person_image(request):
     """
-    # Get API key from settings
-    api_key = getattr(settings, 'GEMINI_API_KEY', None)
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY not set in Django settings")
-    
-    client = genai.Client(api_key=api_key)
+    Returns (image_data, digest, None) for the 'person_handle' of a registered
+    person image or the 'person_image' upload, or (None, None, error_response).
+    """
+    handle = request.POST.get('person_handle')
+    if handle:
+        person = PersonImage.objects.filter(handle=handle).first()
+        if person is None or person.is_expired() or not person.is_owned_by(request):
+            return None, None, JsonResponse({'error': 'Unknown or expired person_handle'}, status=404)
+        return person.read(), person.content_hash, None
     
-    # Use exact model name from working implementation
-    MODEL_NAME = "gemini-2.5-flash-image-preview"
+    person_upload = request.FILES.get('person_image')
+    if not person_upload:
+        return None, None, JsonResponse({'error': 'person_image or person_handle is required'}, status=400)
+    image_data, error_response = _read_image_upload(person_upload, 'person_image')
+    if error_response:
+        return None, None, error_response
+    return image_data, None, None
+
+def _read_tryon_images(request):
+    """
+    Reads the person image ('person_image' upload or 'person_handle') and the
+    garment straight into memory: the prepared image of the store product
+    'product_id', or the 'cloth_image' upload.
+
+    Returns (images, digests, product, None) on success or
+    (None, None, None, error_response). digests holds the known sha256 of each
+    image, or None where it is still to be computed, and product the store
+    product the garment belongs to, if any.
+    """
+    if not use_in_memory_uploads(request):
+        return None, None, None, _upload_rejected_response(request)
     
-    contents = _load_image_parts(image_paths)
-    contents.append(genai.types.Part.from_text(text=prompt))
+    person_image, person_digest, error_response = _read_person_image(request)
+    if error_response:
+        return None, None, None, error_response
     
-    generate_content_config = types.GenerateContentConfig(
-        response_modalities=["IMAGE", "TEXT"],
-    )
+    product_id = request.POST.get('product_id')
+    if product_id:
+        try:
+            product = Product.objects.filter(pk=int(product_id)).exclude(images='').first()
+        except ValueError:
+            return None, None, None, JsonResponse({'error': 'product_id must be an integer'}, status=400)
+        if product is None:
+            return None, None, None, JsonResponse({'error': f'Product {product_id} does not exist or has no image'}, status=404)
+        cloth_image, cloth_digest, error_response = _read_product_garment(product)
+        if error_response:
+            return None, None, None, error_response
+        return [person_image, cloth_image], [person_digest, cloth_digest], product, None
     
-    # Use exact streaming approach from working implementation
-    stream = client.models.generate_content_stream(
-        model=MODEL_NAME,
-        contents=contents,
-        config=generate_content_config,
-    )
+    cloth_upload = request.FILES.get('cloth_image')
+    if not cloth_upload:
+        return None, None, None, JsonResponse({'error': 'cloth_image or product_id is required'}, status=400)
+    cloth_image, error_response = _read_image_upload(cloth_upload, 'cloth_image')
+    if error_response:
+        return None, None, None, error_response
+    cloth_image, cloth_digest, product = _resolve_cloth_image(cloth_image)
     
-    # Process stream exactly like working implementation
-    images_data = []
-    for chunk in stream:
-        if (
-            chunk.candidates is None
-            or chunk.candidates[0].content is None
-            or chunk.candidates[0].content.parts is None
-        ):
-            continue
+    return [person_image, cloth_image], [person_digest, cloth_digest], product, None
+
+def _read_product_garment(product):
+    """
+    Reads a store product's garment image, preparing it first if needed.
+
+    Returns (image bytes, digest, None) or (None, None, error_response) when
+    the product image cannot be read or decoded.
+    """
+    try:
+        cloth_image, cloth_digest = read_garment(product)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None, None, JsonResponse({'error': f'The image of product {product.pk} cannot be read'}, status=500)
+    return cloth_image, cloth_digest, None
+
+def _resolve_cloth_image(cloth_image):
+    """
+    Swaps a re-encoded copy of a store product's image for the product's garment image.
+
+    Every copy then shares the product's cache key and gallery entries.
+    Returns (cloth_image, digest, product); digest and product are None when
+    nothing matched.
+    """
+    product = match_product(cloth_image)
+    if product is None:
+        return cloth_image, None, None
+    try:
+        cloth_image, cloth_digest = read_garment(product)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return cloth_image, None, None
+    return cloth_image, cloth_digest, product
+
+def _gallery_user(request):
+    """The user whose gallery keeps the results of this request, if any."""
+    return request.user if request.user.is_authenticated else None
+
+def _get_response_mode(request):
+    return request.GET.get('response') or request.POST.get('response') or 'json'
+
+def _check_response_mode(request):
+    """Returns an error response if the requested response mode is unusable, otherwise None."""
+    mode = _get_response_mode(request)
+    if mode not in RESPONSE_MODES:
+        return JsonResponse({'error': f'response must be one of: {", ".join(RESPONSE_MODES)}'}, status=400)
+    if mode == 'url' and get_result_cache() is None:
+        return JsonResponse({'error': 'URL responses require the result cache (VTON_CACHE_ENABLED)'}, status=400)
+    return None
+
+def _image_content_type(image_data):
+    try:
+        return sniff_mime_type(image_data)
+    except ValueError:
+        return 'application/octet-stream'
 
-        for part in chunk.candidates[0].content.parts:
-            if part.inline_data and part.inline_data.data:
-                images_data.append(part.inline_data.data)
+def _tryon_response(request, generated_images, result_key, extra=None):
+    """
+    Returns the first generated image in the response mode asked for by the client.
+
+    ``result_key`` is the result cache key the images are stored under, which
+    url responses link to.
+    """
+    mode = _get_response_mode(request)
+    image_data = generated_images[0]
     
-    return images_data
+    with metrics.span('vton.encode', mode=mode) as span:
+        if mode == 'binary':
+            response = HttpResponse(image_data, content_type=_image_content_type(image_data))
+        else:
+            data = {'success': True}
+            data.update(extra or {})
+            if mode == 'url':
+                token = signing.dumps({'key': result_key, 'index': 0}, salt=RESULT_URL_SALT)
+                data['image_url'] = request.build_absolute_uri(reverse('vton_result', args=[token]))
+                data['expires_in'] = getattr(settings, 'VTON_RESULT_URL_TTL', 300)
+            else:
+                # Return the image data as base64 for the frontend to display
+                data['image_data'] = base64.b64encode(image_data).decode('utf-8')
+            response = JsonResponse(data)
+        span.bytes = len(response.content)
+    return response
 
 @csrf_exempt
+@rate_limit('vton')
 def generate_vton(request):
     """
     Handles the VTON image generation request.
-    Expects POST request with 'person_image' and 'cloth_image' files.
+    Expects POST request with 'person_image' and 'cloth_image' files; a
+    'person_handle' from register_person_image can replace 'person_image'
+    and the 'product_id' of a store product can replace 'cloth_image'.
+    An optional 'response' parameter selects 'json' (base64 image, the default),
+    'binary' (the image itself) or 'url' (a short-lived link to the image).
     """
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
     
-    # Check if Google Generative AI library is available
-    if not GOOGLE_GENAI_IMPORT_SUCCESS:
-        return JsonResponse({'error': f'Google Generative AI library is not installed: {GOOGLE_GENAI_IMPORT_ERROR}'}, status=500)
+    # The id ties together the timing log lines of this request's stages
+    with metrics.bind(request_id=uuid.uuid4().hex[:12]):
+        with metrics.span('vton.request') as span:
+            response = _generate_vton(request)
+            span.fields['status'] = response.status_code
+    return response
+
+def _generate_vton(request):
+    error_response = _check_vton_available()
+    if error_response:
+        return error_response
     
-    # Check API key
-    api_key = getattr(settings, 'GEMINI_API_KEY', None)
-    if not api_key or not api_key.strip():
-        return JsonResponse({'error': 'GEMINI_API_KEY is not set in Django settings. Please add your API key to settings.py'}, status=500)
+    with metrics.span('vton.upload') as span:
+        images, digests, product, error_response = _read_tryon_images(request)
+        if images:
+            span.bytes = sum(len(image_data) for image_data in images)
+    if error_response:
+        return error_response
     
+    error_response = _check_response_mode(request)
+    if error_response:
+        return error_response
+    
+    cache_key = get_tryon_key(images, VTON_PROMPT, digests=digests)
+    return _generate_response(request, images, VTON_PROMPT, cache_key, person_hash=digests[0], product=product)
+
+def _generate_response(request, images, prompt, cache_key, person_hash=None, product=None):
+    """Generates a try-on (or serves it from the cache or gallery) and returns it as the response."""
     try:
-        # Get the uploaded files
-        person_image = request.FILES.get('person_image')
-        cloth_image = request.FILES.get('cloth_image')
-        
-        if not person_image or not cloth_image:
-            return JsonResponse({'error': 'Both person_image and cloth_image are required'}, status=400)
-        
-        # Create temporary files for processing
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as person_temp:
-            person_temp.write(person_image.read())
-            person_temp_path = person_temp.name
-            
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as cloth_temp:
-            cloth_temp.write(cloth_image.read())
-            cloth_temp_path = cloth_temp.name
-        
-        # Use the exact prompt from working implementation
-        prompt = "Combine the subjects of these images in a natural way, producing a new image."
-        
-        # Generate the VTON image
-        image_paths = [person_temp_path, cloth_temp_path]
-        print(f"DEBUG: Generating VTON with images: {image_paths}")
-        print(f"DEBUG: Using prompt: {prompt}")
-        
-        generated_images = remix_images(image_paths, prompt)
-        
-        # Clean up temporary files
-        os.unlink(person_temp_path)
-        os.unlink(cloth_temp_path)
-        
-        print(f"DEBUG: Generated {len(generated_images)} images")
+        # Generate the VTON image, reusing a cached result for identical inputs
+        with metrics.span('vton.generate'):
+            generated_images, result_key = generate_and_save(
+                images, prompt, cache_key, user=_gallery_user(request), person_hash=person_hash,
+                product=product,
+            )
         
         if not generated_images:
             return JsonResponse({'error': 'Failed to generate VTON image - no images returned'}, status=500)
         
         # For now, we'll return the first generated image
-        generated_image_data = generated_images[0]
-        
-        # Return the image data as base64 for the frontend to display
-        import base64
-        image_base64 = base64.b64encode(generated_image_data).decode('utf-8')
-        
-        print(f"DEBUG: Returning image data (length: {len(image_base64)})")
-        
-        return JsonResponse({
-            'success': True,
-            'image_data': image_base64
-        })
+        return _tryon_response(request, generated_images, result_key)
         
+    except UpstreamBusy as e:
+        # Rate limited, or the circuit breaker is open: fail fast with a hint for the client
+        retry_after = math.ceil(e.retry_after)
+        response = JsonResponse({'error': str(e), 'retry_after': retry_after}, status=503)
+        response['Retry-After'] = str(retry_after)
+        return response
     except Exception as e:
-        # Clean up temporary files if they exist
-        try:
-            os.unlink(person_temp_path)
-        except:
-            pass
-        try:
-            os.unlink(cloth_temp_path)
-        except:
-            pass
-            
         # Return more detailed error information for debugging
         return JsonResponse({'error': f'VTON generation failed: {str(e)}'}, status=500)
+
+@csrf_exempt
+@rate_limit('vton')
+def generate_outfit_tryon(request, outfit_id):
+    """
+    Tries on a whole wardrobe outfit of the signed-in user in a single generation.
+    Expects POST request with a 'person_image' file or 'person_handle'. Up to
+    VTON_OUTFIT_MAX_ITEMS item images of the outfit are sent along with it,
+    downscaled so that all images together stay within VTON_OUTFIT_MAX_PAYLOAD_BYTES.
+    Accepts the same 'response' parameter as generate_vton.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Authentication required'}, status=401)
+    
+    with metrics.bind(request_id=uuid.uuid4().hex[:12]):
+        with metrics.span('vton.outfit.request', outfit=outfit_id) as span:
+            response = _generate_outfit_tryon(request, outfit_id)
+            span.fields['status'] = response.status_code
+    return response
+
+def _generate_outfit_tryon(request, outfit_id):
+    error_response = _check_vton_available()
+    if error_response:
+        return error_response
+    
+    outfit = Outfit.objects.filter(pk=outfit_id, user=request.user).first()
+    if outfit is None:
+        return JsonResponse({'error': 'Outfit not found'}, status=404)
+    
+    if not use_in_memory_uploads(request):
+        return _upload_rejected_response(request)
+    person_image, person_digest, error_response = _read_person_image(request)
+    if error_response:
+        return error_response
+    
+    error_response = _check_response_mode(request)
+    if error_response:
+        return error_response
+    
+    # The model takes at most five images, the person's included
+    item_images = _read_outfit_item_images(outfit, min(getattr(settings, 'VTON_OUTFIT_MAX_ITEMS', 4), 4))
+    if not item_images:
+        return JsonResponse({'error': 'None of the outfit items has an image'}, status=400)
+    
+    with metrics.span('vton.outfit.pack', items=len(item_images)) as span:
+        images = fit_to_budget(
+            [person_image, *item_images],
+            getattr(settings, 'VTON_OUTFIT_MAX_PAYLOAD_BYTES', 4 * 1024 * 1024),
+        )
+        span.bytes = sum(len(image_data) for image_data in images)
+    
+    cache_key = get_tryon_key(images, VTON_OUTFIT_PROMPT)
+    return _generate_response(
+        request, images, VTON_OUTFIT_PROMPT, cache_key, person_hash=person_digest or digest(person_image),
+    )
+
+def _read_outfit_item_images(outfit, limit):
+    """
+    Returns the images of up to ``limit`` items of ``outfit``, main garments first.
+
+    Items bought in the store use the product's prepared garment image, others
+    their own photo; items without either are left out.
+    """
+    def rank(item):
+        if item.category in OUTFIT_CATEGORY_ORDER:
+            return OUTFIT_CATEGORY_ORDER.index(item.category)
+        return len(OUTFIT_CATEGORY_ORDER)
+    
+    images = []
+    for item in sorted(outfit.items.select_related('store_product'), key=rank):
+        if len(images) >= limit:
+            break
+        try:
+            if item.store_product is not None and item.store_product.images:
+                images.append(read_garment(item.store_product)[0])
+            elif item.image:
+                with item.image.open('rb') as f:
+                    image_data = f.read()
+                sniff_mime_type(image_data)
+                images.append(image_data)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            # A missing or unsupported file; try the outfit without it
+            continue
+    return images
+
+@csrf_exempt
+@rate_limit('vton')
+def submit_vton_job(request):
+    """
+    Queues a VTON image generation and returns its job id straight away.
+    Expects the same parameters as generate_vton.
+    Poll vton_job_status with the returned job id to collect the result, or
+    follow its progress from the server-sent event stream at events_url.
+    Only the user, or for anonymous visitors the session, that submitted the
+    job can follow it; anybody else gets a 404.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    
+    error_response = _check_vton_available()
+    if error_response:
+        return error_response
+    
+    images, digests, product, error_response = _read_tryon_images(request)
+    if error_response:
+        return error_response
+    
+    cache_key = get_tryon_key(images, VTON_PROMPT, digests=digests)
+    try:
+        job = get_job_queue().submit(
+            _run_tryon_job, images, VTON_PROMPT, cache_key,
+            user=_gallery_user(request), person_hash=digests[0], product=product,
+        )
+    except QueueFull as e:
+        response = JsonResponse({'error': str(e)}, status=503)
+        response['Retry-After'] = '5'
+        return response
+    job.owner = _job_owner(request)
+    
+    data = job.to_dict()
+    data['success'] = True
+    data['status_url'] = reverse('vton_job_status', args=[job.id])
+    data['events_url'] = reverse('vton_job_events', args=[job.id])
+    return JsonResponse(data, status=202)
+
+def _job_owner(request):
+    """Identifies who submits a job, starting a session for anonymous visitors."""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    if not request.session.session_key:
+        request.session.create()
+    return f'session:{request.session.session_key}'
+
+def _is_job_owner(request, owner):
+    if request.user.is_authenticated:
+        return owner == f'user:{request.user.pk}'
+    return bool(request.session.session_key) and owner == f'session:{request.session.session_key}'
+
+def _get_job(request, job_id):
+    """Returns the job ``job_id`` if the requester submitted it, else None."""
+    job = get_job_queue().get(job_id)
+    if job is None or not _is_job_owner(request, job.owner):
+        return None
+    return job
+
+def _run_tryon_job(images, prompt, cache_key, **kwargs):
+    """Job function: generate_and_save, remembering where the result is stored for url responses."""
+    generated_images, result_key = generate_and_save(images, prompt, cache_key, **kwargs)
+    current_job().cache_key = result_key
+    return generated_images
+
+def vton_job_status(request, job_id):
+    """
+    Reports the state of a queued VTON job.
+    Once the job is done the generated image is returned in the format chosen
+    by the 'response' parameter, exactly like generate_vton.
+    """
+    job = _get_job(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown or expired job'}, status=404)
+    
+    error_response = _check_response_mode(request)
+    if error_response:
+        return error_response
+    
+    data = job.to_dict()
+    if job.status != DONE:
+        return JsonResponse(data)
+    if not job.result:
+        data['error'] = 'Failed to generate VTON image - no images returned'
+        return JsonResponse(data)
+    return _tryon_response(request, job.result, job.cache_key, extra=data)
+
+def vton_job_events(request, job_id):
+    """
+    Streams the progress of a VTON job as server-sent events.
+
+    Events are queued, running, uploading, generating, text (a text part of
+    the model's answer), image and finally done or failed. The image and done
+    events carry an image_url from which the generated image can be fetched
+    as soon as its first chunk has arrived. A reconnecting client resumes
+    after the event named by its Last-Event-ID header.
+    """
+    job = _get_job(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown or expired job'}, status=404)
+    
+    try:
+        after = int(request.headers.get('Last-Event-ID', -1)) + 1
+    except ValueError:
+        after = 0
+    
+    response = StreamingHttpResponse(_job_event_stream(job, after), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _job_event_stream(job, after):
+    heartbeat = getattr(settings, 'VTON_JOB_EVENTS_HEARTBEAT', 15)
+    while True:
+        events = job.wait_for_events(after, heartbeat)
+        if not events:
+            # Comment line keeping proxies from closing an idle connection
+            yield ': keep-alive\n\n'
+            continue
+        for event in events:
+            data = dict(event['data'])
+            if event['event'] in (IMAGE, DONE) and (job.first_image or job.result):
+                data['image_url'] = reverse('vton_job_image', args=[job.id])
+            yield f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(data)}\n\n"
+            after = event['id'] + 1
+            if event['event'] in (DONE, FAILED):
+                return
+
+def vton_job_image(request, job_id):
+    """Serves the image of a VTON job, available as soon as generation has produced it."""
+    job = _get_job(request, job_id)
+    if job is None:
+        return JsonResponse({'error': 'Unknown or expired job'}, status=404)
+    image_data = job.result[0] if job.status == DONE and job.result else job.first_image
+    if image_data is None:
+        return JsonResponse({'error': 'The image is not ready yet'}, status=404)
+    return HttpResponse(image_data, content_type=_image_content_type(image_data))
+
+def vton_result(request, token):
+    """Serves a stored try-on image from a signed, short-lived URL."""
+    try:
+        payload = signing.loads(
+            token, salt=RESULT_URL_SALT, max_age=getattr(settings, 'VTON_RESULT_URL_TTL', 300)
+        )
+    except signing.SignatureExpired:
+        return JsonResponse({'error': 'This result link has expired'}, status=410)
+    except signing.BadSignature:
+        return JsonResponse({'error': 'Invalid result link'}, status=404)
+    
+    cache = get_result_cache()
+    generated_images = cache.get(payload['key'], record_stats=False) if cache else None
+    if not generated_images or payload['index'] >= len(generated_images):
+        return JsonResponse({'error': 'This result is no longer available'}, status=404)
+    
+    image_data = generated_images[payload['index']]
+    response = HttpResponse(image_data, content_type=_image_content_type(image_data))
+    response['Cache-Control'] = 'private, max-age=%d' % getattr(settings, 'VTON_RESULT_URL_TTL', 300)
+    return response
+
+@csrf_exempt
+@rate_limit('vton')
+def submit_vton_batch(request):
+    """
+    Queues try-ons of one person image against several garments.
+    Expects POST request with a 'person_image' file (or 'person_handle') plus 'product_ids'
+    (store products) and/or 'cloth_images' files, up to VTON_BATCH_MAX_ITEMS
+    in total. At most VTON_BATCH_CONCURRENCY of them are generated at once;
+    each item is a job whose result can be collected as soon as it is done.
+    Each garment counts as one try-on request against the 'vton' rate limit.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    
+    error_response = _check_vton_available()
+    if error_response:
+        return error_response
+    
+    if not use_in_memory_uploads(request):
+        return _upload_rejected_response(request)
+    
+    product_ids = []
+    for value in request.POST.getlist('product_ids'):
+        product_ids.extend(part.strip() for part in value.split(',') if part.strip())
+    cloth_uploads = request.FILES.getlist('cloth_images')
+    # Refuse oversized batches before reading and matching any image
+    max_items = getattr(settings, 'VTON_BATCH_MAX_ITEMS', 12)
+    if not product_ids and not cloth_uploads:
+        return JsonResponse({'error': 'Provide at least one of product_ids or cloth_images'}, status=400)
+    item_count = len(product_ids) + len(cloth_uploads)
+    if item_count > max_items:
+        return JsonResponse({'error': f'A batch can contain at most {max_items} garments'}, status=400)
+    
+    # The first garment was charged by @rate_limit along with the request
+    limit_result = check_rate_limit('vton', request, cost=item_count - 1) if item_count > 1 else None
+    if limit_result is not None and not limit_result.allowed:
+        return too_many_requests(limit_result)
+    
+    person_image, person_digest, error_response = _read_person_image(request)
+    if error_response:
+        return error_response
+    
+    # Each item is a (description, cloth image bytes, cloth digest or None, product) tuple
+    items = []
+    if product_ids:
+        try:
+            products = Product.objects.in_bulk([int(product_id) for product_id in product_ids])
+        except ValueError:
+            return JsonResponse({'error': 'product_ids must be integers'}, status=400)
+        for product_id in product_ids:
+            product = products.get(int(product_id))
+            if product is None or not product.images:
+                return JsonResponse({'error': f'Product {product_id} does not exist or has no image'}, status=400)
+            cloth_image, cloth_digest, error_response = _read_product_garment(product)
+            if error_response:
+                return error_response
+            items.append(({'product_id': product.id}, cloth_image, cloth_digest, product))
+    for index, upload in enumerate(cloth_uploads):
+        cloth_image, error_response = _read_image_upload(upload, 'cloth_images')
+        if error_response:
+            return error_response
+        cloth_image, cloth_digest, product = _resolve_cloth_image(cloth_image)
+        items.append(({'cloth_index': index}, cloth_image, cloth_digest, product))
+    
+    calls = []
+    user = _gallery_user(request)
+    for _, cloth_image, cloth_digest, product in items:
+        images = [person_image, cloth_image]
+        cache_key = get_tryon_key(images, VTON_PROMPT, digests=[person_digest, cloth_digest])
+        calls.append((
+            (images, VTON_PROMPT, cache_key),
+            {'user': user, 'person_hash': person_digest, 'product': product},
+        ))
+    try:
+        batch = get_job_queue().submit_batch(
+            _run_tryon_job, calls, getattr(settings, 'VTON_BATCH_CONCURRENCY', 3)
+        )
+    except QueueFull as e:
+        response = JsonResponse({'error': str(e)}, status=503)
+        response['Retry-After'] = '5'
+        return response
+    batch.owner = _job_owner(request)
+    for (label, _, _, _), job in zip(items, batch.jobs):
+        job.label = label
+        job.owner = batch.owner
+    
+    data = _batch_status(batch)
+    data['success'] = True
+    response = JsonResponse(data, status=202)
+    return limit_result.add_headers(response) if limit_result is not None else response
+
+def _batch_status(batch):
+    data = batch.to_dict()
+    data['status_url'] = reverse('vton_batch_status', args=[batch.id])
+    data['items'] = []
+    for job in batch.jobs:
+        item = job.to_dict()
+        item.update(job.label)
+        item['status_url'] = reverse('vton_job_status', args=[job.id])
+        data['items'].append(item)
+    return data
+
+def vton_batch_status(request, batch_id):
+    """
+    Reports the state of every item of a batch.
+    Collect finished items from their status_url, which accepts the same
+    'response' parameter as generate_vton.
+    """
+    batch = get_job_queue().get_batch(batch_id)
+    if batch is None or not _is_job_owner(request, batch.owner):
+        return JsonResponse({'error': 'Unknown or expired batch'}, status=404)
+    return JsonResponse(_batch_status(batch))
+
+@csrf_exempt
+def register_person_image(request):
+    """
+    Stores a normalized person photo once for use in several try-ons.
+    Expects POST request with a 'person_image' file. Returns a 'person_handle'
+    that generate_vton, the job and the batch endpoints accept instead of the
+    file until it expires after VTON_PERSON_HANDLE_TTL seconds.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Only POST method is allowed'}, status=405)
+    
+    if not use_in_memory_uploads(request):
+        return _upload_rejected_response(request)
+    
+    person_upload = request.FILES.get('person_image')
+    if not person_upload:
+        return JsonResponse({'error': 'person_image is required'}, status=400)
+    image_data, error_response = _read_image_upload(person_upload, 'person_image')
+    if error_response:
+        return error_response
+    
+    if request.user.is_authenticated:
+        owner = {'user': request.user}
+    else:
+        if not request.session.session_key:
+            request.session.create()
+        owner = {'session_key': request.session.session_key}
+    
+    normalized = normalize_image(image_data)
+    person = PersonImage(content_hash=digest(image_data), **owner)
+    extension = mimetypes.guess_extension(_image_content_type(normalized)) or '.bin'
+    person.image.save(f'{person.handle}{extension}', ContentFile(normalized), save=False)
+    person.save()
+    
+    return JsonResponse({
+        'success': True,
+        'person_handle': person.handle,
+        'expires_at': person.expires_at.isoformat(),
+    }, status=201)
+
+def tryon_gallery(request):
+    """Lists the signed-in user's stored try-on results, newest first."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Authentication required'}, status=401)
+    
+    results = TryOnResult.objects.filter(user=request.user).select_related('product')
+    
+    # Pagination
+    paginator = Paginator(results, 12)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    
+    items = []
+    for result in page_obj:
+        items.append({
+            'id': result.id,
+            'image_url': reverse('tryon_gallery_image', args=[result.id]),
+            'thumbnail_url': result.thumbnail.url if result.thumbnail else None,
+            'product_id': result.product_id,
+            'product_name': result.product.product_name if result.product else None,
+            'created_at': result.created_at.isoformat(),
+        })
+    
+    return JsonResponse({
+        'success': True,
+        'results': items,
+        'page': page_obj.number,
+        'num_pages': paginator.num_pages,
+        'count': paginator.count,
+        'used_bytes': results.aggregate(total=Sum('size_bytes'))['total'] or 0,
+        'quota_bytes': getattr(settings, 'VTON_GALLERY_QUOTA_BYTES', 50 * 1024 * 1024),
+    })
+
+def tryon_gallery_image(request, result_id):
+    """Serves a stored try-on image from the signed-in user's gallery."""
+    if not request.user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Authentication required'}, status=401)
+    
+    result = get_object_or_404(TryOnResult, id=result_id, user=request.user)
+    result.touch()
+    image_data = result.read()
+    return HttpResponse(image_data, content_type=_image_content_type(image_data))
+
+@staff_member_required
+def vton_stats(request):
+    """Reports try-on metrics, cache and job queue statistics for this process."""
+    cache = get_result_cache()
+    return JsonResponse({
+        'metrics': metrics.snapshot(),
+        'cache': cache.stats() if cache else None,
+        'jobs': get_job_queue().stats(),
+        'breakers': get_upstream_limiter().breaker_states(),
+    })
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WardrobeItem, Outfit, WardrobeStats
+from .models import WardrobeItem, Outfit, WardrobeStats, WardrobeCategoryStats
 
 @admin.register(WardrobeItem)
 class WardrobeItemAdmin(admin.ModelAdmin):
@@ -36,6 +36,22 @@ class OutfitAdmin(admin.ModelAdmin):
 class WardrobeStatsAdmin(admin.ModelAdmin):
     list_display = ['user', 'total_items', 'total_outfits', 'most_worn_category', 'total_value', 'updated_at']
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['recompute_stats']
+    
+    @admin.action(description='Recompute selected stats from scratch')
+    def recompute_stats(self, request, queryset):
+        for stats in queryset.select_related('user'):
+            stats.update_stats()
+        self.message_user(request, f'Recomputed {queryset.count()} wardrobe stats.')
+    
+    def has_add_permission(self, request):
+        return False  # Stats are auto-generated
+
+@admin.register(WardrobeCategoryStats)
+class WardrobeCategoryStatsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'category', 'item_count', 'times_worn']
+    list_filter = ['category']
+    search_fields = ['user__username']
     
     def has_add_permission(self, request):
-        return False  # Stats are auto-generated
\ No newline at end of file
+        return False  # Kept up to date by signals
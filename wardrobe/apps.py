@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class WardrobeConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'wardrobe'
-    verbose_name = 'Wardrobe'
\ No newline at end of file
+    verbose_name = 'Wardrobe'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from wardrobe.models import WardrobeStats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes wardrobe statistics from scratch, or only those that have drifted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--drifted',
+            action='store_true',
+            help='Only recompute stats whose counts no longer match the wardrobe.',
+        )
+
+    def handle(self, *args, **options):
+        recomputed = 0
+        for stats in WardrobeStats.objects.select_related('user').iterator():
+            if options['drifted'] and not stats.has_drifted():
+                continue
+            stats.update_stats()
+            recomputed += 1
+        self.stdout.write(self.style.SUCCESS(f'Recomputed {recomputed} wardrobe stats.'))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wardrobe', '0002_wardrobecategorystats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='wardrobecategorystats',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='wardrobecategorystats',
+            name='times_worn',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
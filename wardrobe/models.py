@@ -1,8 +1,12 @@
 from django.db import models
+from django.db.models import Count, Sum
 from django.conf import settings
 from store.models import Product, Variation
 from django.utils import timezone
 
+# WardrobeItem fields that WardrobeStats depend on
+STATS_FIELDS = ('user_id', 'category', 'purchase_price', 'times_worn')
+
 class WardrobeItem(models.Model):
     CLOTHING_CATEGORIES = [
         ('tops', 'Tops'),
@@ -72,6 +76,19 @@ class WardrobeItem(models.Model):
     def __str__(self):
         return f"{self.user.username}'s {self.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so that saving can update WardrobeStats by the difference
+        loaded = dict(zip(field_names, values))
+        if all(name in loaded for name in STATS_FIELDS):
+            instance._stats_snapshot = tuple(loaded[name] for name in STATS_FIELDS)
+        return instance
+    
+    def stats_snapshot(self):
+        """The values WardrobeStats are computed from"""
+        return tuple(getattr(self, name) for name in STATS_FIELDS)
+    
     def get_tags_list(self):
         """Return tags as a list"""
         if self.tags:
@@ -138,24 +155,56 @@ class WardrobeStats(models.Model):
         return f"{self.user.username}'s Wardrobe Stats"
     
     def update_stats(self):
-        """Update all statistics"""
-        items = WardrobeItem.objects.filter(user=self.user)
-        outfits = Outfit.objects.filter(user=self.user)
+        """
+        Recompute all statistics from scratch.
         
-        self.total_items = items.count()
-        self.total_outfits = outfits.count()
+        Signals keep them up to date on every change (see signals.py), so this
+        is only needed on request or when has_drifted() finds them inconsistent.
+        """
+        items = WardrobeItem.objects.filter(user=self.user).order_by()
+        totals = items.aggregate(count=Count('id'), value=Sum('purchase_price'))
+        self.total_items = totals['count']
+        self.total_outfits = Outfit.objects.filter(user=self.user).count()
+        self.total_value = totals['value'] or 0
         
-        # Calculate total value
-        total_value = sum(item.purchase_price or 0 for item in items)
-        self.total_value = total_value
+        category_rows = [
+            WardrobeCategoryStats(
+                user=self.user, category=row['category'],
+                item_count=row['item_count'], times_worn=row['times_worn'] or 0,
+            )
+            for row in items.values('category').annotate(item_count=Count('id'), times_worn=Sum('times_worn'))
+        ]
+        WardrobeCategoryStats.objects.filter(user=self.user).delete()
+        WardrobeCategoryStats.objects.bulk_create(category_rows)
         
-        # Find most worn category
-        if items.exists():
-            category_counts = {}
-            for item in items:
-                category_counts[item.category] = category_counts.get(item.category, 0) + item.times_worn
-            
-            if category_counts:
-                self.most_worn_category = max(category_counts, key=category_counts.get)
+        # Find most worn category, breaking ties by name as the signals do
+        most_worn = min(category_rows, key=lambda row: (-row.times_worn, row.category), default=None)
+        self.most_worn_category = most_worn.category if most_worn else None
         
-        self.save()
\ No newline at end of file
+        self.save()
+    
+    def has_drifted(self):
+        """Cheap check that the incrementally kept counts still match the wardrobe"""
+        category_items = WardrobeCategoryStats.objects.filter(user=self.user).aggregate(
+            total=Sum('item_count')
+        )['total'] or 0
+        return (
+            self.total_items != WardrobeItem.objects.filter(user=self.user).count()
+            or self.total_outfits != Outfit.objects.filter(user=self.user).count()
+            or category_items != self.total_items
+        )
+
+class WardrobeCategoryStats(models.Model):
+    """Per-category counts behind WardrobeStats, kept up to date by signals"""
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='wardrobe_category_stats')
+    category = models.CharField(max_length=20, choices=WardrobeItem.CLOTHING_CATEGORIES)
+    item_count = models.PositiveIntegerField(default=0)
+    times_worn = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'category'], name='unique_wardrobe_category_stats'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username}'s {self.category} stats"
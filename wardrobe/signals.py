@@ -0,0 +1,127 @@
+"""
+Keeps WardrobeStats up to date incrementally.
+
+Every save or delete of a WardrobeItem or Outfit applies the difference it
+makes to the owner's counters with F() expressions, instead of re-counting
+the whole wardrobe.  WardrobeItem remembers the values it was loaded with
+(WardrobeItem.from_db) so that updates only apply what changed.
+
+Changes that bypass signals, such as QuerySet.update(), let the counters
+drift; the dashboard checks them with WardrobeStats.has_drifted() and falls
+back to a full update_stats(), as does `python manage.py
+recompute_wardrobe_stats`.
+"""
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Outfit, WardrobeCategoryStats, WardrobeItem, WardrobeStats
+
+
+def _price(value):
+    return Decimal(str(value)) if value else Decimal('0')
+
+
+def _recompute(user_id):
+    stats, _ = WardrobeStats.objects.get_or_create(user_id=user_id)
+    stats.update_stats()
+
+
+def apply_stats_delta(user_id, items=0, outfits=0, value=0, categories=(), create=True):
+    """
+    Adds deltas to the user's WardrobeStats.
+
+    ``categories`` holds (category, item delta, times worn delta) triples. A
+    user without stats gets them computed from scratch if ``create`` is set;
+    otherwise (e.g. while the user is being deleted) nothing happens.
+    """
+    categories = [change for change in categories if change[1] or change[2]]
+    if not (items or outfits or value or categories):
+        return
+    try:
+        with transaction.atomic():
+            updated = WardrobeStats.objects.filter(user_id=user_id).update(
+                total_items=F('total_items') + items,
+                total_outfits=F('total_outfits') + outfits,
+                total_value=F('total_value') + value,
+                updated_at=timezone.now(),
+            )
+            if not updated:
+                if create:
+                    _recompute(user_id)
+                return
+            for category, item_delta, worn_delta in categories:
+                updated = WardrobeCategoryStats.objects.filter(user_id=user_id, category=category).update(
+                    item_count=F('item_count') + item_delta,
+                    times_worn=F('times_worn') + worn_delta,
+                )
+                if not updated:
+                    WardrobeCategoryStats.objects.create(
+                        user_id=user_id, category=category, item_count=item_delta, times_worn=worn_delta,
+                    )
+            if categories:
+                most_worn = (
+                    WardrobeCategoryStats.objects.filter(user_id=user_id, item_count__gt=0)
+                    .order_by('-times_worn', 'category')
+                    .values_list('category', flat=True)
+                    .first()
+                )
+                WardrobeStats.objects.filter(user_id=user_id).update(most_worn_category=most_worn)
+    except IntegrityError:
+        # The check constraint of a PositiveIntegerField refused a negative counter,
+        # which means it had drifted already
+        if create or WardrobeStats.objects.filter(user_id=user_id).exists():
+            _recompute(user_id)
+
+
+@receiver(post_save, sender=WardrobeItem)
+def _item_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = instance.stats_snapshot()
+    old = getattr(instance, '_stats_snapshot', None)
+    instance._stats_snapshot = new
+    user_id, category, price, times_worn = new
+
+    if created:
+        apply_stats_delta(user_id, items=1, value=_price(price), categories=[(category, 1, times_worn)])
+    elif old is None:
+        # Not loaded from the database, so there is nothing to compare with
+        _recompute(user_id)
+    elif old[0] != user_id:
+        old_user_id, old_category, old_price, old_times_worn = old
+        apply_stats_delta(
+            old_user_id, items=-1, value=-_price(old_price),
+            categories=[(old_category, -1, -old_times_worn)], create=False,
+        )
+        apply_stats_delta(user_id, items=1, value=_price(price), categories=[(category, 1, times_worn)])
+    elif old != new:
+        _, old_category, old_price, old_times_worn = old
+        if old_category == category:
+            categories = [(category, 0, times_worn - old_times_worn)]
+        else:
+            categories = [(old_category, -1, -old_times_worn), (category, 1, times_worn)]
+        apply_stats_delta(user_id, value=_price(price) - _price(old_price), categories=categories)
+
+
+@receiver(post_delete, sender=WardrobeItem)
+def _item_deleted(sender, instance, **kwargs):
+    user_id, category, price, times_worn = instance.stats_snapshot()
+    apply_stats_delta(
+        user_id, items=-1, value=-_price(price), categories=[(category, -1, -times_worn)], create=False,
+    )
+
+
+@receiver(post_save, sender=Outfit)
+def _outfit_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        apply_stats_delta(instance.user_id, outfits=1)
+
+
+@receiver(post_delete, sender=Outfit)
+def _outfit_deleted(sender, instance, **kwargs):
+    apply_stats_delta(instance.user_id, outfits=-1, create=False)
@@ -1,3 +1,170 @@
-from django.test import TestCase
+import random
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from .models import Outfit, WardrobeCategoryStats, WardrobeItem, WardrobeStats
+
+CATEGORIES = [value for value, _ in WardrobeItem.CLOTHING_CATEGORIES]
+
+
+def _user(name):
+    return get_user_model().objects.create_user(
+        first_name=name, last_name='Test', email=f'{name}@example.com', username=name, password='secret',
+    )
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class IncrementalStatsTests(TestCase):
+    """The counters kept by signals must always equal a fresh update_stats()."""
+
+    def setUp(self):
+        self.users = [_user('alice'), _user('bob')]
+        self.random = random.Random(1234)
+
+    def _state(self, user):
+        stats = WardrobeStats.objects.filter(user=user).first()
+        if stats is None:
+            return None
+        categories = {
+            row.category: (row.item_count, row.times_worn)
+            for row in WardrobeCategoryStats.objects.filter(user=user)
+            # Emptied categories may be kept at zero instead of being deleted
+            if row.item_count or row.times_worn
+        }
+        return (
+            stats.total_items, stats.total_outfits, Decimal(stats.total_value),
+            stats.most_worn_category, categories,
+        )
+
+    def assertStatsConsistent(self, message=''):
+        for user in self.users:
+            incremental = self._state(user)
+            if incremental is None:
+                continue
+            stats = WardrobeStats.objects.get(user=user)
+            self.assertFalse(stats.has_drifted(), message)
+            stats.update_stats()
+            self.assertEqual(incremental, self._state(user), message)
+
+    def _price(self):
+        return self.random.choice([None, Decimal('0'), Decimal(self.random.randint(1, 20000)) / 100])
+
+    def _create(self):
+        WardrobeItem.objects.create(
+            user=self.random.choice(self.users),
+            name='item',
+            category=self.random.choice(CATEGORIES),
+            purchase_price=self._price(),
+            times_worn=self.random.randint(0, 5),
+        )
+
+    def _update(self, item):
+        change = self.random.choice(['category', 'price', 'worn', 'user', 'name', 'several'])
+        if change in ('category', 'several'):
+            item.category = self.random.choice(CATEGORIES)
+        if change in ('price', 'several'):
+            item.purchase_price = self._price()
+        if change in ('worn', 'several'):
+            item.times_worn = self.random.randint(0, 10)
+        if change == 'user':
+            item.user = self.random.choice(self.users)
+        if change == 'name':
+            item.name = 'renamed'
+        if change == 'worn' and self.random.random() < 0.5:
+            item.mark_as_worn()
+        else:
+            item.save()
+
+    def test_random_changes(self):
+        for step in range(300):
+            items = list(WardrobeItem.objects.all())
+            action = self.random.choice(['create', 'create', 'update', 'update', 'delete', 'outfit'])
+            if action == 'create' or not items:
+                self._create()
+            elif action == 'update':
+                self._update(self.random.choice(items))
+            elif action == 'delete':
+                self.random.choice(items).delete()
+            else:
+                outfits = list(Outfit.objects.all())
+                if outfits and self.random.random() < 0.4:
+                    self.random.choice(outfits).delete()
+                else:
+                    Outfit.objects.create(user=self.random.choice(self.users), name='outfit')
+            if step % 10 == 0:
+                self.assertStatsConsistent(f'after step {step} ({action})')
+        self.assertStatsConsistent('at the end')
+
+    def test_saving_a_new_instance_twice(self):
+        item = WardrobeItem.objects.create(user=self.users[0], name='shirt', category='tops', times_worn=1)
+        # The snapshot taken on create lets the second save apply only its own change
+        item.category = 'casual'
+        item.purchase_price = Decimal('12.50')
+        item.save()
+        self.assertStatsConsistent()
+
+    def test_category_move(self):
+        item = WardrobeItem.objects.create(user=self.users[0], name='coat', category='outerwear', times_worn=4)
+        WardrobeItem.objects.create(user=self.users[0], name='jeans', category='bottoms', times_worn=2)
+        item = WardrobeItem.objects.get(pk=item.pk)
+        item.category = 'formal'
+        item.save()
+        self.assertStatsConsistent()
+        categories = self._state(self.users[0])[4]
+        self.assertNotIn('outerwear', categories)
+        self.assertEqual(categories['formal'], (1, 4))
+        self.assertEqual(WardrobeStats.objects.get(user=self.users[0]).most_worn_category, 'formal')
+
+    def test_instances_without_snapshot(self):
+        item = WardrobeItem.objects.create(user=self.users[0], name='dress', category='dresses', times_worn=1)
+        # Deferred fields and hand-built instances cannot be compared with their old values
+        partial = WardrobeItem.objects.only('id', 'name').get(pk=item.pk)
+        partial.name = 'summer dress'
+        partial.save()
+        self.assertStatsConsistent()
+        unloaded = WardrobeItem(
+            pk=item.pk, user=self.users[0], name='dress', category='shoes', times_worn=3,
+            created_at=item.created_at,
+        )
+        unloaded.save()
+        self.assertStatsConsistent()
+
+    def test_delete_all(self):
+        items = [
+            WardrobeItem.objects.create(user=self.users[0], name=str(i), category=category, times_worn=i)
+            for i, category in enumerate(['tops', 'shoes', 'tops'])
+        ]
+        for item in items:
+            WardrobeItem.objects.get(pk=item.pk).delete()
+        self.assertStatsConsistent()
+        self.assertEqual(self._state(self.users[0]), (0, 0, Decimal('0'), None, {}))
+
+    def test_has_drifted(self):
+        WardrobeItem.objects.create(user=self.users[0], name='shirt', category='tops')
+        stats = WardrobeStats.objects.get(user=self.users[0])
+        self.assertFalse(stats.has_drifted())
+        # bulk_create sends no signals
+        WardrobeItem.objects.bulk_create([WardrobeItem(user=self.users[0], name='hat', category='accessories')])
+        stats.refresh_from_db()
+        self.assertTrue(stats.has_drifted())
+        stats.update_stats()
+        self.assertFalse(stats.has_drifted())
+
+    def test_negative_counter_triggers_a_recompute(self):
+        item = WardrobeItem.objects.create(user=self.users[0], name='boots', category='shoes', times_worn=2)
+        # Drift the counter so that deleting the item would take it below zero
+        WardrobeCategoryStats.objects.filter(user=self.users[0], category='shoes').update(item_count=0)
+        WardrobeItem.objects.get(pk=item.pk).delete()
+        self.assertStatsConsistent()
+        self.assertFalse(WardrobeCategoryStats.objects.filter(user=self.users[0], item_count__gt=0).exists())
+
+    def test_deleting_the_user(self):
+        for category in ('shoes', 'tops'):
+            WardrobeItem.objects.create(user=self.users[0], name=category, category=category, times_worn=1)
+        Outfit.objects.create(user=self.users[0], name='outfit')
+        user_id = self.users[0].pk
+        self.users[0].delete()
+        self.assertFalse(WardrobeStats.objects.filter(user_id=user_id).exists())
+        self.assertFalse(WardrobeCategoryStats.objects.exists())
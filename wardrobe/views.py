@@ -3,22 +3,21 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.core.paginator import Paginator
-from django.db.models import Q, Count
+from django.db.models import Q, F
 from django.views.decorators.http import require_POST
 from django.conf import settings
-from .models import WardrobeItem, Outfit, WardrobeStats
+from .models import WardrobeItem, Outfit, WardrobeStats, WardrobeCategoryStats
 from .forms import WardrobeItemForm, OutfitForm, ManualItemForm
 from store.models import Product
 import json
 import random
 
-# Try to import google.generativeai, use dummy if not available
-try:
-    import google.generativeai as genai
-    GENAI_AVAILABLE = True
-except ImportError:
-    GENAI_AVAILABLE = False
-    genai = None
+from greatkart.genai_clients import GENAI_CLIENT_AVAILABLE as GENAI_AVAILABLE, get_genai_client
+from greatkart.ratelimit import rate_limit
+from greatkart.upstream import get_upstream_limiter
+
+# Model used for AI outfit suggestions
+OUTFIT_MODEL_NAME = 'gemini-pro'
 
 def wardrobe_dashboard(request):
     """Main wardrobe dashboard"""
@@ -26,7 +25,8 @@ def wardrobe_dashboard(request):
     if request.user.is_authenticated:
         # Get or create user stats
         stats, created = WardrobeStats.objects.get_or_create(user=request.user)
-        if created or request.GET.get('refresh_stats'):
+        # Stats are kept up to date by signals; recount only on request or if they drifted
+        if created or request.GET.get('refresh_stats') or stats.has_drifted():
             stats.update_stats()
         
         # Get recent items
@@ -39,8 +39,8 @@ def wardrobe_dashboard(request):
         recent_outfits = Outfit.objects.filter(user=request.user)[:4]
         
         # Category breakdown
-        category_stats = WardrobeItem.objects.filter(user=request.user).values('category').annotate(
-            count=Count('id')
+        category_stats = WardrobeCategoryStats.objects.filter(user=request.user, item_count__gt=0).values(
+            'category', count=F('item_count')
         ).order_by('-count')
     else:
         # For anonymous users, create empty data or use session data
@@ -126,10 +126,6 @@ def add_manual_item(request):
             item.source = 'manual_upload'
             item.save()
             
-            # Update stats
-            stats, created = WardrobeStats.objects.get_or_create(user=request.user)
-            stats.update_stats()
-            
             messages.success(request, f'{item.name} has been added to your wardrobe!')
             return redirect('wardrobe:dashboard')
     else:
@@ -185,10 +181,6 @@ def delete_item(request, item_id):
     item_name = item.name
     item.delete()
     
-    # Update stats
-    stats, created = WardrobeStats.objects.get_or_create(user=request.user)
-    stats.update_stats()
-    
     messages.success(request, f'{item_name} has been removed from your wardrobe.')
     return redirect('wardrobe:items')
 
@@ -271,10 +263,6 @@ def create_outfit(request):
             outfit.save()
             form.save_m2m()  # Save many-to-many relationships
             
-            # Update stats
-            stats, created = WardrobeStats.objects.get_or_create(user=request.user)
-            stats.update_stats()
-            
             messages.success(request, f'Outfit "{outfit.name}" has been created!')
             return redirect('wardrobe:outfit_detail', outfit_id=outfit.id)
     else:
@@ -296,6 +284,7 @@ def outfit_detail(request, outfit_id):
     
     return render(request, 'wardrobe/outfit_detail.html', context)
 
+@rate_limit('outfit')
 def generate_outfit_ai(request):
     """AI-powered outfit generation based on user's wardrobe"""
     if not request.user.is_authenticated:
@@ -355,10 +344,13 @@ def generate_ai_outfit_suggestions(user_items, occasion, season, style_preferenc
     if not api_key or api_key == 'place_holder':
         return create_smart_outfit_suggestions(user_items, occasion, season, style_preference)
     
+    # Don't wait on the AI service while its circuit breaker is open
+    if get_upstream_limiter().is_open('outfit'):
+        return create_smart_outfit_suggestions(user_items, occasion, season, style_preference)
+    
     try:
-        # Configure Gemini
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-pro')
+        # Shared Gemini client, reusing its HTTP connections
+        client = get_genai_client(api_key)
         
         # Prepare wardrobe data for AI
         wardrobe_data = []
@@ -410,7 +402,9 @@ def generate_ai_outfit_suggestions(user_items, occasion, season, style_preferenc
         Only return valid JSON, no additional text.
         """
         
-        response = model.generate_content(prompt)
+        response = get_upstream_limiter().call(
+            'outfit', client.models.generate_content, model=OUTFIT_MODEL_NAME, contents=prompt
+        )
         
         # Parse AI response
         ai_response = response.text.strip()
@@ -586,10 +580,6 @@ def save_ai_outfit(request):
         items = WardrobeItem.objects.filter(id__in=item_ids, user=request.user)
         outfit.items.set(items)
         
-        # Update stats
-        stats, created = WardrobeStats.objects.get_or_create(user=request.user)
-        stats.update_stats()
-        
         messages.success(request, f'Outfit "{outfit_name}" has been saved to your collection!')
         return JsonResponse({'success': True, 'outfit_id': outfit.id})
         
@@ -636,10 +626,6 @@ def add_purchase_to_wardrobe(user, product, variations=None, purchase_price=None
             
             item.save()
         
-        # Update user stats
-        stats, created = WardrobeStats.objects.get_or_create(user=user)
-        stats.update_stats()
-        
         return item
         
     except Exception as e: